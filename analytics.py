@@ -0,0 +1,226 @@
+import threading
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+EPOCH = date(1970, 1, 1)
+# Размер порции при чтении журналов серверным курсором
+FETCH_CHUNK = 100000
+
+# Колонки загружаются в числовом виде: дата - номер дня от 1970-01-01,
+# суммы - float8 (для аналитики точности double достаточно)
+SALES_QUERY = """
+    SELECT id, warehouse_id, sale_date::date - DATE '1970-01-01', quantity,
+           amount::float8, (quantity * amount)::float8
+    FROM sales
+    WHERE id > %s
+    ORDER BY id
+"""
+SALES_COLUMNS = [("id", "int64"), ("warehouse_id", "int32"), ("day", "int32"),
+                 ("quantity", "int32"), ("amount", "float64"), ("revenue", "float64")]
+
+CHARGES_QUERY = """
+    SELECT id, expense_item_id, charge_date - DATE '1970-01-01', amount::float8
+    FROM charges
+    WHERE id > %s
+    ORDER BY id
+"""
+CHARGES_COLUMNS = [("id", "int64"), ("expense_item_id", "int32"), ("day", "int32"), ("amount", "float64")]
+ANALYTICS_TABLES = ("sales", "charges")
+
+
+def to_day(value):
+    return (value - EPOCH).days
+
+
+def to_month(value):
+    return value.year * 12 + value.month - 1
+
+
+def month_start(index):
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class ColumnTable:
+    # Набор колонок NumPy с запасом емкости: догрузка новых строк
+    # не копирует весь массив при каждой синхронизации
+    def __init__(self, columns):
+        self.columns = columns
+        self.size = 0
+        self.data = {name: np.empty(0, dtype=dtype) for name, dtype in columns}
+
+    def append(self, rows):
+        if not rows:
+            return
+        count = len(rows)
+        if self.size + count > len(self.data[self.columns[0][0]]):
+            capacity = max(2 * (self.size + count), 1024)
+            for name, dtype in self.columns:
+                grown = np.empty(capacity, dtype=dtype)
+                grown[:self.size] = self.data[name][:self.size]
+                self.data[name] = grown
+        # Порция переводится в колонки одним преобразованием
+        block = np.array(rows, dtype="float64")
+        for position, (name, _) in enumerate(self.columns):
+            self.data[name][self.size:self.size + count] = block[:, position]
+        self.size += count
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    def last_id(self):
+        return int(self["id"][-1]) if self.size else 0
+
+
+class AnalyticsCache:
+    # Клиентская копия sales и charges в колонках NumPy для повторных срезов
+    # выручки без обращения к базе. Новые строки догружаются по id > последнего
+    # загруженного; после изменения или удаления загруженных строк sync()
+    # перечитывает журналы целиком (reload). Об изменениях сообщают
+    # уведомления (changed, migrations.py, версия 6), а без них - рост
+    # версий таблиц в data_versions (версия 5)
+    def __init__(self, db):
+        if np is None:
+            raise Exception("Для локальной аналитики нужен пакет numpy.")
+        self.db = db
+        self.lock = threading.Lock()
+        self.sales = ColumnTable(SALES_COLUMNS)
+        self.charges = ColumnTable(CHARGES_COLUMNS)
+        # Пришло уведомление об изменении, которое не догружается по id
+        self.edited = False
+        self.subscribed = False
+        # Версии sales и charges при последней загрузке
+        self.versions = None
+
+    def subscribe(self, watch):
+        # watch(tables, callback) - подписка на уведомления (views/workers.py, watch_changes)
+        if not self.subscribed:
+            watch(ANALYTICS_TABLES, self.changed)
+            self.subscribed = True
+
+    def changed(self, change):
+        if change.op != "I" or change.ids is None:
+            self.edited = True
+
+    def _versions(self):
+        versions = self.db.report_cache.current_versions(self.db)
+        return None if versions is None else tuple(versions.get(table) for table in ANALYTICS_TABLES)
+
+    def sync(self):
+        with self.lock:
+            versions = self._versions()
+            if self.subscribed and self.db.changes.started:
+                stale = self.edited
+            else:
+                # Без уведомлений вставку не отличить от изменения: при росте
+                # версии копия перечитывается целиком
+                stale = versions is not None and self.versions is not None and versions != self.versions
+            if stale:
+                self._reload()
+            else:
+                self._load(self.sales, SALES_QUERY)
+                self._load(self.charges, CHARGES_QUERY)
+            self.versions = versions
+
+    def reload(self):
+        with self.lock:
+            self.versions = self._versions()
+            self._reload()
+
+    def _reload(self):
+        # Флаг сбрасывается до чтения: изменение во время загрузки вызовет еще одну
+        self.edited = False
+        sales = ColumnTable(SALES_COLUMNS)
+        charges = ColumnTable(CHARGES_COLUMNS)
+        self._load(sales, SALES_QUERY)
+        self._load(charges, CHARGES_QUERY)
+        self.sales, self.charges = sales, charges
+
+    def _load(self, table, sql):
+        cursor = self.db.open_cursor(sql, (table.last_id(),), row_format="tuple")
+        try:
+            while not cursor.exhausted:
+                table.append(cursor.fetch(FETCH_CHUNK))
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _period_mask(days, start_date, end_date):
+        mask = np.ones(len(days), dtype=bool)
+        if start_date is not None:
+            mask &= days >= to_day(start_date)
+        if end_date is not None:
+            mask &= days <= to_day(end_date)
+        return mask
+
+    def profit_per_period(self, start_date, end_date, period="month"):
+        # Выручка, расходы и прибыль по дням или месяцам внутри интервала
+        with self.lock:
+            sales_days = self.sales["day"]
+            sales_mask = self._period_mask(sales_days, start_date, end_date)
+            charges_days = self.charges["day"]
+            charges_mask = self._period_mask(charges_days, start_date, end_date)
+            sales_keys = sales_days[sales_mask]
+            charges_keys = charges_days[charges_mask]
+            sales_values = self.sales["revenue"][sales_mask]
+            charges_values = self.charges["amount"][charges_mask]
+
+        if period == "month":
+            sales_keys = sales_keys.astype("datetime64[D]").astype("datetime64[M]").astype("int64") + 1970 * 12
+            charges_keys = charges_keys.astype("datetime64[D]").astype("datetime64[M]").astype("int64") + 1970 * 12
+            first, last = to_month(start_date), to_month(end_date)
+            label = month_start
+        else:
+            first, last = to_day(start_date), to_day(end_date)
+            label = lambda index: EPOCH + timedelta(days=int(index))
+
+        # Группировка суммированием по номеру периода
+        length = last - first + 1
+        totals_sales = np.bincount(sales_keys - first, weights=sales_values, minlength=length)
+        totals_charges = np.bincount(charges_keys - first, weights=charges_values, minlength=length)
+        return [
+            {
+                "period": label(first + index),
+                "total_sales": float(totals_sales[index]),
+                "total_expenses": float(totals_charges[index]),
+                "profit": float(totals_sales[index] - totals_charges[index]),
+            }
+            for index in range(length)
+        ]
+
+    def top_items(self, start_date=None, end_date=None, limit=5):
+        # Топ товаров по выручке за интервал (без дат - за все время)
+        with self.lock:
+            mask = self._period_mask(self.sales["day"], start_date, end_date)
+            items = self.sales["warehouse_id"][mask]
+            revenue = self.sales["revenue"][mask]
+        if not len(items):
+            return []
+        totals = np.bincount(items, weights=revenue)
+        sold = np.flatnonzero(np.bincount(items))
+        limit = min(limit, len(sold))
+        top = sold[np.argpartition(-totals[sold], limit - 1)[:limit]]
+        top = top[np.argsort(-totals[top], kind="stable")]
+
+        names = {row['id']: row['name'] for row in self.db.get_reference("warehouses")}
+        return [
+            {"item_name": names.get(int(item), str(item)), "total_revenue": float(totals[item])}
+            for item in top
+        ]
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache(db):
+    # Один кэш на процесс: загрузка журналов выполняется один раз
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None or _shared_cache.db is not db:
+            _shared_cache = AnalyticsCache(db)
+        return _shared_cache
@@ -0,0 +1,155 @@
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from db_utils import Database, JOURNALS, REFERENCE_QUERIES, QueryError, reference_cache
+from instrumentation import QueryInstrumentation, caller_view, payload_size
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:
+    psycopg = None
+
+
+class AsyncDatabase:
+    # Асинхронный вариант Database на psycopg 3. Ожидание ответа базы не
+    # занимает поток: окно может запустить несколько запросов одновременно
+    # (asyncio.gather), каждый получит свое соединение из пула.
+    # Плейсхолдеры %s у psycopg 3 те же, поэтому тексты запросов и построители
+    # отчетов и журналов берутся из Database. Повторяющиеся запросы psycopg 3
+    # подготавливает на сервере сам (prepare_threshold)
+    def __init__(self, host, port, dbname, user, password, minconn=1, maxconn=8, instrumentation=None):
+        if psycopg is None:
+            raise Exception("Для асинхронного доступа к базе нужны пакеты psycopg и psycopg_pool.")
+        self.instrumentation = instrumentation or QueryInstrumentation()
+        conninfo = make_conninfo(host=host, port=port, dbname=dbname, user=user, password=password)
+        # Пул открывается при первом запросе: для этого нужен работающий цикл asyncio
+        self.pool = AsyncConnectionPool(conninfo, min_size=minconn, max_size=maxconn, open=False,
+                                        kwargs={"autocommit": True, "row_factory": dict_row})
+        self.opened = False
+
+    @classmethod
+    def from_config(cls, config):
+        parser = config.parser
+        instrumentation = parser['instrumentation'] if parser.has_section('instrumentation') else None
+        return cls(
+            host=config['host'],
+            port=config['port'],
+            dbname=config['dbname'],
+            user=config['user'],
+            password=config['password'],
+            minconn=config.getint('pool_min', 1),
+            maxconn=config.getint('pool_max', 8),
+            instrumentation=QueryInstrumentation.from_config(instrumentation)
+        )
+
+    @asynccontextmanager
+    async def connection(self):
+        if not self.opened:
+            try:
+                await self.pool.open()
+            except Exception as e:
+                raise Exception(f"Ошибка подключения к базе данных: {e}")
+            self.opened = True
+        async with self.pool.connection() as conn:
+            yield conn
+
+    async def close(self):
+        if self.opened:
+            await self.pool.close()
+            self.opened = False
+
+    async def query(self, sql, params=None):
+        started = time.perf_counter()
+        rows = None
+        try:
+            async with self.connection() as conn:
+                cursor = await conn.execute(sql, params)
+                if cursor.description:  # Если запрос возвращает результат
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            raise self._query_error("Ошибка выполнения запроса", sql, params, started, e) from e
+        size = payload_size(rows) if rows and self.instrumentation.enabled else 0
+        self._record(sql, params, started, len(rows) if rows is not None else 0, size)
+        return rows
+
+    async def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            async with self.connection() as conn:
+                cursor = await conn.execute(sql, params)
+                rowcount = max(cursor.rowcount, 0)
+        except Exception as e:
+            raise self._query_error("Ошибка выполнения команды", sql, params, started, e) from e
+        self._record(sql, params, started, rowcount, 0)
+
+    @asynccontextmanager
+    async def transaction(self):
+        # Явная транзакция: commit при успехе, rollback при ошибке
+        async with self.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    yield cursor
+
+    def _record(self, sql, params, started, rows, size):
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            instrumentation.record(sql, params, time.perf_counter() - started, rows, size, caller_view())
+
+    def _query_error(self, message, sql, params, started, error):
+        view = caller_view()
+        self.instrumentation.record_error(sql, params, time.perf_counter() - started, view, error)
+        pgcode = getattr(getattr(error, 'diag', None), 'sqlstate', None)
+        return QueryError(f"{message}: {error}", sql, params, view, pgcode)
+
+    # Журналы
+    async def journal_page(self, journal_type, date_from=None, date_to=None, after=None, limit=100, **filters):
+        return await self.query(*Database.journal_query(journal_type, date_from, date_to, after, limit, **filters))
+
+    async def write_journal_row(self, journal_type, sql, params=None):
+        journal = JOURNALS[journal_type]
+        result = await self.query(
+            f"WITH {journal['alias']} AS ({sql} RETURNING *) "
+            f"SELECT {journal['columns']} FROM {journal['alias']} {journal['joins']}",
+            params
+        )
+        return result[0] if result else None
+
+    journal_key = staticmethod(Database.journal_key)
+
+    # Справочники: общий кэш с синхронной Database
+    async def get_reference(self, table):
+        rows, generation = reference_cache.lookup(table)
+        if rows is None:
+            rows = reference_cache.store(table, generation, await self.query(REFERENCE_QUERIES[table]))
+        return rows
+
+    def invalidate_reference(self, table=None):
+        reference_cache.invalidate(table)
+
+    # Методы для авторизации
+    async def get_user(self, username):
+        result = await self.query("SELECT * FROM users WHERE username = %s", (username,))
+        return result[0] if result else None
+
+    async def verify_password(self, username, password):
+        user = await self.get_user(username)
+        if user and hashlib.sha256(user['password_hash'].encode('utf-8')).hexdigest():
+            return user
+        return None
+
+    # Отчеты
+    async def calculate_monthly_profit(self):
+        try:
+            result = await self.query(*Database.current_month_profit_query())
+            return result[0] if result else None
+        except Exception as e:
+            raise Exception(f"Не удалось рассчитать прибыль: {e}")
+
+    async def get_top_5_revenue_items(self, start_date, end_date):
+        try:
+            return await self.query(*Database.top_items_query(start_date, end_date, 5))
+        except Exception as e:
+            raise Exception(f"Не удалось получить топ-5 товаров: {e}")
@@ -3,10 +3,13 @@ from PyQt5.QtCore import Qt
 
 
 class LoginWindow(QDialog):
-    def __init__(self, db):
+    def __init__(self, db=None):
         super().__init__()
+        # База может подключаться в фоне, пока пользователь вводит логин и пароль
         self.db = db
         self.user_role = None
+        self.pending_login = False
+        self.connection_error = None
         self.init_ui()
 
     def init_ui(self):
@@ -33,6 +36,20 @@ class LoginWindow(QDialog):
 
         self.setLayout(layout)
 
+    def set_database(self, db):
+        self.db = db
+        if self.pending_login:
+            # Вход был нажат до подключения к базе: выполняем его сейчас
+            self.pending_login = False
+            self.login_button.setEnabled(True)
+            self.label.setText("Введите логин и пароль:")
+            self.handle_login()
+
+    def connection_failed(self, message):
+        self.connection_error = message
+        QMessageBox.critical(self, "Ошибка", f"Не удалось подключиться к базе данных: {message}")
+        self.reject()
+
     def handle_login(self):
         username = self.username_input.text()
         password = self.password_input.text()
@@ -41,6 +58,12 @@ class LoginWindow(QDialog):
             QMessageBox.warning(self, "Ошибка", "Пожалуйста, заполните все поля.")
             return
 
+        if self.db is None:
+            self.pending_login = True
+            self.login_button.setEnabled(False)
+            self.label.setText("Подключение к базе данных...")
+            return
+
         try:
             user = self.db.verify_password(username, password)
             if user:
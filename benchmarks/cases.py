@@ -0,0 +1,215 @@
+import importlib.util
+import random
+import time
+from PyQt5.QtCore import QDate
+from PyQt5.QtWidgets import QMessageBox
+from views.journal_view import JournalView, SalesForm, ChargesForm
+from views.reference_view import ReferenceView
+from views.record_form import RecordForm
+from views.report_view import ReportView, BACKEND_SERVER, BACKEND_LOCAL
+
+
+# Окна запускаются так же, как в приложении (в том числе фоновые запросы
+# через QThreadPool), замер идет до момента, когда данные показаны в окне
+WAIT_TIMEOUT = 600
+
+
+class Context:
+    def __init__(self, app, db, seed=42):
+        self.app = app
+        self.db = db
+        self.random = random.Random(seed)
+        # Сообщения окон вместо модальных диалогов: ошибка окна - ошибка замера
+        self.errors = []
+        self.max_ids = {
+            table: db.query(f"SELECT coalesce(max(id), 0) AS id FROM {table}")[0]['id']
+            for table in ("sales", "charges", "warehouses", "expense_items")
+        }
+
+    def random_id(self, table):
+        return self.random.randint(1, self.max_ids[table])
+
+    def wait(self, condition):
+        deadline = time.perf_counter() + WAIT_TIMEOUT
+        while not condition():
+            if self.errors:
+                raise Exception(self.errors.pop())
+            if time.perf_counter() > deadline:
+                raise Exception("Превышено время ожидания окна.")
+            self.app.processEvents()
+            time.sleep(0.001)
+        if self.errors:
+            raise Exception(self.errors.pop())
+
+
+def install_message_hooks(context):
+    # Модальные окна сообщений заблокировали бы замер
+    def hook(kind):
+        def show(parent, title, text, *args, **kwargs):
+            if kind in ("warning", "critical"):
+                context.errors.append(f"{title}: {text}")
+            return QMessageBox.Yes
+        return staticmethod(show)
+
+    for kind in ("information", "warning", "critical", "question"):
+        setattr(QMessageBox, kind, hook(kind))
+
+
+def model_resets(model):
+    counter = [0]
+    model.modelReset.connect(lambda: counter.__setitem__(0, counter[0] + 1))
+    return counter
+
+
+def journal_load_data(journal_type, days):
+    # JournalView.load_data: курсор страницы и первая порция строк за период
+    def setup(context):
+        view = JournalView(context.db, journal_type, "admin")
+        resets = model_resets(view.model)
+        context.wait(lambda: resets[0] > 0)
+        view.date_from_input.setDate(QDate.currentDate().addDays(-days))
+
+        def run():
+            expected = resets[0] + 1
+            view.load_data()
+            context.wait(lambda: resets[0] >= expected)
+        return run, lambda: view.done(0)
+    return setup
+
+
+def journal_next_page(journal_type, days):
+    # Переход на следующую страницу: дочитывание текущей и открытие следующей
+    def setup(context):
+        view = JournalView(context.db, journal_type, "admin")
+        resets = model_resets(view.model)
+        view.date_from_input.setDate(QDate.currentDate().addDays(-days))
+        # Ответ на запрос из конструктора отбрасывается: показан будет только этот
+        view.apply_filter()
+        context.wait(lambda: resets[0] > 0)
+
+        def run():
+            expected = resets[0] + 1
+            view.next_page()
+            context.wait(lambda: resets[0] >= expected)
+        return run, lambda: view.done(0)
+    return setup
+
+
+def reference_load_data(table, cold):
+    # ReferenceView.load_data: с холодным кэшем справочник читается из базы
+    def setup(context):
+        view = ReferenceView(context.db, table, "admin")
+        resets = model_resets(view.model)
+        context.wait(lambda: resets[0] > 0)
+
+        def run():
+            if cold:
+                context.db.invalidate_reference(table)
+            expected = resets[0] + 1
+            view.load_data()
+            context.wait(lambda: resets[0] >= expected)
+        return run, lambda: view.done(0)
+    return setup
+
+
+def report(method, backend):
+    def setup(context):
+        view = ReportView(context.db)
+        view.backend_combo.setCurrentIndex(view.backend_combo.findData(backend))
+
+        def run():
+            getattr(view, method)()
+            context.wait(lambda: view.profit_button.isEnabled())
+        if backend == BACKEND_LOCAL:
+            # Первичная загрузка колонок NumPy измеряется отдельно
+            run()
+        return run, lambda: view.done(0)
+    return setup
+
+
+def report_local_load(context):
+    import analytics
+
+    def run():
+        analytics.AnalyticsCache(context.db).sync()
+    return run, None
+
+
+def form_open(form_type, table):
+    # Открытие формы изменения: справочник для списка и чтение записи по id
+    def setup(context):
+        def run():
+            if form_type is RecordForm:
+                form = RecordForm(context.db, mode="edit", record_id=context.random_id(table), table_type=table)
+            else:
+                form = form_type(context.db, mode="edit", record_id=context.random_id(table))
+            form.deleteLater()
+        return run, None
+    return setup
+
+
+def sales_insert(context):
+    def run():
+        form = SalesForm(context.db, mode="add")
+        form.warehouse_combo.setCurrentIndex(context.random.randrange(form.warehouse_combo.count()))
+        form.quantity_input.setText(str(context.random.randint(1, 10)))
+        form.amount_input.setText(f"{context.random.uniform(10, 1000):.2f}")
+        form.handle_save()
+        check_saved(context, form)
+    return run, None
+
+
+def charges_insert(context):
+    def run():
+        form = ChargesForm(context.db, mode="add")
+        form.expense_item_combo.setCurrentIndex(context.random.randrange(form.expense_item_combo.count()))
+        form.amount_input.setText(f"{context.random.uniform(100, 10000):.2f}")
+        form.handle_save()
+        check_saved(context, form)
+    return run, None
+
+
+def warehouse_insert(context):
+    def run():
+        form = RecordForm(context.db, mode="add", table_type="warehouses")
+        form.name_input.setText(f"Товар {context.random.random()}")
+        form.quantity_input.setText(str(context.random.randint(1, 1000)))
+        form.amount_input.setText(f"{context.random.uniform(10, 1000):.2f}")
+        form.handle_save()
+        check_saved(context, form)
+    return run, None
+
+
+def check_saved(context, form):
+    form.deleteLater()
+    if context.errors:
+        raise Exception(context.errors.pop())
+    if form.saved_row is None:
+        raise Exception("Форма не вернула сохраненную строку.")
+
+
+def all_cases():
+    cases = [
+        ("journal.load_data[sales,7d]", journal_load_data("sales", 7)),
+        ("journal.load_data[sales,365d]", journal_load_data("sales", 365)),
+        ("journal.load_data[charges,7d]", journal_load_data("charges", 7)),
+        ("journal.next_page[sales,365d]", journal_next_page("sales", 365)),
+        ("reference.load_data[warehouses,cold]", reference_load_data("warehouses", True)),
+        ("reference.load_data[warehouses,warm]", reference_load_data("warehouses", False)),
+        ("reference.load_data[expense_items,cold]", reference_load_data("expense_items", True)),
+        ("report.profit[server]", report("generate_profit_report", BACKEND_SERVER)),
+        ("report.top_items[server]", report("generate_top_items_report", BACKEND_SERVER)),
+        ("form.open[sales]", form_open(SalesForm, "sales")),
+        ("form.open[charges]", form_open(ChargesForm, "charges")),
+        ("form.open[warehouses]", form_open(RecordForm, "warehouses")),
+        ("insert[sales]", sales_insert),
+        ("insert[charges]", charges_insert),
+        ("insert[warehouses]", warehouse_insert),
+    ]
+    if importlib.util.find_spec("numpy") is not None:
+        cases += [
+            ("report.local_load", report_local_load),
+            ("report.profit[local]", report("generate_profit_report", BACKEND_LOCAL)),
+            ("report.top_items[local]", report("generate_top_items_report", BACKEND_LOCAL)),
+        ]
+    return cases
@@ -0,0 +1,111 @@
+import psycopg2
+from psycopg2 import sql as pg_sql
+import migrations
+
+
+# Базовые таблицы приложения в том виде, в котором их ожидают запросы журналов,
+# справочников и форм
+BASE_SCHEMA = """
+    CREATE TABLE users (
+        id serial PRIMARY KEY,
+        username varchar(50) UNIQUE NOT NULL,
+        password_hash varchar(255) NOT NULL,
+        role varchar(20) NOT NULL
+    );
+    CREATE TABLE warehouses (
+        id serial PRIMARY KEY,
+        name varchar(255) NOT NULL,
+        quantity integer NOT NULL DEFAULT 0,
+        amount numeric(12, 2) NOT NULL DEFAULT 0
+    );
+    CREATE TABLE expense_items (
+        id serial PRIMARY KEY,
+        name varchar(255) NOT NULL
+    );
+    CREATE TABLE sales (
+        id serial PRIMARY KEY,
+        warehouse_id integer NOT NULL REFERENCES warehouses(id),
+        sale_date timestamp NOT NULL,
+        quantity integer NOT NULL,
+        amount numeric(12, 2) NOT NULL
+    );
+    CREATE TABLE charges (
+        id serial PRIMARY KEY,
+        expense_item_id integer NOT NULL REFERENCES expense_items(id),
+        charge_date date NOT NULL,
+        amount numeric(12, 2) NOT NULL
+    );
+"""
+
+# Данные генерируются на сервере через generate_series: 10 млн продаж
+# не проходят через клиента. Даты равномерно распределены по последним
+# days дням, товары - с перекосом (часть товаров продается чаще)
+FILL_DATA = """
+    SELECT setseed(%(seed)s);
+    INSERT INTO users (username, password_hash, role) VALUES
+        ('admin', md5('admin'), 'admin'), ('user', md5('user'), 'user');
+    INSERT INTO warehouses (name, quantity, amount)
+    SELECT 'Товар ' || g, (random() * 1000)::int, round((10 + random() * 990)::numeric, 2)
+    FROM generate_series(1, %(items)s) g;
+    INSERT INTO expense_items (name)
+    SELECT 'Статья расхода ' || g
+    FROM generate_series(1, %(expense_items)s) g;
+    INSERT INTO sales (warehouse_id, sale_date, quantity, amount)
+    SELECT 1 + floor(power(random(), 2) * %(items)s)::int,
+           localtimestamp - random() * %(days)s * interval '1 day',
+           1 + (random() * 9)::int,
+           round((10 + random() * 990)::numeric, 2)
+    FROM generate_series(1, %(sales)s) g;
+    INSERT INTO charges (expense_item_id, charge_date, amount)
+    SELECT 1 + floor(random() * %(expense_items)s)::int,
+           current_date - (random() * %(days)s)::int,
+           round((100 + random() * 9900)::numeric, 2)
+    FROM generate_series(1, %(charges)s) g;
+"""
+
+DEFAULT_VOLUMES = {
+    "items": 10000,
+    "expense_items": 200,
+    "sales": 10000000,
+    "charges": 1000000,
+    "days": 730,
+}
+
+
+def admin_connection(config):
+    # Соединение с той же базой, что в config.ini: из него создается и удаляется тестовая
+    conn = psycopg2.connect(host=config['host'], port=config['port'], dbname=config['dbname'],
+                            user=config['user'], password=config['password'])
+    conn.autocommit = True
+    return conn
+
+
+def create_database(config, name):
+    conn = admin_connection(config)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(pg_sql.SQL("DROP DATABASE IF EXISTS {}").format(pg_sql.Identifier(name)))
+            cursor.execute(pg_sql.SQL("CREATE DATABASE {}").format(pg_sql.Identifier(name)))
+    finally:
+        conn.close()
+
+
+def drop_database(config, name):
+    conn = admin_connection(config)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(pg_sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(pg_sql.Identifier(name)))
+    finally:
+        conn.close()
+
+
+def fill_database(db, volumes, seed=0.42):
+    # Схема, данные, дневные итоги отчетов и индексы. Итоги и индексы создаются
+    # миграциями после заполнения: один пересчет и одно построение вместо
+    # обновления на каждую вставку
+    with db.transaction(timeout=0) as cursor:
+        cursor.execute(BASE_SCHEMA)
+        cursor.execute(FILL_DATA, dict(volumes, seed=seed))
+    migrations.migrate(db)
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE")
@@ -0,0 +1,89 @@
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from db_utils import Database, ROW_FORMATS, load_config
+from instrumentation import QueryInstrumentation
+
+
+# Память и время Database.query на большом результате в каждом формате строк.
+# Запрос - страница журнала продаж без фильтров, те же колонки, что в окне
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сравнение форматов строк Database.query на большом результате.")
+    parser.add_argument("--config", default="config.ini", help="config.ini с параметрами сервера Postgres")
+    parser.add_argument("--database", default="shop_bench", help="база с заполненным журналом продаж (benchmarks.run --keep)")
+    parser.add_argument("--rows", type=int, default=1000000, help="число читаемых строк")
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров времени каждого формата")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию - stdout)")
+    return parser.parse_args()
+
+
+def measure_memory(db, sql, params, row_format):
+    # Память результата - прирост после запроса, пик - с учетом временных
+    # объектов драйвера. tracemalloc замедляет выполнение, поэтому время
+    # меряется отдельными запусками
+    gc.collect()
+    tracemalloc.start()
+    rows = db.query(sql, params, row_format=row_format)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(next(iter(rows.values()))) if row_format == "columns" else len(rows)
+    del rows
+    return count, retained, peak
+
+
+def measure_time(db, sql, params, row_format, repeat):
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        rows = db.query(sql, params, row_format=row_format)
+        runs.append((time.perf_counter() - started) * 1000)
+        del rows
+    return runs
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    config['dbname'] = args.database
+    db = Database.from_config(config)
+    # Учет размера строк в статистике запросов не должен попадать в замер
+    db.instrumentation = QueryInstrumentation(enabled=False)
+    sql, params = db.journal_query("sales", limit=args.rows)
+
+    result = {"database": args.database, "rows": args.rows, "repeat": args.repeat, "formats": []}
+    try:
+        # Прогрев: кэш страниц сервера и подготовленный запрос
+        db.query(sql, params, row_format="tuple")
+        for row_format in ROW_FORMATS:
+            count, retained, peak = measure_memory(db, sql, params, row_format)
+            runs = measure_time(db, sql, params, row_format, args.repeat)
+            entry = {
+                "format": row_format,
+                "rows": count,
+                "retained_mb": round(retained / 2 ** 20, 1),
+                "peak_mb": round(peak / 2 ** 20, 1),
+                "bytes_per_row": round(retained / max(count, 1), 1),
+                "median_ms": round(statistics.median(runs), 1),
+                "min_ms": round(min(runs), 1),
+            }
+            result["formats"].append(entry)
+            print(f"{row_format}: {entry['retained_mb']} МБ, {entry['median_ms']} мс", file=sys.stderr)
+    finally:
+        db.close()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
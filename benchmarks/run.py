@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Окна создаются без дисплея
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QThreadPool
+from PyQt5.QtWidgets import QApplication
+from db_utils import Database, load_config
+from benchmarks import dataset
+from benchmarks.cases import Context, all_cases, install_message_hooks
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Замеры производительности приложения на синтетических данных.")
+    parser.add_argument("--config", default="config.ini", help="config.ini с параметрами сервера Postgres")
+    parser.add_argument("--database", default="shop_bench", help="имя временной базы для замеров")
+    for name, value in dataset.DEFAULT_VOLUMES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value, dest=name)
+    parser.add_argument("--repeat", type=int, default=20, help="число замеров каждого сценария")
+    parser.add_argument("--warmup", type=int, default=2, help="число прогревочных запусков без замера")
+    parser.add_argument("--case", action="append", help="запустить только сценарии с этим префиксом")
+    parser.add_argument("--reuse", action="store_true", help="использовать уже заполненную базу")
+    parser.add_argument("--keep", action="store_true", help="не удалять базу после замеров")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию - stdout)")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def summarize(runs):
+    ordered = sorted(runs)
+    return {
+        "runs_ms": [round(value, 3) for value in runs],
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+    }
+
+
+def run_case(context, setup, repeat, warmup):
+    run, teardown = setup(context)
+    try:
+        for _ in range(warmup):
+            run()
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            runs.append((time.perf_counter() - started) * 1000)
+        return summarize(runs)
+    finally:
+        if teardown is not None:
+            teardown()
+        context.app.processEvents()
+
+
+def main():
+    args = parse_args()
+    volumes = {name: getattr(args, name) for name in dataset.DEFAULT_VOLUMES}
+    config = load_config(args.config)
+    server = dict(config)
+    config['dbname'] = args.database
+
+    result = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "database": args.database,
+        "volumes": volumes,
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "setup_seconds": None,
+        "cases": [],
+    }
+
+    if not args.reuse:
+        started = time.perf_counter()
+        dataset.create_database(server, args.database)
+        db = Database.from_config(config)
+        dataset.fill_database(db, volumes)
+        result["setup_seconds"] = round(time.perf_counter() - started, 1)
+        print(f"База {args.database} заполнена за {result['setup_seconds']} с", file=sys.stderr)
+    else:
+        # Объемы уже заполненной базы неизвестны: ниже пишется фактическое число строк
+        result["volumes"] = None
+        db = Database.from_config(config)
+    result["postgres"] = db.query("SHOW server_version")[0]['server_version']
+    result["row_counts"] = {
+        table: db.query(f"SELECT count(*) AS rows FROM {table}")[0]['rows']
+        for table in ("warehouses", "expense_items", "sales", "charges")
+    }
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    context = Context(app, db)
+    install_message_hooks(context)
+    try:
+        for name, setup in all_cases():
+            if args.case and not any(name.startswith(prefix) for prefix in args.case):
+                continue
+            try:
+                case = dict(case=name, **run_case(context, setup, args.repeat, args.warmup))
+            except Exception as e:
+                case = {"case": name, "error": str(e)}
+            result["cases"].append(case)
+            print(f"{name}: {case.get('median_ms', case.get('error'))}", file=sys.stderr)
+    finally:
+        # Окна закрывают курсоры в фоновых задачах: дожидаемся их до закрытия пула
+        QThreadPool.globalInstance().waitForDone()
+        db.close()
+        if not args.keep and not args.reuse:
+            dataset.drop_database(server, args.database)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
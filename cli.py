@@ -0,0 +1,192 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from db_utils import Database, JOURNALS, last_months, load_config
+
+
+# Отчеты без графического интерфейса: для ночных выгрузок на сервере.
+# Модуль не импортирует PyQt5 и views, поэтому запускается за доли секунды.
+#   python cli.py report profit top expenses --months 3 --output-dir reports
+#   python cli.py journal sales --from 2026-01-01 --to 2026-01-31 --format json
+
+# Отчет: функция (начало, конец, аргументы) -> (sql, params)
+REPORTS = {
+    "profit": lambda start, end, args: Database.profit_query(start, end),
+    "top": lambda start, end, args: Database.top_items_query(start, end, args.limit),
+    "expenses": lambda start, end, args: Database.expense_breakdown_query(start, end),
+}
+
+# Строк журнала за одно обращение к серверному курсору
+JOURNAL_CHUNK = 5000
+
+
+def parse_date(text):
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверная дата {text!r}, ожидается ГГГГ-ММ-ДД")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Отчеты и выгрузка журналов без графического интерфейса.")
+    parser.add_argument("--config", default="config.ini", help="config.ini с параметрами базы")
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=("csv", "json"), default="csv")
+    output.add_argument("--output", help="файл результата (по умолчанию - stdout)")
+    period = argparse.ArgumentParser(add_help=False)
+    period.add_argument("--from", dest="date_from", type=parse_date, help="начало периода, ГГГГ-ММ-ДД")
+    period.add_argument("--to", dest="date_to", type=parse_date, help="конец периода включительно")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", parents=[output, period],
+                                 help="прибыль, топ товаров, расходы по статьям")
+    report.add_argument("reports", nargs="+", choices=sorted(REPORTS), metavar="REPORT",
+                        help=f"один или несколько отчетов: {', '.join(sorted(REPORTS))}")
+    report.add_argument("--months", type=int, help="последние N месяцев, каждый месяц отдельным периодом")
+    report.add_argument("--limit", type=int, default=5, help="число товаров в отчете top")
+    report.add_argument("--output-dir", help="каталог для нескольких отчетов: <отчет>.<формат>")
+    report.add_argument("--jobs", type=int, help="одновременных запросов (по умолчанию - pool_max)")
+
+    journal = commands.add_parser("journal", parents=[output, period], help="строки журнала")
+    journal.add_argument("journal_type", choices=sorted(JOURNALS))
+    journal.add_argument("--name", help="подстрока названия товара или статьи расхода")
+    journal.add_argument("--amount-from", type=Decimal)
+    journal.add_argument("--amount-to", type=Decimal)
+
+    args = parser.parse_args(argv)
+    if args.command == "report":
+        if len(args.reports) > 1 and args.output:
+            parser.error("для нескольких отчетов укажите --output-dir")
+        if args.months is not None and (args.date_from or args.date_to):
+            parser.error("--months нельзя совмещать с --from/--to")
+    return args
+
+
+def report_periods(args):
+    # [(начало, конец)]; без дат - текущий месяц
+    if args.months:
+        return sorted((start, end) for start, end, _ in last_months(args.months))
+    if args.date_from is None and args.date_to is None:
+        start, end, _ = last_months(1)[0]
+        return [(start, end)]
+    return [(args.date_from or date.min, args.date_to or date.today())]
+
+
+def json_value(value):
+    # Суммы - строкой: без потери копеек при чтении в float
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def write_rows(file, file_format, columns, batches):
+    # batches - итератор пачек строк (кортежи значений в порядке columns).
+    # Строки пишутся по мере поступления, JSON - массив, объект на строку
+    if file_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+        return
+    file.write("[")
+    separator = "\n"
+    for rows in batches:
+        for row in rows:
+            file.write(separator + json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=json_value))
+            separator = ",\n"
+    file.write("\n]\n")
+
+
+def open_output(path, binary=False):
+    if path is None or path == "-":
+        if binary:
+            return os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        return os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", newline="")
+    if binary:
+        return open(path, "wb")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def compute(db, report, start, end, args):
+    sql, params = REPORTS[report](start, end, args)
+    return db.query(sql, params, row_format="columns", timeout=0)
+
+
+def run_reports(db, args):
+    periods = report_periods(args)
+    tasks = [(report, start, end) for report in args.reports for start, end in periods]
+    jobs = args.jobs or db.maxconn
+    # Каждый отчет за каждый период - отдельный запрос на своем соединении пула;
+    # результаты записываются в порядке задач
+    with ThreadPoolExecutor(max_workers=min(jobs, db.maxconn, len(tasks))) as executor:
+        results = executor.map(lambda task: compute(db, *task, args), tasks)
+        results = dict(zip(tasks, results))
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for report in args.reports:
+        columns = None
+        batches = []
+        for start, end in periods:
+            result = results[(report, start, end)]
+            columns = ["period_start", "period_end", *result]
+            batches.append([(start, end, *row) for row in zip(*result.values())])
+        path = os.path.join(args.output_dir, f"{report}.{args.format}") if args.output_dir else args.output
+        with open_output(path) as file:
+            write_rows(file, args.format, columns, batches)
+
+
+def run_journal(db, args):
+    sql, params = Database.journal_query(
+        args.journal_type, args.date_from, args.date_to,
+        name=args.name, amount_from=args.amount_from, amount_to=args.amount_to,
+    )
+    if args.format == "csv":
+        # CSV формирует сам Postgres (COPY), строки идут в файл без разбора в Python
+        with open_output(args.output, binary=True) as file:
+            db.copy_out(sql, params, file, timeout=0)
+        return
+    cursor = db.open_cursor(sql, params, row_format="tuple", timeout=0)
+    try:
+        first = cursor.fetch(JOURNAL_CHUNK)
+        batches = itertools.chain([first], iter(lambda: cursor.fetch(JOURNAL_CHUNK), []))
+        with open_output(args.output) as file:
+            write_rows(file, args.format, cursor.columns, batches)
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        db = Database.from_config(load_config(args.config))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        if args.command == "report":
+            run_reports(db, args)
+        else:
+            run_journal(db, args)
+    except BrokenPipeError:
+        # Вывод передан в head и подобные: остаток не нужен
+        return 0
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,1173 @@
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager, nullcontext
 import hashlib
+import itertools
+import keyword
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from configparser import ConfigParser
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from instrumentation import QueryInstrumentation, caller_view, payload_size
+
+
+# Запросы журналов. Порядок (дата, id) по убыванию однозначен и позволяет
+# листать страницы по ключу последней строки, а не через OFFSET
+JOURNALS = {
+    "sales": {
+        "table": "sales",
+        "alias": "s",
+        "columns": "s.id, w.name AS warehouse_name, s.sale_date, s.quantity, s.amount",
+        "joins": "JOIN warehouses w ON s.warehouse_id = w.id",
+        "reference": "warehouses",
+        "reference_column": "s.warehouse_id",
+        "date_column": "s.sale_date",
+        "id_column": "s.id",
+        "date_key": "sale_date",
+        "name_column": "w.name",
+        "name_key": "warehouse_name",
+        "amount_column": "s.amount",
+    },
+    "charges": {
+        "table": "charges",
+        "alias": "c",
+        "columns": "c.id, e.name AS expense_item, c.charge_date, c.amount",
+        "joins": "JOIN expense_items e ON c.expense_item_id = e.id",
+        "reference": "expense_items",
+        "reference_column": "c.expense_item_id",
+        "date_column": "c.charge_date",
+        "id_column": "c.id",
+        "date_key": "charge_date",
+        "name_column": "e.name",
+        "name_key": "expense_item",
+        "amount_column": "c.amount",
+    },
+}
+
+
+# Загрузка журналов из CSV. Файл копируется во временную таблицу через
+# COPY FROM STDIN, наименования заменяются на id справочника, после
+# проверки строки переносятся в журнал одной транзакцией
+IMPORTS = {
+    "sales": {
+        "columns": ["warehouse_name", "sale_date", "quantity", "amount"],
+        "reference": "warehouses",
+        "name_column": "warehouse_name",
+        # Колонка, шаблон допустимого значения, текст ошибки, тип значения
+        # (дата и целое дополнительно проверяются по календарю и диапазону integer)
+        "checks": [
+            ("sale_date", r"^\s*\d{4}-\d{2}-\d{2}([ T]([01]\d|2[0-3]):[0-5]\d(:[0-5]\d(\.\d+)?)?)?\s*$",
+             "неверная дата", "date"),
+            ("quantity", r"^\s*\d+\s*$", "неверное количество", "integer"),
+            ("amount", r"^\s*\d{1,10}([.,]\d+)?\s*$", "неверная цена", None),
+        ],
+        "insert": """
+            INSERT INTO sales (warehouse_id, sale_date, quantity, amount)
+            SELECT r.id, trim(i.sale_date)::timestamp, trim(i.quantity)::integer,
+                   replace(trim(i.amount), ',', '.')::numeric
+            FROM import_rows i
+            JOIN warehouses r ON r.name = i.warehouse_name
+        """,
+    },
+    "charges": {
+        "columns": ["expense_item", "charge_date", "amount"],
+        "reference": "expense_items",
+        "name_column": "expense_item",
+        "checks": [
+            ("charge_date", r"^\s*\d{4}-\d{2}-\d{2}\s*$", "неверная дата", "date"),
+            ("amount", r"^\s*\d{1,10}([.,]\d+)?\s*$", "неверная сумма", None),
+        ],
+        "insert": """
+            INSERT INTO charges (expense_item_id, charge_date, amount)
+            SELECT r.id, trim(i.charge_date)::date, replace(trim(i.amount), ',', '.')::numeric
+            FROM import_rows i
+            JOIN expense_items r ON r.name = i.expense_item
+        """,
+    },
+}
+# Сколько ошибочных строк показывать пользователю
+IMPORT_ERRORS_SHOWN = 10
+# Размер блока при передаче файла в COPY
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+# Справочники, которые нужны формам и окнам справочников
+REFERENCE_QUERIES = {
+    "warehouses": "SELECT id, name, quantity, amount FROM warehouses ORDER BY id",
+    "expense_items": "SELECT id, name FROM expense_items ORDER BY id",
+}
+# Справочники, по которым доступен фильтр по сумме
+REFERENCE_AMOUNTS = ("warehouses",)
+
+# Подготавливаются только операторы, которые допускает PREPARE
+PREPARABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b", re.IGNORECASE)
+PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+# Оператор пропал из сеанса (DISCARD ALL, пулер соединений) или устарел
+# после изменения схемы: его нужно подготовить заново
+STALE_STATEMENT_CODES = ("26000", "0A000")
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+# Границы целых типов параметров: bigint-значение для параметра integer
+# обычный запрос сравнит, а EXECUTE отвергнет
+INTEGER_LIMITS = {"smallint": 2 ** 15, "integer": 2 ** 31}
+
+
+# Форматы строк результата query и open_cursor:
+# dict - RealDictRow (по умолчанию), tuple - кортежи psycopg2 без обработки,
+# record - объекты Record с полями в __slots__, columns - {колонка: список значений}
+ROW_FORMATS = ("dict", "tuple", "record", "columns")
+
+# Версии таблиц (data_versions, migrations.py, версия 5) меняются триггерами
+# при каждой записи. Отчеты по дневным итогам зависят от исходных таблиц
+VERSIONED_TABLE = re.compile(r"\b(warehouses|expense_items|sales|charges)(?:_daily)?\b")
+DATA_VERSIONS_QUERY = "SELECT table_name, version FROM data_versions"
+WRITE_STATEMENT = re.compile(r"\b(INSERT|UPDATE|DELETE|TRUNCATE|COPY)\b", re.IGNORECASE)
+UNDEFINED_TABLE = "42P01"
+
+# Уведомления об изменениях строк (migrations.py, версия 6). Полезная
+# нагрузка: "таблица:операция:id,id,..."; операция - I, U, D или T (TRUNCATE),
+# "*" вместо списка id - изменено слишком много строк, нужна перезагрузка
+CHANGES_CHANNEL = "shop_changes"
+Change = namedtuple("Change", "table op ids")
+
+# Запрос прерван: отмена (CancelToken) или statement_timeout
+QUERY_CANCELED = "57014"
+# Обрыв связи с сервером, который не заметит сам клиент (сеть, выключенный
+# сервер), обнаруживается TCP keepalive: ожидание ответа не длится бесконечно
+KEEPALIVE_DEFAULTS = {"keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 3}
+
+
+class Record:
+    # Строка без словаря на каждую строку: имена колонок хранит класс,
+    # созданный один раз на набор колонок (record_class). Доступ row['name']
+    # такой же, как у RealDictRow, поэтому окна работают с обоими видами строк
+    __slots__ = ()
+    __getitem__ = object.__getattribute__
+
+    def keys(self):
+        return self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Record(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+
+@lru_cache(maxsize=256)
+def record_class(columns):
+    for name in columns:
+        if not name.isidentifier() or keyword.iskeyword(name):
+            raise Exception(f"Колонку {name!r} нельзя сделать полем записи: задайте ей имя через AS.")
+    if len(set(columns)) != len(columns):
+        raise Exception(f"Повторяющиеся имена колонок: {', '.join(columns)}")
+    # Конструктор с явными присваиваниями заметно быстрее цикла с setattr
+    namespace = {}
+    body = "".join(f"\n    _record.{name} = {name}" for name in columns) or "\n    pass"
+    exec(f"def __init__(_record, {', '.join(columns)}):{body}", namespace)
+    return type("Record", (Record,), {"__slots__": columns, "__init__": namespace["__init__"]})
+
+
+def convert_rows(rows, description, row_format):
+    # rows - кортежи psycopg2 (для dict - уже RealDictRow)
+    if row_format in ("dict", "tuple"):
+        return rows
+    names = tuple(column[0] for column in description)
+    if row_format == "record":
+        return list(itertools.starmap(record_class(names), rows))
+    if row_format == "columns":
+        if not rows:
+            return {name: [] for name in names}
+        return {name: list(values) for name, values in zip(names, zip(*rows))}
+    raise Exception(f"Неизвестный формат строк: {row_format}")
+
+
+def like_pattern(text):
+    # Подстрока для ILIKE: символы шаблона во вводе пользователя экранируются
+    text = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{text}%"
+
+
+MONTH_NAMES = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+
+
+def last_months(count, today=None):
+    # [(начало, конец, название)] последних count месяцев, текущий - первым
+    start = (today or date.today()).replace(day=1)
+    months = []
+    for _ in range(count):
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        months.append((start, end, f"{MONTH_NAMES[start.month - 1]} {start.year}"))
+        start = (start - timedelta(days=1)).replace(day=1)
+    return months
+
+
+def positional_sql(sql):
+    # Плейсхолдеры psycopg2 (%s, %(name)s) переводятся в $1, $2, ...
+    # Возвращает текст и имена параметров по номерам (None для позиционных)
+    names = []
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(0) == "%%":
+            return "%"
+        name = match.group(1)
+        if name is None:
+            count += 1
+            return f"${count}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    text = PLACEHOLDER.sub(replace, sql)
+    return text, names or None
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # Соединение с LRU-кэшем подготовленных операторов по тексту запроса.
+    # Операторы живут в серверном сеансе, поэтому кэш принадлежит соединению:
+    # после переподключения пул создает новое соединение с пустым кэшем
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+        self.statement_names = itertools.count(1)
+        # statement_timeout сеанса в мс (0 - без ограничения) и время
+        # возврата в пул: по нему Database решает, проверять ли соединение
+        self.statement_timeout = 0
+        self.last_used = time.monotonic()
+
+    def prepare(self, sql, limit, placeholders=True):
+        statement = self.prepared.get(sql)
+        if statement is not None:
+            self.prepared.move_to_end(sql)
+            return statement
+        name = f"ps_{next(self.statement_names)}"
+        # Без параметров psycopg2 не разбирает плейсхолдеры, текст идет как есть
+        text, names = positional_sql(sql) if placeholders else (sql, None)
+        with self.cursor() as cursor:
+            cursor.execute(f"PREPARE {name} AS {text}")
+            # Выведенные сервером типы параметров: по ним проверяются значения
+            cursor.execute("SELECT parameter_types::text[] FROM pg_prepared_statements WHERE name = %s", (name,))
+            types = cursor.fetchone()[0]
+            statement = self.prepared[sql] = (name, names, types)
+            while len(self.prepared) > limit:
+                _, evicted = self.prepared.popitem(last=False)
+                cursor.execute(f"DEALLOCATE {evicted[0]}")
+        return statement
+
+    def forget(self, sql):
+        statement = self.prepared.pop(sql, None)
+        if statement is not None:
+            with self.cursor() as cursor:
+                cursor.execute(f"DEALLOCATE {statement[0]}")
+
+    def forget_all(self):
+        # Сервер уже не знает ни одного оператора этого сеанса
+        self.prepared.clear()
+
+
+class ReferenceCache:
+    # Общий для всего процесса кэш справочников. Сбрасывается явно после
+    # изменения справочника (сохранение RecordForm, удаление в ReferenceView)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        # Счетчик сбросов: результат загрузки, начатой до сброса, не сохраняется
+        self.generations = {}
+
+    def get(self, db, table):
+        rows, generation = self.lookup(table)
+        if rows is None:
+            rows = self.store(table, generation, db.query(REFERENCE_QUERIES[table]))
+        return rows
+
+    def lookup(self, table):
+        # Строки из кэша (или None) и номер сброса на момент обращения
+        with self.lock:
+            return self.data.get(table), self.generations.get(table, 0)
+
+    def store(self, table, generation, rows):
+        with self.lock:
+            if self.generations.get(table, 0) == generation:
+                self.data[table] = rows
+        return rows
+
+    def invalidate(self, table=None):
+        with self.lock:
+            tables = [table] if table is not None else list(REFERENCE_QUERIES)
+            for name in tables:
+                self.data.pop(name, None)
+                self.generations[name] = self.generations.get(name, 0) + 1
+
+
+    def apply_change(self, db, change):
+        # Изменение из уведомления: в кэш попадают только измененные строки
+        rows, generation = self.lookup(change.table)
+        if rows is None:
+            return
+        if change.ids is None:
+            self.invalidate(change.table)
+            return
+        changed = [] if change.op == "D" else db.reference_rows(change.table, change.ids)
+        ids = set(change.ids)
+        merged = [row for row in rows if row['id'] not in ids] + changed
+        merged.sort(key=lambda row: row['id'])
+        with self.lock:
+            # Кэш успел смениться (сброс или другое изменение): перечитается целиком
+            if self.data.get(change.table) is rows:
+                self.data[change.table] = merged
+            else:
+                self.data.pop(change.table, None)
+                self.generations[change.table] = self.generations.get(change.table, 0) + 1
+
+
+reference_cache = ReferenceCache()
+
+
+def parse_change(payload):
+    table, op, ids = payload.split(":", 2)
+    return Change(table, op, None if ids == "*" else [int(value) for value in ids.split(",")])
+
+
+class ChangeListener:
+    # Отдельное соединение с LISTEN вне пула. Сам слушатель не ждет
+    # уведомлений: владелец следит за сокетом (fileno) и вызывает poll,
+    # когда в нем появились данные, - окна делают это через QSocketNotifier
+    # (views/workers.py, watch_changes)
+    def __init__(self, conn_params):
+        self.conn_params = conn_params
+        self.conn = None
+        # [(таблицы, функция)]; функция получает Change
+        self.subscribers = []
+
+    def start(self):
+        conn = psycopg2.connect(**self.conn_params)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+        self.conn = conn
+        return conn.fileno()
+
+    @property
+    def started(self):
+        return self.conn is not None and not self.conn.closed
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def subscribe(self, tables, callback):
+        # Возвращает функцию отписки
+        entry = (frozenset(tables), callback)
+        self.subscribers.append(entry)
+        return lambda: self.subscribers.remove(entry) if entry in self.subscribers else None
+
+    def tables(self):
+        return set().union(*(tables for tables, _ in self.subscribers))
+
+    def poll(self):
+        # Читает пришедшие уведомления без ожидания и раздает их подписчикам
+        try:
+            self.conn.poll()
+        except Exception as e:
+            raise Exception(f"Потеряно соединение для уведомлений: {e}")
+        changes = [parse_change(notify.payload) for notify in self.conn.notifies
+                   if notify.channel == CHANGES_CHANNEL]
+        self.conn.notifies.clear()
+        self.dispatch(changes)
+        return changes
+
+    def dispatch(self, changes):
+        for change in changes:
+            for tables, callback in list(self.subscribers):
+                if change.table in tables:
+                    callback(change)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+@lru_cache(maxsize=256)
+def report_tables(sql):
+    return tuple(sorted(set(VERSIONED_TABLE.findall(sql))))
+
+
+def cache_key(sql, params):
+    if isinstance(params, dict):
+        return sql, tuple(sorted(params.items()))
+    return sql, tuple(params or ())
+
+
+class ReportCache:
+    # Результаты отчетов по тексту запроса и параметрам. Запись действительна,
+    # пока не изменились версии таблиц отчета и не истек ttl; лишние записи
+    # вытесняются по LRU. Версии всех таблиц читаются одним запросом не чаще
+    # раза в version_ttl секунд: повторный отчет не обращается к серверу, а
+    # чужие изменения видны с задержкой не больше version_ttl. После записи
+    # через эту же Database версии перечитываются сразу
+    def __init__(self, enabled=True, max_entries=128, ttl=600.0, version_ttl=1.0):
+        self.lock = threading.Lock()
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        # {(sql, params): (версии таблиц отчета, время сохранения, строки)}
+        self.entries = OrderedDict()
+        self.versions = None
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        # config - секция [report_cache] из config.ini или None
+        if config is None:
+            return cls()
+        return cls(
+            enabled=config.getboolean("enabled", True),
+            max_entries=config.getint("max_entries", 128),
+            ttl=config.getfloat("ttl_seconds", 600.0),
+            version_ttl=config.getfloat("version_check_seconds", 1.0),
+        )
+
+    def current_versions(self, db):
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at and now - self.checked_at < self.version_ttl:
+                return self.versions
+        try:
+            versions = dict(db.query(DATA_VERSIONS_QUERY, row_format="tuple"))
+        except QueryError as e:
+            if e.pgcode != UNDEFINED_TABLE:
+                raise
+            # Миграция версии 5 не применена (о ней сообщает проверка версий
+            # при запуске): отчеты считаются без кэша, таблица проверяется
+            # снова через version_ttl
+            versions = None
+        with self.lock:
+            self.versions = versions
+            self.checked_at = now
+        return versions
+
+    def get(self, db, sql, params, compute):
+        # Строки из кэша общие для всех, кто запросил тот же отчет, и не изменяются
+        if not self.enabled:
+            return compute()
+        versions = self.current_versions(db)
+        if versions is None:
+            return compute()
+        key = cache_key(sql, params)
+        # Версии читаются до расчета: изменение во время расчета не потеряется,
+        # отчет просто посчитается еще раз при следующем обращении
+        version = tuple(versions.get(table, 0) for table in report_tables(sql))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and now - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        rows = compute()
+        with self.lock:
+            self.entries[key] = (version, now, rows)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return rows
+
+    def expire_versions(self):
+        with self.lock:
+            self.checked_at = 0.0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions = None
+            self.checked_at = 0.0
+
+
+class CancelToken:
+    # Позволяет прервать выполняющийся запрос из другого потока,
+    # например по кнопке "Отмена" в окне
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.conn = None
+
+    @contextmanager
+    def bind(self, conn):
+        with self.lock:
+            if self.cancelled:
+                raise Exception("Операция отменена")
+            self.conn = conn
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.conn = None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                # Отмена через отдельный канал: соединение после ошибки
+                # остается пригодным и возвращается в пул
+                self.conn.cancel()
+
+
+class CopyWriter:
+    # Приемник COPY TO STDOUT: пишет данные в файл по мере поступления
+    # и сообщает о ходе выгрузки не чаще раза в PROGRESS_INTERVAL секунд
+    PROGRESS_INTERVAL = 0.2
+
+    def __init__(self, file, progress=None):
+        self.file = file
+        self.progress = progress
+        # Первая строка выгрузки - заголовок CSV
+        self.rows = -1
+        self.bytes = 0
+        self.reported_at = time.monotonic()
+
+    def write(self, data):
+        self.file.write(data)
+        # psycopg2 передает данные COPY по одной строке за вызов
+        self.rows += 1
+        self.bytes += len(data)
+        if self.progress is not None and time.monotonic() - self.reported_at >= self.PROGRESS_INTERVAL:
+            self.reported_at = time.monotonic()
+            self.progress(self.rows)
+
+
+class ServerCursor:
+    # Именованный (серверный) курсор: строки остаются на стороне Postgres
+    # и передаются клиенту порциями по мере вызова fetch()
+    _names = itertools.count(1)
+
+    def __init__(self, conn, sql, params=None, release=None, row_format="dict"):
+        self.conn = conn
+        self.release = release
+        self.exhausted = False
+        self.row_format = row_format
+        # Имена колонок; у серверного курсора известны после первого fetch
+        self.columns = None
+        # fetch и close могут вызываться из разных потоков
+        self.lock = threading.Lock()
+        self.cursor = conn.cursor(name=f"shop_cursor_{next(self._names)}",
+                                  cursor_factory=RealDictCursor if row_format == "dict" else None)
+        self.cursor.execute(sql, params)
+
+    def fetch(self, size):
+        with self.lock:
+            if self.exhausted:
+                return []
+            try:
+                rows = self.cursor.fetchmany(size)
+                self.columns = [column[0] for column in self.cursor.description]
+                result = convert_rows(rows, self.cursor.description, self.row_format)
+            except Exception as e:
+                self._close()
+                raise Exception(f"Ошибка чтения курсора: {e}")
+            if len(rows) < size:
+                # Данные закончились: освобождаем соединение, не дожидаясь закрытия окна
+                self._close()
+            return result
+
+    def fetch_all(self):
+        with self.lock:
+            if self.exhausted:
+                return []
+            try:
+                return convert_rows(self.cursor.fetchall(), self.cursor.description, self.row_format)
+            except Exception as e:
+                raise Exception(f"Ошибка чтения курсора: {e}")
+            finally:
+                self._close()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        self.exhausted = True
+        if self.conn is None:
+            return
+        try:
+            self.cursor.close()
+            self.conn.rollback()
+        except Exception:
+            pass
+        finally:
+            if self.release is not None:
+                self.release(self.conn)
+            else:
+                self.conn.close()
+            self.conn = None
+
+
+class QueryError(Exception):
+    # Ошибка запроса с контекстом: текст запроса, параметры, окно-источник и код ошибки Postgres
+    def __init__(self, message, sql=None, params=None, view=None, pgcode=None):
+        super().__init__(message)
+        self.sql = sql
+        self.params = params
+        self.view = view
+        self.pgcode = pgcode
+
+
+def load_config(file_path='config.ini'):
+    config = ConfigParser()
+    config.read(file_path)
+    if 'database' not in config:
+        raise Exception("Конфигурация базы данных не найдена в config.ini.")
+    return config['database']
 
 
 class Database:
-    def __init__(self, host, port, dbname, user, password):
-        try:
-            self.conn = psycopg2.connect(
-                host=host,
-                port=port,
-                dbname=dbname,
-                user=user,
-                password=password
-            )
-            self.conn.autocommit = True
+    def __init__(self, host, port, dbname, user, password, minconn=1, maxconn=8, instrumentation=None,
+                 prepared_statements=64, report_cache=None, statement_timeouts=None, keepalives=None,
+                 health_check=30.0):
+        self.instrumentation = instrumentation or QueryInstrumentation()
+        self.report_cache = report_cache or ReportCache()
+        # Размер кэша подготовленных операторов на соединение, 0 - без подготовки
+        self.prepared_statements = prepared_statements
+        # Запросы, которые сервер не смог подготовить (например, тип параметра
+        # не выводится из контекста), выполняются обычным способом
+        self.unpreparable = set()
+        self.conn_params = dict(host=host, port=port, dbname=dbname, user=user, password=password)
+        self.keepalives = dict(keepalives=1, **(keepalives or KEEPALIVE_DEFAULTS))
+        # Ограничение времени запроса по окну-источнику, мс: {"journalview": 30000, ...};
+        # "default" - для остальных запросов, 0 - без ограничения
+        self.statement_timeouts = statement_timeouts or {}
+        # Соединение, простоявшее в пуле дольше health_check секунд или
+        # взятое в пул до обнаруженного обрыва связи, перед выдачей проверяется
+        self.health_check = health_check
+        self.lost_at = 0.0
+        try:
+            self.pool = ThreadedConnectionPool(minconn, maxconn, connection_factory=PreparedConnection,
+                                               **self.conn_params, **self.keepalives)
         except Exception as e:
             raise Exception(f"Ошибка подключения к базе данных: {e}")
+        # ThreadedConnectionPool не ждет освобождения соединений, а сразу
+        # выдает ошибку, поэтому число одновременных запросов ограничиваем сами
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+        self._aio = None
+        self._changes = None
 
-    def query(self, sql, params=None):
+    @classmethod
+    def from_config(cls, config):
+        # Секция [instrumentation] необязательна: без нее действуют значения по умолчанию
+        parser = config.parser
+        instrumentation = parser['instrumentation'] if parser.has_section('instrumentation') else None
+        report_cache = parser['report_cache'] if parser.has_section('report_cache') else None
+        # [statement_timeout]: секунды по имени окна (JournalView = 30) и default
+        timeouts = parser['statement_timeout'] if parser.has_section('statement_timeout') else {}
+        return cls(
+            host=config['host'],
+            port=config['port'],
+            dbname=config['dbname'],
+            user=config['user'],
+            password=config['password'],
+            minconn=config.getint('pool_min', 1),
+            maxconn=config.getint('pool_max', 8),
+            prepared_statements=config.getint('prepared_statements', 64),
+            instrumentation=QueryInstrumentation.from_config(instrumentation),
+            report_cache=ReportCache.from_config(report_cache),
+            statement_timeouts={view: int(float(seconds) * 1000) for view, seconds in timeouts.items()},
+            keepalives={key: config.getint(key, value) for key, value in KEEPALIVE_DEFAULTS.items()},
+            health_check=config.getfloat('health_check_seconds', 30.0)
+        )
+
+    @property
+    def aio(self):
+        # Асинхронный доступ к той же базе (async_db.py), создается при первом обращении
+        if self._aio is None:
+            from async_db import AsyncDatabase
+            self._aio = AsyncDatabase(**self.conn_params, maxconn=self.maxconn, instrumentation=self.instrumentation)
+        return self._aio
+
+    @property
+    def changes(self):
+        # Слушатель уведомлений об изменениях; соединение открывает start()
+        if self._changes is None:
+            self._changes = ChangeListener(dict(self.conn_params, **self.keepalives))
+        return self._changes
+
+    def statement_timeout(self, view):
+        # "JournalView.load_data" -> ограничение для JournalView
+        timeouts = self.statement_timeouts
+        return timeouts.get(view.split(".")[0].lower(), timeouts.get("default", 0))
+
+    def acquire(self, autocommit=True, timeout=None):
+        # timeout - statement_timeout в мс; None - по окну, из которого идет
+        # запрос ([statement_timeout] в config.ini). Миграции, командная строка
+        # и синхронизация копии передают 0: их запросы не ограничиваются
+        self.slots.acquire()
         try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(sql, params)
-                if cursor.description:  # Если запрос возвращает результат
-                    return cursor.fetchall()
+            conn = self._pooled_connection()
+        except Exception:
+            self.slots.release()
+            raise
+        try:
+            if timeout is None:
+                timeout = self.statement_timeout(caller_view()) if self.statement_timeouts else 0
+            # autocommit до SET: откат транзакции вернул бы прежнее значение
+            conn.autocommit = True
+            if conn.statement_timeout != timeout:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET statement_timeout = %s", (timeout,))
+                conn.statement_timeout = timeout
+            conn.autocommit = autocommit
+            return conn
+        except Exception:
+            self.release(conn)
+            raise
+
+    def _pooled_connection(self):
+        # Разорванные соединения (перезапуск сервера, обрыв сети) закрываются,
+        # вместо них пул открывает новые
+        for attempt in range(self.maxconn + 1):
+            conn = self.pool.getconn()
+            if not conn.closed and conn.last_used > self.lost_at \
+                    and time.monotonic() - conn.last_used < self.health_check:
+                return conn
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                return conn
+            except psycopg2.Error:
+                self.lost_at = time.monotonic()
+                self.pool.putconn(conn, close=True)
+        raise Exception("Ошибка подключения к базе данных: соединения разорваны")
+
+    def release(self, conn):
+        try:
+            conn.last_used = time.monotonic()
+            if conn.closed:
+                # Остальные соединения пула могли оборваться так же: проверяются при выдаче
+                self.lost_at = conn.last_used
+            # Пул сам откатывает незавершенную транзакцию, а сломанное соединение закрываем
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self, autocommit=True, timeout=None):
+        conn = self.acquire(autocommit, timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def query(self, sql, params=None, token=None, row_format="dict", timeout=None):
+        # token - CancelToken, через который запрос можно прервать из другого потока;
+        # row_format - вид строк результата (см. ROW_FORMATS); timeout - см. acquire
+        if row_format not in ROW_FORMATS:
+            raise Exception(f"Неизвестный формат строк: {row_format}")
+        started = time.perf_counter()
+        rows = None
+        cursor_factory = RealDictCursor if row_format == "dict" else None
+        conn = None
+        try:
+            for attempt in range(2):
+                with self.connection(timeout=timeout) as conn, conn.cursor(cursor_factory=cursor_factory) as cursor:
+                    try:
+                        with token.bind(conn) if token is not None else nullcontext():
+                            self._execute(conn, cursor, sql, params)
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        # Связь оборвалась во время запроса: чтение повторяется
+                        # один раз на новом соединении, запись - нет
+                        if attempt or not conn.closed or WRITE_STATEMENT.search(sql):
+                            raise
+                        continue
+                    if cursor.description:  # Если запрос возвращает результат
+                        rows = cursor.fetchall()
+                        description = cursor.description
+                break
         except Exception as e:
-            raise Exception(f"Ошибка выполнения запроса: {e}")
+            raise self._query_error("Ошибка выполнения запроса", sql, params, started, e, conn, token) from e
+        size = payload_size(rows) if rows and self.instrumentation.enabled else 0
+        self._record(sql, params, started, len(rows) if rows is not None else 0, size)
+        if WRITE_STATEMENT.search(sql):
+            self.report_cache.expire_versions()
+        return convert_rows(rows, description, row_format) if rows is not None else None
 
     def execute(self, sql, params=None):
+        started = time.perf_counter()
+        conn = None
         try:
-            with self.conn.cursor() as cursor:
+            with self.connection() as conn, conn.cursor() as cursor:
+                self._execute(conn, cursor, sql, params)
+                rowcount = max(cursor.rowcount, 0)
+        except Exception as e:
+            raise self._query_error("Ошибка выполнения команды", sql, params, started, e, conn) from e
+        self._record(sql, params, started, rowcount, 0)
+        self.report_cache.expire_versions()
+
+    def _execute(self, conn, cursor, sql, params):
+        # Повторяющиеся запросы выполняются через PREPARE/EXECUTE: разбор
+        # и планирование на сервере происходят один раз на соединение
+        if (not self.prepared_statements or sql in self.unpreparable
+                or not PREPARABLE.match(sql) or not isinstance(conn, PreparedConnection)):
+            cursor.execute(sql, params)
+            return
+        for attempt in range(2):
+            try:
+                name, names, types = conn.prepare(sql, self.prepared_statements, params is not None)
+            except psycopg2.Error as e:
+                if not (e.pgcode or "").startswith("42"):
+                    raise
+                self.unpreparable.add(sql)
                 cursor.execute(sql, params)
-                self.conn.commit()
+                return
+            values = [params[key] for key in names] if names else list(params or ())
+            if any(isinstance(value, (float, Decimal)) and kind in INTEGER_TYPES
+                   or isinstance(value, int) and kind in INTEGER_LIMITS
+                   and not -INTEGER_LIMITS[kind] <= value < INTEGER_LIMITS[kind]
+                   for value, kind in zip(values, types)):
+                # EXECUTE молча округлит дробное значение до целого типа
+                # параметра или отвергнет большое число, а обычный запрос
+                # сравнил бы его точно
+                cursor.execute(sql, params)
+                return
+            placeholders = ", ".join(["%s"] * len(values))
+            try:
+                cursor.execute(f"EXECUTE {name} ({placeholders})" if values else f"EXECUTE {name}", values or None)
+                return
+            except psycopg2.Error as e:
+                code = e.pgcode or ""
+                if code.startswith("22"):
+                    # Неверное значение (например, "1.5" для integer) - ошибка
+                    # ввода, а не подготовки: подготовленный запрос остается
+                    raise
+                if code.startswith("42"):
+                    # Тип параметра выведен при подготовке уже, чем допускает
+                    # обычный запрос. Запрос больше не готовим, только если
+                    # обычное выполнение прошло; иначе ошибка та же, что без PREPARE
+                    cursor.execute(sql, params)
+                    self.unpreparable.add(sql)
+                    conn.forget(sql)
+                    return
+                if attempt or code not in STALE_STATEMENT_CODES:
+                    raise
+                if code == "26000":
+                    conn.forget_all()
+                else:
+                    conn.forget(sql)
+
+    def _record(self, sql, params, started, rows, size):
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            instrumentation.record(sql, params, time.perf_counter() - started, rows, size, caller_view(), explain=self.explain)
+
+    def _query_error(self, message, sql, params, started, error, conn=None, token=None):
+        view = caller_view()
+        self.instrumentation.record_error(sql, params, time.perf_counter() - started, view, error)
+        pgcode = getattr(error, 'pgcode', None)
+        if pgcode == QUERY_CANCELED:
+            # Текст сервера зависит от lc_messages, поэтому причина определяется
+            # по токену: отмененный токен - отмена пользователем, иначе сработал
+            # statement_timeout соединения
+            timeout = conn.statement_timeout if isinstance(conn, PreparedConnection) else 0
+            if token is not None and token.cancelled or not timeout:
+                error = "запрос отменен"
+            else:
+                error = f"превышено время выполнения ({timeout / 1000:g} с)"
+        return QueryError(f"{message}: {error}", sql, params, view, pgcode)
+
+    def explain(self, sql, params=None):
+        # EXPLAIN ANALYZE действительно выполняет запрос, поэтому транзакция
+        # всегда откатывается
+        with self.connection(autocommit=False) as conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                    return "\n".join(row[0] for row in cursor.fetchall())
+            finally:
+                conn.rollback()
+
+    @contextmanager
+    def transaction(self, cursor_factory=None, timeout=None):
+        # Явная транзакция на соединении из пула: commit при успехе, rollback при ошибке
+        with self.connection(autocommit=False, timeout=timeout) as conn:
+            try:
+                with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self.report_cache.expire_versions()
+
+    def copy_in(self, table, file, columns=None, cursor=None):
+        # Потоковая загрузка CSV (с заголовком) в таблицу: файл читается
+        # блоками, поэтому расход памяти не зависит от его размера
+        column_list = f" ({', '.join(columns)})" if columns else ""
+        sql = f"COPY {table}{column_list} FROM STDIN WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')"
+        try:
+            if cursor is not None:
+                cursor.copy_expert(sql, file, size=COPY_BUFFER_SIZE)
+                return cursor.rowcount
+            with self.transaction() as cursor:
+                cursor.copy_expert(sql, file, size=COPY_BUFFER_SIZE)
+                return cursor.rowcount
         except Exception as e:
-            self.conn.rollback()
-            raise Exception(f"Ошибка выполнения команды: {e}")
+            raise Exception(f"Ошибка загрузки данных: {e}")
+
+    def copy_out(self, sql, params, file, progress=None, token=None, timeout=None):
+        # Потоковая выгрузка результата запроса в CSV (с заголовком): строки
+        # идут из Postgres прямо в файл, не накапливаясь в памяти
+        try:
+            with self.connection(timeout=timeout) as conn, conn.cursor() as cursor:
+                query = cursor.mogrify(sql, params).decode(psycopg2.extensions.encodings[conn.encoding])
+                writer = CopyWriter(file, progress)
+                with token.bind(conn) if token is not None else nullcontext():
+                    cursor.copy_expert(
+                        f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')",
+                        writer, size=COPY_BUFFER_SIZE
+                    )
+                return writer.rows
+        except Exception as e:
+            if token is not None and token.cancelled:
+                raise Exception("Выгрузка отменена")
+            raise Exception(f"Ошибка выгрузки данных: {e}")
+
+    def import_journal_csv(self, journal_type, file):
+        # Возвращает число загруженных строк; при любой ошибке журнал не меняется
+        spec = IMPORTS[journal_type]
+        with self.transaction() as cursor:
+            columns = ", ".join(f"{column} text" for column in spec['columns'])
+            cursor.execute(f"CREATE TEMP TABLE import_rows (line bigserial, {columns}) ON COMMIT DROP")
+            self.copy_in("import_rows", file, spec['columns'], cursor=cursor)
+            # Статистика по временной таблице нужна планировщику для выбора хеш-соединений
+            cursor.execute("ANALYZE import_rows")
+
+            errors = self._import_errors(cursor, spec)
+            if errors:
+                raise Exception("Ошибки в файле:\n" + "\n".join(errors))
+
+            cursor.execute(spec['insert'])
+            return cursor.rowcount
+
+    def _import_errors(self, cursor, spec):
+        checks = [(f"{spec['name_column']} IS NULL", "не указано наименование")]
+        for column, pattern, message, kind in spec['checks']:
+            condition = f"{column} IS NULL OR {column} !~ '{pattern}'"
+            if kind == "date":
+                # Шаблон пропускает 2026-13-45: календарь проверяет Python.
+                # Различных дат в файле немного, поэтому строки файла в
+                # приложение не передаются
+                cursor.execute(f"SELECT DISTINCT left(trim({column}), 10) FROM import_rows WHERE {column} ~ '{pattern}'")
+                invalid = []
+                for (value,) in cursor.fetchall():
+                    try:
+                        date.fromisoformat(value)
+                    except ValueError:
+                        invalid.append(value)
+                if invalid:
+                    values = cursor.mogrify("%s", (invalid,)).decode()
+                    condition += f" OR left(trim({column}), 10) = ANY({values})"
+            elif kind == "integer":
+                # Больше 2147483647 не помещается в integer; сравнение строк
+                # одной длины не требует приведения типа
+                digits = f"ltrim(trim({column}), '0')"
+                condition += (f" OR length({digits}) > 10"
+                              f" OR lpad({digits}, 10, '0') COLLATE \"C\" > '{2 ** 31 - 1}'")
+            checks.append((condition, message))
+        # Подзапросы без корреляции Postgres хеширует один раз на весь файл
+        checks.append((
+            f"{spec['name_column']} NOT IN (SELECT name FROM {spec['reference']})",
+            "наименование не найдено в справочнике",
+        ))
+        checks.append((
+            f"{spec['name_column']} IN (SELECT name FROM {spec['reference']} GROUP BY name HAVING count(*) > 1)",
+            "наименование в справочнике не уникально",
+        ))
+        # Все проверки за один проход по временной таблице; для строки
+        # выводится первая найденная ошибка. Номер строки в файле на
+        # единицу больше номера данных из-за заголовка
+        problem = " ".join(f"WHEN {condition} THEN %s" for condition, _ in checks)
+        where = " OR ".join(f"({condition})" for condition, _ in checks)
+        cursor.execute(
+            f"SELECT line + 1, CASE {problem} END FROM import_rows i WHERE {where} ORDER BY line LIMIT %s",
+            [message for _, message in checks] + [IMPORT_ERRORS_SHOWN]
+        )
+        return [f"строка {line}: {message}" for line, message in cursor.fetchall()]
 
+    def open_cursor(self, sql, params=None, row_format="dict", timeout=None):
+        # Серверный курсор живет внутри транзакции, поэтому соединение
+        # берется из пула без autocommit и занято до закрытия курсора
+        conn = self.acquire(autocommit=False, timeout=timeout)
+        try:
+            return ServerCursor(conn, sql, params, release=self.release, row_format=row_format)
+        except Exception as e:
+            self.release(conn)
+            raise Exception(f"Ошибка открытия курсора: {e}")
 
     def close(self):
-        if self.conn:
-            self.conn.close()
+        if self._changes is not None:
+            self._changes.close()
+        if self.pool:
+            self.pool.closeall()
+
+    @staticmethod
+    def journal_query(journal_type, date_from=None, date_to=None, after=None, limit=None,
+                      name=None, amount_from=None, amount_to=None):
+        # after - ключ (дата, id) последней строки предыдущей страницы,
+        # name - подстрока названия товара или статьи расхода
+        journal = JOURNALS[journal_type]
+        conditions = []
+        params = []
+        if date_from is not None:
+            conditions.append(f"{journal['date_column']} >= %s")
+            params.append(date_from)
+        if date_to is not None:
+            # Граница включительно: все записи до начала следующего дня
+            conditions.append(f"{journal['date_column']} < %s")
+            params.append(date_to + timedelta(days=1))
+        if name:
+            # Подходящие названия находит триграммный индекс справочника (см. schema.py)
+            conditions.append(f"{journal['name_column']} ILIKE %s")
+            params.append(like_pattern(name))
+        if amount_from is not None:
+            conditions.append(f"{journal['amount_column']} >= %s")
+            params.append(amount_from)
+        if amount_to is not None:
+            conditions.append(f"{journal['amount_column']} <= %s")
+            params.append(amount_to)
+        if after is not None:
+            # Отдельное условие на дату повторяет ключ: по сравнению строк Postgres
+            # не отбрасывает партиции более поздних месяцев, по нему - отбрасывает
+            conditions.append(f"{journal['date_column']} <= %s")
+            conditions.append(f"({journal['date_column']}, {journal['id_column']}) < (%s, %s)")
+            params.extend((after[0], *after))
+
+        sql = f"SELECT {journal['columns']} FROM {journal['table']} {journal['alias']} {journal['joins']}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {journal['date_column']} DESC, {journal['id_column']} DESC"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    # Строки журналов - записи со __slots__: страницы держатся в памяти окна
+    def journal_page(self, journal_type, date_from=None, date_to=None, after=None, limit=100, **filters):
+        sql, params = self.journal_query(journal_type, date_from, date_to, after, limit, **filters)
+        return self.query(sql, params, row_format="record")
+
+    def open_journal(self, journal_type, date_from=None, date_to=None, after=None, limit=None, **filters):
+        sql, params = self.journal_query(journal_type, date_from, date_to, after, limit, **filters)
+        return self.open_cursor(sql, params, row_format="record")
+
+    @staticmethod
+    def reference_search_query(table, name=None, amount_from=None, amount_to=None):
+        # Условия накладываются на обычный запрос справочника: Postgres
+        # переносит их внутрь подзапроса и использует индексы таблицы
+        conditions = []
+        params = []
+        if name:
+            conditions.append("r.name ILIKE %s")
+            params.append(like_pattern(name))
+        if amount_from is not None:
+            conditions.append("r.amount >= %s")
+            params.append(amount_from)
+        if amount_to is not None:
+            conditions.append("r.amount <= %s")
+            params.append(amount_to)
+        sql = f"SELECT * FROM ({REFERENCE_QUERIES[table]}) r"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql + " ORDER BY r.id", params
+
+    def search_reference(self, table, token=None, **filters):
+        # Отфильтрованные строки читаются с сервера и в общий кэш не попадают
+        sql, params = self.reference_search_query(table, **filters)
+        return self.query(sql, params, token=token)
+
+    def reference_rows(self, table, ids):
+        # Строки справочника по id в том же виде, что и get_reference
+        return self.query(f"SELECT * FROM ({REFERENCE_QUERIES[table]}) r WHERE r.id = ANY(%s) ORDER BY r.id",
+                          (list(ids),))
+
+    def journal_rows(self, journal_type, ids, reference_ids=None):
+        # Строки журнала по id в том же виде, что и страницы журнала;
+        # reference_ids - только строки с этими товарами или статьями расхода
+        journal = JOURNALS[journal_type]
+        sql = (f"SELECT {journal['columns']} FROM {journal['table']} {journal['alias']} {journal['joins']} "
+               f"WHERE {journal['id_column']} = ANY(%s)")
+        params = [list(ids)]
+        if reference_ids is not None:
+            sql += f" AND {journal['reference_column']} = ANY(%s)"
+            params.append(list(reference_ids))
+        return self.query(sql, params, row_format="record")
+
+    def get_reference(self, table):
+        # Строки общие для всех окон, изменять их нельзя
+        return reference_cache.get(self, table)
+
+    def invalidate_reference(self, table=None):
+        reference_cache.invalidate(table)
+
+    def write_journal_row(self, journal_type, sql, params=None):
+        # sql - INSERT или UPDATE одной записи журнала без RETURNING.
+        # Возвращает измененную строку в том же виде, что и запросы журнала,
+        # чтобы окно могло обновить только ее
+        journal = JOURNALS[journal_type]
+        result = self.query(
+            f"WITH {journal['alias']} AS ({sql} RETURNING *) "
+            f"SELECT {journal['columns']} FROM {journal['alias']} {journal['joins']}",
+            params
+        )
+        return result[0] if result else None
+
+    def delete_many(self, table, ids):
+        # Удаление набора строк одной командой в явной транзакции: триггеры
+        # дневных итогов срабатывают один раз на всю операцию.
+        # Возвращает id действительно удаленных строк
+        sql = f"DELETE FROM {table} WHERE id = ANY(%s) RETURNING id"
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(sql, (list(ids),))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            raise QueryError(f"Ошибка удаления записей: {e}", sql, None, caller_view(), getattr(e, 'pgcode', None)) from e
+
+    def update_many(self, table, ids, values):
+        # values - {поле: значение}, одинаковые для всех строк. Возвращает
+        # измененные строки: для журналов - в виде строк журнала, для
+        # справочников - целиком, чтобы окно обновило только их
+        assignments = ", ".join(f"{column} = %s" for column in values)
+        sql = f"UPDATE {table} SET {assignments} WHERE id = ANY(%s) RETURNING *"
+        if table in JOURNALS:
+            journal = JOURNALS[table]
+            sql = (f"WITH {journal['alias']} AS ({sql}) "
+                   f"SELECT {journal['columns']} FROM {journal['alias']} {journal['joins']}")
+        params = [*values.values(), list(ids)]
+        try:
+            with self.transaction(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        except Exception as e:
+            raise QueryError(f"Ошибка изменения записей: {e}", sql, params, caller_view(), getattr(e, 'pgcode', None)) from e
+
+    @staticmethod
+    def journal_key(journal_type, row):
+        # Ключ строки для запроса следующей страницы
+        return row[JOURNALS[journal_type]['date_key']], row['id']
 
     # Методы для авторизации
     def get_user(self, username):
@@ -52,18 +1181,77 @@ class Database:
             return user
         return None
 
+    # Отчеты читают дневные итоги sales_daily/charges_daily (см. schema.py),
+    # поэтому их стоимость зависит от числа дней, а не от числа операций
+    @staticmethod
+    def profit_query(start_date, end_date):
+        sql = """
+            SELECT s.total AS total_sales, c.total AS total_expenses, s.total - c.total AS profit
+            FROM (SELECT COALESCE(SUM(revenue), 0) AS total FROM sales_daily
+                  WHERE day BETWEEN %s AND %s) s,
+                 (SELECT COALESCE(SUM(amount), 0) AS total FROM charges_daily
+                  WHERE day BETWEEN %s AND %s) c
+        """
+        return sql, (start_date, end_date, start_date, end_date)
+
+    @staticmethod
+    def current_month_profit_query():
+        today = date.today()
+        month_start = today.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        return Database.profit_query(month_start, next_month - timedelta(days=1))
+
+    @staticmethod
+    def top_items_query(start_date=None, end_date=None, limit=5):
+        # Без дат - за все время
+        conditions = ["d.sales_count <> 0"]
+        params = []
+        if start_date is not None:
+            conditions.append("d.day >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("d.day <= %s")
+            params.append(end_date)
+        sql = f"""
+            SELECT w.name AS item_name, SUM(d.revenue) AS total_revenue
+            FROM sales_daily d
+            JOIN warehouses w ON d.warehouse_id = w.id
+            WHERE {" AND ".join(conditions)}
+            GROUP BY w.name
+            ORDER BY total_revenue DESC
+            LIMIT %s
+        """
+        params.append(limit)
+        return sql, params
+
+    @staticmethod
+    def expense_breakdown_query(start_date, end_date):
+        sql = """
+            SELECT e.name AS item_name, SUM(d.amount) AS total_amount
+            FROM charges_daily d
+            JOIN expense_items e ON d.expense_item_id = e.id
+            WHERE d.charges_count <> 0 AND d.day BETWEEN %s AND %s
+            GROUP BY e.name
+            ORDER BY total_amount DESC
+        """
+        return sql, (start_date, end_date)
+
+    def query_report(self, sql, params=None, token=None):
+        # Запрос отчета по дневным итогам; сеанс просмотра с локальной
+        # копией (replica.py) выполняет его без обращения к серверу.
+        # Повторный отчет по неизмененным данным берется из report_cache
+        return self.report_cache.get(self, sql, params,
+                                     lambda: self.query(sql, params, token=token, row_format="record"))
+
     def calculate_monthly_profit(self):
         try:
-            # Вызов хранимой процедуры для расчета прибыли за месяц
-            result = self.query("SELECT * FROM calculate_monthly_profit()")
+            result = self.query(*self.current_month_profit_query())
             return result[0] if result else None
         except Exception as e:
             raise Exception(f"Не удалось рассчитать прибыль: {e}")
 
     def get_top_5_revenue_items(self, start_date, end_date):
         try:
-            # Вызов хранимой процедуры для получения топ-5 товаров по выручке
-            result = self.query("SELECT * FROM top_5_revenue_items(%s, %s)", (start_date, end_date))
-            return result
+            return self.query(*self.top_items_query(start_date, end_date, 5))
         except Exception as e:
-            raise Exception(f"Не удалось получить топ-5 товаров: {e}")
\ No newline at end of file
+            raise Exception(f"Не удалось получить топ-5 товаров: {e}")
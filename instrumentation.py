@@ -0,0 +1,207 @@
+import logging
+import math
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Гистограмма времени выполнения: корзины по степеням двойки в миллисекундах
+# (<=1 мс, <=2 мс, <=4 мс, ... , последняя - все, что дольше)
+HISTOGRAM_BUCKETS = 16
+# Модули, которые сами не являются "окном", вызвавшим запрос
+SKIPPED_MODULES = ("db_utils", "async_db", "instrumentation", "views.workers", "views.table_model", "asyncio", "qasync")
+# EXPLAIN ANALYZE повторно выполняет запрос, поэтому применяется только к чтению
+READ_ONLY_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b(?!.*\b(INSERT|UPDATE|DELETE)\b)", re.IGNORECASE | re.DOTALL)
+
+# Контекстная переменная, а не threading.local: у каждой задачи asyncio
+# (async_db.py) свой источник, даже если они выполняются в одном потоке
+_current_view = ContextVar("current_view", default=None)
+
+
+@contextmanager
+def view_context(view):
+    # Фоновые задачи запоминают окно, которое их запустило
+    token = _current_view.set(view)
+    try:
+        yield
+    finally:
+        _current_view.reset(token)
+
+
+def caller_view(skip=SKIPPED_MODULES):
+    view = _current_view.get()
+    if view:
+        return view
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(skip) and module != "threading":
+            owner = frame.f_locals.get("self")
+            if owner is not None:
+                return f"{type(owner).__name__}.{frame.f_code.co_name}"
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "-"
+
+
+def normalize(sql):
+    return " ".join(sql.split())
+
+
+def payload_size(rows):
+    # Примерный объем полученных данных: длина строк и байтов, 8 байт на прочие значения
+    size = 0
+    for row in rows:
+        for value in (row.values() if hasattr(row, "values") else row):
+            size += len(value) if isinstance(value, (str, bytes)) else 8
+    return size
+
+
+def bucket(elapsed_ms):
+    if elapsed_ms <= 1:
+        return 0
+    return min(int(math.ceil(math.log2(elapsed_ms))), HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_label(index):
+    if index == HISTOGRAM_BUCKETS - 1:
+        return f">{2 ** (index - 1)}ms"
+    return f"<={2 ** index}ms"
+
+
+class StatementStats:
+    # Статистика одного запроса за скользящее окно: по корзине на минуту
+    def __init__(self, window_minutes):
+        self.windows = deque(maxlen=window_minutes)
+        self.views = Counter()
+
+    def add(self, elapsed_ms, rows, size, view):
+        minute = int(time.time() // 60)
+        if not self.windows or self.windows[-1]["minute"] != minute:
+            self.windows.append({
+                "minute": minute, "count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "rows": 0, "bytes": 0, "histogram": [0] * HISTOGRAM_BUCKETS,
+            })
+        window = self.windows[-1]
+        if elapsed_ms is None:
+            window["errors"] += 1
+        else:
+            window["count"] += 1
+            window["total_ms"] += elapsed_ms
+            window["max_ms"] = max(window["max_ms"], elapsed_ms)
+            window["rows"] += rows
+            window["bytes"] += size
+            window["histogram"][bucket(elapsed_ms)] += 1
+        self.views[view] += 1
+
+    def summary(self, window_minutes):
+        oldest = int(time.time() // 60) - window_minutes
+        recent = [window for window in self.windows if window["minute"] > oldest]
+        histogram = [sum(window["histogram"][index] for window in recent) for index in range(HISTOGRAM_BUCKETS)]
+        count = sum(window["count"] for window in recent)
+        total_ms = sum(window["total_ms"] for window in recent)
+        return {
+            "count": count,
+            "errors": sum(window["errors"] for window in recent),
+            "total_ms": round(total_ms, 3),
+            "avg_ms": round(total_ms / count, 3) if count else 0.0,
+            "max_ms": round(max((window["max_ms"] for window in recent), default=0.0), 3),
+            "rows": sum(window["rows"] for window in recent),
+            "bytes": sum(window["bytes"] for window in recent),
+            "histogram": {bucket_label(index): value for index, value in enumerate(histogram) if value},
+            "views": dict(self.views),
+        }
+
+
+class QueryInstrumentation:
+    # Замеры запросов Database.query/execute: время, строки, объем данных
+    # и окно-источник; медленные запросы пишутся в журнал, при explain_slow -
+    # вместе с планом EXPLAIN (ANALYZE, BUFFERS)
+    def __init__(self, enabled=True, slow_query_ms=500.0, explain_slow=False,
+                 log_file="slow_queries.log", window_minutes=15):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.window_minutes = window_minutes
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.logger = logging.getLogger("shop.queries")
+        if enabled and log_file:
+            # Журнал у процесса один: последний созданный экземпляр задает файл
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            handler = logging.FileHandler(log_file, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            # Медленные запросы только в своем файле, не в общем журнале приложения
+            self.logger.propagate = False
+
+    @classmethod
+    def from_config(cls, config):
+        # config - секция [instrumentation] из config.ini или None
+        if config is None:
+            return cls()
+        return cls(
+            enabled=config.getboolean("enabled", True),
+            slow_query_ms=config.getfloat("slow_query_ms", 500.0),
+            explain_slow=config.getboolean("explain_slow", False),
+            log_file=config.get("log_file", "slow_queries.log"),
+            window_minutes=config.getint("window_minutes", 15),
+        )
+
+    def _stats(self, statement):
+        stats = self.statements.get(statement)
+        if stats is None:
+            stats = self.statements[statement] = StatementStats(self.window_minutes)
+        return stats
+
+    def record(self, sql, params, elapsed, rows, size, view, explain=None):
+        # Возвращает True, если запрос оказался медленным
+        if not self.enabled:
+            return False
+        statement = normalize(sql)
+        elapsed_ms = elapsed * 1000
+        with self.lock:
+            self._stats(statement).add(elapsed_ms, rows, size, view)
+        if elapsed_ms < self.slow_query_ms:
+            return False
+
+        self.logger.warning("slow query %.1f ms, rows=%s, bytes=%s, view=%s: %s; params=%r",
+                            elapsed_ms, rows, size, view, statement, params)
+        if self.explain_slow and explain is not None and READ_ONLY_STATEMENT.match(sql):
+            # План снимается в отдельном потоке, чтобы не удваивать задержку вызывающего
+            threading.Thread(target=self._log_plan, args=(explain, sql, params, statement), daemon=True).start()
+        return True
+
+    def record_error(self, sql, params, elapsed, view, error):
+        if not self.enabled:
+            return
+        statement = normalize(sql)
+        with self.lock:
+            self._stats(statement).add(None, 0, 0, view)
+        self.logger.error("query failed after %.1f ms, view=%s: %s; params=%r; error=%s",
+                          elapsed * 1000, view, statement, params, error)
+
+    def _log_plan(self, explain, sql, params, statement):
+        try:
+            plan = explain(sql, params)
+            self.logger.warning("plan for slow query: %s\n%s", statement, plan)
+        except Exception as e:
+            self.logger.error("EXPLAIN failed for %s: %s", statement, e)
+
+    def summary(self):
+        # Статистика за окно, самые затратные по суммарному времени запросы - первыми
+        with self.lock:
+            items = [(statement, stats.summary(self.window_minutes)) for statement, stats in self.statements.items()]
+        items.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+        return [dict(statement=statement, **summary) for statement, summary in items]
+
+    def log_summary(self, limit=20):
+        for item in self.summary()[:limit]:
+            self.logger.info("stats: %s", item)
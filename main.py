@@ -1,11 +1,73 @@
 import sys
+import time
+
+# Отсчет этапов запуска для --profile-startup
+STARTED = time.perf_counter()
+
+import importlib
+import logging
+import threading
+from contextlib import contextmanager
+from PyQt5.QtCore import QThreadPool
 from PyQt5.QtWidgets import QApplication, QMainWindow, QMenu, QMenuBar, QAction, QMessageBox, QDialog
-from configparser import ConfigParser
-from db_utils import Database
 from auth import LoginWindow
-from views.reference_view import ReferenceView
-from views.journal_view import JournalView
-from views.report_view import ReportView
+from views.workers import run_in_background, install_async_loop
+
+
+# Модули окон импортируются в фоне, пока показано окно входа
+VIEW_MODULES = ("views.reference_view", "views.journal_view", "views.report_view", "views.dashboard_view")
+# Предупреждения модулей (недоступные уведомления, ошибки синхронизации
+# копии, устаревшая схема) пишутся в журнал рядом с медленными запросами
+APP_LOG = "shop.log"
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    # Длительность этапов запуска; фоновые этапы идут параллельно окну входа
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started)
+
+    def add(self, name, started):
+        thread = "GUI" if threading.current_thread() is threading.main_thread() else "фон"
+        with self.lock:
+            self.phases.append((started - STARTED, time.perf_counter() - started, thread, name))
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("Этапы запуска (начало от старта, длительность, поток):", file=sys.stderr)
+        with self.lock:
+            phases = sorted(self.phases)
+        for offset, duration, thread, name in phases:
+            print(f"{offset * 1000:9.1f} мс {duration * 1000:9.1f} мс  {thread:<4} {name}", file=sys.stderr)
+
+
+def connect_database(profile):
+    # psycopg2 и пул соединений загружаются в фоне: задержка сети
+    # не откладывает показ окна входа
+    with profile.phase("Импорт db_utils"):
+        from db_utils import Database, load_config
+    with profile.phase("Чтение config.ini"):
+        config = load_config()
+    with profile.phase("Подключение к базе данных"):
+        return Database.from_config(config)
+
+
+def preload_views(profile):
+    for module in VIEW_MODULES:
+        with profile.phase(f"Импорт {module}"):
+            importlib.import_module(module)
 
 
 class MainApp(QMainWindow):
@@ -36,12 +98,57 @@ class MainApp(QMainWindow):
         reports_menu = menubar.addMenu("Отчеты")
         self.add_action(reports_menu, "Прибыль за месяц", self.open_report_view)
         self.add_action(reports_menu, "Топ товаров", self.open_report_view)
+        self.add_action(reports_menu, "Панель отчетов", self.open_dashboard_view)
+
+        # Заранее загружаем справочники в общий кэш, чтобы формы открывались без запросов
+        for table in ("warehouses", "expense_items"):
+            run_in_background(self.db.get_reference, table)
+        # Без индексов журналов окна и отчеты работают, но медленно;
+        # без новых версий схемы часть окон не работает вовсе
+        from migrations import missing_indexes, pending_versions
+        run_in_background(missing_indexes, self.db, on_result=self.check_indexes, owner=self)
+        run_in_background(pending_versions, self.db, on_result=self.check_versions, owner=self)
 
         if self.user_role == 'user':
             # Обычный пользователь может только просматривать данные
             self.remove_admin_actions()
         self.show()
 
+    def check_indexes(self, missing):
+        if not missing:
+            return
+        logger.warning("Отсутствуют индексы базы данных: %s. Создать их: python migrations.py", ", ".join(missing))
+        if self.user_role != "admin":
+            return
+        confirm = QMessageBox.question(
+            self, "Индексы базы данных",
+            f"В базе нет индексов, от которых зависит скорость журналов и отчетов:\n{', '.join(missing)}\n\n"
+            "Создать их сейчас? Построение идет в фоне и не блокирует работу с базой.",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if confirm == QMessageBox.Yes:
+            # Только индексы: версии схемы с долгими блокировками таблиц
+            # применяются командой python migrations.py
+            from migrations import build_missing_indexes
+            run_in_background(
+                build_missing_indexes, self.db,
+                on_result=lambda applied: QMessageBox.information(self, "Индексы базы данных", "Индексы созданы."),
+                on_error=lambda message: QMessageBox.critical(self, "Ошибка", f"Не удалось создать индексы: {message}"),
+                owner=self,
+            )
+
+    def check_versions(self, pending):
+        if not pending:
+            return
+        versions = "\n".join(f"{version}: {description}" for version, description in pending)
+        logger.warning("Схема базы данных устарела, не применены версии:\n%s\nПрименить: python migrations.py", versions)
+        if self.user_role == "admin":
+            QMessageBox.warning(
+                self, "Схема базы данных",
+                f"Не применены версии схемы базы данных:\n{versions}\n\n"
+                "Отчеты и журналы могут не работать. Примените их командой python migrations.py."
+            )
+
     def add_action(self, menu, title, callback):
         action = QAction(title, self)
         action.triggered.connect(callback)
@@ -61,61 +168,89 @@ class MainApp(QMainWindow):
                 if action.text() == action_name:
                     menu.removeAction(action)
 
-    # Методы открытия форм
+    # Методы открытия форм. Модули окон обычно уже загружены в фоне при запуске
     def open_expense_items(self):
         # Открыть справочник статей расходов
+        from views.reference_view import ReferenceView
         reference_view = ReferenceView(self.db, "expense_items", self.user_role)  # Передаем 'expense_items' для статей расходов
         reference_view.exec_()
 
     def open_warehouses(self):
         # Открыть справочник товаров
+        from views.reference_view import ReferenceView
         reference_view = ReferenceView(self.db, "warehouses", self.user_role)  # Передаем 'warehouses' для товаров
         reference_view.exec_()
 
     def open_sales(self):
+        from views.journal_view import JournalView
         view = JournalView(self.db, "sales", self.user_role)
         view.exec_()
 
     def open_charges(self):
+        from views.journal_view import JournalView
         view = JournalView(self.db, "charges", self.user_role)
         view.exec_()
 
     def open_report_view(self):
+        from views.report_view import ReportView
         view = ReportView(self.db)
         view.exec_()
 
-
-def load_config(file_path='config.ini'):
-    config = ConfigParser()
-    config.read(file_path)
-    if 'database' not in config:
-        raise Exception("Конфигурация базы данных не найдена в config.ini.")
-    return config['database']
+    def open_dashboard_view(self):
+        from views.dashboard_view import DashboardView
+        view = DashboardView(self.db)
+        view.exec_()
 
 
 def main():
-    try:
-        config = load_config()
-        db = Database(
-            host=config['host'],
-            port=config['port'],
-            dbname=config['dbname'],
-            user=config['user'],
-            password=config['password']
-        )
-    except Exception as e:
-        QMessageBox.critical(None, "Ошибка", f"Не удалось подключиться к базе данных: {str(e)}")
-        sys.exit(1)
+    logging.basicConfig(
+        level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        handlers=[logging.FileHandler(APP_LOG, encoding="utf-8", delay=True), logging.StreamHandler()],
+    )
+    profile = StartupProfile("--profile-startup" in sys.argv[1:])
+    profile.add("Импорт PyQt5 и окна входа", STARTED)
+
+    with profile.phase("Создание QApplication"):
+        app = QApplication(sys.argv)
+        # При наличии qasync и psycopg 3 окна могут ждать запросы через asyncio
+        loop = install_async_loop(app)
+
+    # Окно входа показывается сразу, подключение к базе и импорт окон идут в фоне
+    with profile.phase("Показ окна входа"):
+        login_window = LoginWindow()
+        login_window.show()
+        app.processEvents()
+    run_in_background(
+        connect_database, profile,
+        on_result=login_window.set_database,
+        on_error=login_window.connection_failed,
+    )
+    run_in_background(preload_views, profile)
 
-    app = QApplication(sys.argv)
+    if login_window.exec_() != QDialog.Accepted:
+        # Фоновые задачи запуска завершаем до выхода
+        QThreadPool.globalInstance().waitForDone()
+        profile.report()
+        sys.exit(1 if login_window.connection_error else 0)
 
-    login_window = LoginWindow(db)
-    if login_window.exec_() == QDialog.Accepted:
+    db = login_window.db
+    if login_window.user_role == 'user':
+        # Сеанс просмотра читает данные из локальной копии, если она включена в config.ini
+        with profile.phase("Локальная копия"):
+            from replica import open_replica
+            db = open_replica(db)
+    with profile.phase("Главное окно"):
         main_app = MainApp(db, login_window.user_role)
         main_app.show()
-        sys.exit(app.exec_())
+    profile.report()
+    if loop is None:
+        exit_code = app.exec_()
     else:
-        sys.exit(0)
+        with loop:
+            exit_code = loop.run_forever() or 0
+    # Сводка по запросам сеанса попадает в журнал рядом с медленными запросами
+    db.instrumentation.log_summary()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,382 @@
+import argparse
+import sys
+from collections import namedtuple
+from db_utils import Database, load_config
+from partitions import partition_migration
+from schema import ROLLUP_REFRESH, rollup_statements
+
+
+# Индекс, которым владеет миграция. Индексы строятся через
+# CREATE INDEX CONCURRENTLY: запись в таблицы во время построения не блокируется.
+# extension - расширение, без которого индекс не построить; если его нет на
+# сервере, индекс пропускается (состояние "unavailable")
+Index = namedtuple("Index", "name table columns method extension", defaults=("btree", None))
+
+# Отслеживание изменений: updated_at ставится при вставке (значение по
+# умолчанию) и каждом изменении строки, удаленные id попадают в deleted_rows.
+# Колонка с now() по умолчанию добавляется без перезаписи таблицы
+TRACKED_TABLES = ("warehouses", "expense_items", "sales", "charges")
+
+CHANGE_TRACKING_FUNCTIONS = """
+    CREATE TABLE IF NOT EXISTS deleted_rows (
+        seq bigserial PRIMARY KEY,
+        table_name text NOT NULL,
+        id integer NOT NULL,
+        deleted_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at = now();
+        RETURN NEW;
+    END
+    $$;
+    CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO deleted_rows (table_name, id) SELECT TG_TABLE_NAME, id FROM old_rows;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+CHANGE_TRACKING = """
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+    DROP TRIGGER IF EXISTS {table}_touch ON {table};
+    CREATE TRIGGER {table}_touch BEFORE UPDATE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    DROP TRIGGER IF EXISTS {table}_deleted ON {table};
+    CREATE TRIGGER {table}_deleted AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows();
+"""
+
+# Версии данных для кэша отчетов (db_utils.ReportCache): счетчик таблицы
+# увеличивается один раз на оператор записи и виден другим сеансам только
+# после фиксации транзакции, как и сами изменения
+DATA_VERSIONS = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        table_name text PRIMARY KEY,
+        version bigint NOT NULL DEFAULT 0
+    );
+    INSERT INTO data_versions (table_name) VALUES {tables} ON CONFLICT DO NOTHING;
+    CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE data_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+DATA_VERSION_TRIGGER = """
+    DROP TRIGGER IF EXISTS {table}_version ON {table};
+    CREATE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+"""
+
+# Уведомления об изменениях для открытых окон (db_utils.ChangeListener).
+# Одно уведомление на оператор, а не на строку; при массовых изменениях
+# вместо списка id передается "*". Уведомления доставляются после фиксации
+# транзакции, одинаковые в одной транзакции объединяются
+NOTIFY_MAX_IDS = 500
+
+CHANGE_NOTIFY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        changed bigint;
+        ids text;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            changed := {max_ids} + 1;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT count(*), string_agg(id::text, ',') INTO changed, ids
+            FROM (SELECT id FROM old_rows LIMIT {max_ids} + 1) r;
+        ELSE
+            SELECT count(*), string_agg(id::text, ',') INTO changed, ids
+            FROM (SELECT id FROM new_rows LIMIT {max_ids} + 1) r;
+        END IF;
+        IF changed > {max_ids} THEN
+            ids := '*';
+        END IF;
+        IF changed > 0 THEN
+            PERFORM pg_notify('shop_changes', TG_TABLE_NAME || ':' || left(TG_OP, 1) || ':' || ids);
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+CHANGE_NOTIFY_TRIGGERS = """
+    DROP TRIGGER IF EXISTS {table}_notify_insert ON {table};
+    CREATE TRIGGER {table}_notify_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_changes();
+    DROP TRIGGER IF EXISTS {table}_notify_update ON {table};
+    CREATE TRIGGER {table}_notify_update AFTER UPDATE ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_changes();
+    DROP TRIGGER IF EXISTS {table}_notify_delete ON {table};
+    CREATE TRIGGER {table}_notify_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_changes();
+    DROP TRIGGER IF EXISTS {table}_notify_truncate ON {table};
+    CREATE TRIGGER {table}_notify_truncate AFTER TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_changes();
+"""
+
+# Версии схемы по порядку. Шаг миграции - Index или команда SQL;
+# примененные версии записываются в schema_migrations
+MIGRATIONS = [
+    (1, "Индексы журналов по дате: сортировка страниц и фильтр периода", [
+        Index("sales_date_id", "sales", "sale_date, id"),
+        Index("charges_date_id", "charges", "charge_date, id"),
+    ]),
+    (2, "Индексы внешних ключей журналов: отчеты и поиск по товару или статье", [
+        Index("sales_warehouse_date", "sales", "warehouse_id, sale_date"),
+        Index("charges_expense_item_date", "charges", "expense_item_id, charge_date"),
+    ]),
+    (3, "Индекс стоимости товаров для поиска в справочнике", [
+        Index("warehouses_amount", "warehouses", "amount"),
+    ]),
+    (4, "Отметки изменений и удалений для локальной копии (replica.py)", [
+        CHANGE_TRACKING_FUNCTIONS,
+        *(CHANGE_TRACKING.format(table=table) for table in TRACKED_TABLES),
+        Index("sales_updated", "sales", "updated_at, id"),
+        Index("charges_updated", "charges", "updated_at, id"),
+        Index("warehouses_updated", "warehouses", "updated_at, id"),
+        Index("expense_items_updated", "expense_items", "updated_at, id"),
+        Index("deleted_rows_deleted", "deleted_rows", "deleted_at, seq"),
+    ]),
+    (5, "Версии данных для кэша отчетов", [
+        DATA_VERSIONS.format(tables=", ".join(f"('{table}')" for table in TRACKED_TABLES)),
+        *(DATA_VERSION_TRIGGER.format(table=table) for table in TRACKED_TABLES),
+    ]),
+    (6, "Уведомления об изменениях строк для открытых окон", [
+        CHANGE_NOTIFY_FUNCTION.format(max_ids=NOTIFY_MAX_IDS),
+        *(CHANGE_NOTIFY_TRIGGERS.format(table=table) for table in TRACKED_TABLES),
+    ]),
+    (7, "Помесячные партиции журналов продаж и расходов (partitions.py)", [
+        partition_migration(),
+    ]),
+    # Таблицы, триггеры и пересчет итогов - одна команда и одна транзакция:
+    # на время пересчета запись в журналы блокируется (см. schema.install_rollups)
+    (8, "Дневные итоги продаж и расходов для отчетов (schema.py)", [
+        "LOCK TABLE sales, charges IN SHARE ROW EXCLUSIVE MODE;\n"
+        + "".join(rollup_statements()) + ROLLUP_REFRESH,
+    ]),
+    (9, "Триграммные индексы поиска по названию (pg_trgm)", [
+        Index("warehouses_name_trgm", "warehouses", "name gin_trgm_ops", "gin", "pg_trgm"),
+        Index("expense_items_name_trgm", "expense_items", "name gin_trgm_ops", "gin", "pg_trgm"),
+    ]),
+]
+
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version integer PRIMARY KEY,
+        description text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+# Миграции из нескольких копий приложения выполняются по очереди
+MIGRATIONS_LOCK = 724_001
+
+INDEX_STATUS = """
+    SELECT c.relname AS name, i.indisvalid AS valid
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+"""
+
+
+def expected_indexes():
+    return [step for _, _, steps in MIGRATIONS for step in steps if isinstance(step, Index)]
+
+
+def index_status(cursor):
+    # {имя индекса: "ok" | "invalid" | "missing" | "unavailable"}. Прерванное построение
+    # CONCURRENTLY оставляет невалидный индекс, который планировщик не использует
+    indexes = expected_indexes()
+    cursor.execute(INDEX_STATUS, ([index.name for index in indexes],))
+    found = {row[0]: row[1] for row in cursor.fetchall()}
+    cursor.execute("SELECT name FROM pg_available_extensions")
+    available = {row[0] for row in cursor.fetchall()}
+    status = {}
+    for index in indexes:
+        if index.name in found:
+            status[index.name] = "ok" if found[index.name] else "invalid"
+        elif index.extension is not None and index.extension not in available:
+            status[index.name] = "unavailable"
+        else:
+            status[index.name] = "missing"
+    return status
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return set()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def buildable_indexes(cursor):
+    # Отсутствующие и невалидные индексы, которые можно построить без версий
+    # схемы: индексы примененных версий и версий только из индексов (колонки
+    # updated_at и таблицу deleted_rows создает версия 4): [(Index, состояние)]
+    applied = applied_versions(cursor)
+    status = index_status(cursor)
+    return [
+        (step, status[step.name])
+        for version, _, steps in MIGRATIONS
+        if version in applied or all(isinstance(step, Index) for step in steps)
+        for step in steps
+        if isinstance(step, Index) and status[step.name] in ("missing", "invalid")
+    ]
+
+
+def missing_indexes(db):
+    # Проверка при запуске приложения: имена индексов, которые можно построить из приложения
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        return [index.name for index, _ in buildable_indexes(cursor)]
+
+
+def pending_versions(db):
+    # Проверка при запуске: непримененные версии схемы. Без них часть окон
+    # не работает (например, отчеты без дневных итогов версии 8)
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        applied = applied_versions(cursor)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+
+def build_index(cursor, index, status):
+    if index.extension is not None:
+        cursor.execute(f"CREATE EXTENSION IF NOT EXISTS {index.extension}")
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", (index.table,))
+    if cursor.fetchone()[0] == "p":
+        build_partitioned_index(cursor, index, status)
+        return
+    if status == "invalid":
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}")
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table} "
+                   f"USING {index.method} ({index.columns})")
+
+
+def build_partitioned_index(cursor, index, status):
+    # На таблице с партициями CONCURRENTLY не поддерживается. Индекс создается
+    # только на родительской таблице (ON ONLY, без построения), затем строится
+    # CONCURRENTLY на каждой партиции и подключается к родительскому. Индекс
+    # становится валидным, когда подключены все партиции
+    if status == "invalid":
+        cursor.execute(f"DROP INDEX IF EXISTS {index.name}")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index.name} ON ONLY {index.table} "
+                   f"USING {index.method} ({index.columns})")
+    cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass",
+                   (index.table,))
+    for partition in [row[0] for row in cursor.fetchall()]:
+        name = f"{partition}_{index.name}"
+        cursor.execute(INDEX_STATUS, ([name],))
+        found = cursor.fetchone()
+        if found is not None and not found[1]:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {partition} "
+                       f"USING {index.method} ({index.columns})")
+        cursor.execute(f"ALTER INDEX {index.name} ATTACH PARTITION {name}")
+
+
+def build_missing_indexes(db, log=None):
+    # Построение из приложения: только отсутствующие и невалидные индексы,
+    # без версий схемы. Перевод на партиции и другие шаги со строгими
+    # блокировками применяет только python migrations.py
+    log = log or (lambda message: None)
+    built = []
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK,))
+        try:
+            for index, status in buildable_indexes(cursor):
+                log(f"Индекс {index.name} ({status}): построение...")
+                build_index(cursor, index, status)
+                built.append(index.name)
+        except Exception as e:
+            raise Exception(f"Ошибка построения индексов: {e}")
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK,))
+    return built
+
+
+def migrate(db, log=None):
+    # Применяет новые версии и заново строит индексы уже примененных,
+    # если их удалили или построение было прервано. Возвращает список
+    # примененных версий. Команды версии и ее запись в schema_migrations -
+    # одна транзакция: прерванная версия не оставляет половины изменений.
+    # CONCURRENTLY не работает внутри транзакции, поэтому индексы строятся
+    # после нее в режиме autocommit; недостроенные достроит следующий запуск
+    log = log or (lambda message: None)
+    applied_now = []
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK,))
+        try:
+            cursor.execute(MIGRATIONS_TABLE)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            for version, description, steps in MIGRATIONS:
+                if version not in applied:
+                    conn.autocommit = False
+                    try:
+                        with conn:
+                            for step in steps:
+                                if not isinstance(step, Index):
+                                    cursor.execute(step)
+                            cursor.execute(
+                                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                                (version, description)
+                            )
+                    finally:
+                        conn.autocommit = True
+                    applied_now.append(version)
+                    log(f"Применена версия {version}: {description}")
+                # Состояние после версии: ее команды могли создать таблицы индексов
+                status = index_status(cursor)
+                for step in steps:
+                    if isinstance(step, Index) and status[step.name] in ("missing", "invalid"):
+                        log(f"Индекс {step.name} ({status[step.name]}): построение...")
+                        build_index(cursor, step, status[step.name])
+        except Exception as e:
+            raise Exception(f"Ошибка миграции схемы: {e}")
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK,))
+    return applied_now
+
+
+def print_status(db):
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        cursor.execute(MIGRATIONS_TABLE)
+        cursor.execute("SELECT version, applied_at FROM schema_migrations")
+        applied = dict(cursor.fetchall())
+        status = index_status(cursor)
+    for version, description, steps in MIGRATIONS:
+        when = applied[version].strftime('%Y-%m-%d %H:%M') if version in applied else "не применена"
+        print(f"{version:3} {when:>16}  {description}")
+        for step in steps:
+            if isinstance(step, Index):
+                print(f"{'':22}{step.name}: {status[step.name]}")
+    return (all(value in ("ok", "unavailable") for value in status.values())
+            and all(version in applied for version, _, _ in MIGRATIONS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Версии схемы базы и индексы, от которых зависит скорость запросов.")
+    parser.add_argument("--config", default="config.ini")
+    parser.add_argument("--status", action="store_true", help="только показать состояние; код выхода 1, если схема не актуальна")
+    args = parser.parse_args()
+
+    db = Database.from_config(load_config(args.config))
+    try:
+        if args.status:
+            sys.exit(0 if print_status(db) else 1)
+        applied = migrate(db, log=print)
+        print(f"Применено версий: {len(applied)}. Схема актуальна.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import re
+from datetime import date
+from db_utils import Database, load_config
+
+
+# Помесячные партиции журналов. Почти все запросы журналов ограничены
+# датой, поэтому Postgres читает только партиции нужных месяцев, а старые
+# месяцы можно отключить от таблицы и перенести в схему archive.
+# Таблицы переводятся на партиции миграцией (migrations.py, версия 7)
+PARTITIONED_TABLES = {"sales": "sale_date", "charges": "charge_date"}
+# На сколько месяцев вперед партиции создаются заранее
+MONTHS_AHEAD = 3
+ARCHIVE_SCHEMA = "archive"
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+# Строки вне созданных месяцев попадают в партицию по умолчанию, поэтому
+# вставка не зависит от того, успело ли приложение создать партицию.
+# При создании партиции месяца его строки переносятся из партиции по умолчанию
+PARTITION_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION create_month_partition(parent text, part_column text, month date)
+    RETURNS boolean LANGUAGE plpgsql AS $$
+    DECLARE
+        month_start date := date_trunc('month', month)::date;
+        month_end date := (date_trunc('month', month) + interval '1 month')::date;
+        part text := format('%s_y%sm%s', parent, to_char(month, 'YYYY'), to_char(month, 'MM'));
+    BEGIN
+        IF to_regclass(part) IS NOT NULL THEN
+            RETURN false;
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, parent);
+        IF to_regclass(parent || '_default') IS NOT NULL THEN
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+                parent || '_default', part_column, month_start, part_column, month_end, part);
+        END IF;
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       parent, part, month_start, month_end);
+        RETURN true;
+    END
+    $$;
+
+    CREATE OR REPLACE FUNCTION create_month_partitions(parent text, part_column text, months_ahead integer)
+    RETURNS integer LANGUAGE plpgsql AS $$
+    DECLARE
+        created integer := 0;
+    BEGIN
+        FOR i IN 0..months_ahead LOOP
+            IF create_month_partition(parent, part_column, (date_trunc('month', now()) + make_interval(months => i))::date) THEN
+                created := created + 1;
+            END IF;
+        END LOOP;
+        RETURN created;
+    END
+    $$;
+
+    -- Перевод обычной таблицы на помесячные партиции: данные копируются в новую
+    -- таблицу с теми же колонками; индексы, внешние ключи, триггеры и права
+    -- создаются заново по описанию старой таблицы. Первичный ключ включает
+    -- колонку партиционирования, как требует Postgres
+    CREATE OR REPLACE FUNCTION partition_by_month(parent text, part_column text, months_ahead integer)
+    RETURNS void LANGUAGE plpgsql AS $$
+    DECLARE
+        old text := parent || '_unpartitioned';
+        id_sequence text := pg_get_serial_sequence(parent, 'id');
+        statements text[];
+        statement text;
+        month date;
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = parent::regclass) = 'p' THEN
+            RETURN;
+        END IF;
+        SELECT array_agg(pg_get_indexdef(indexrelid)) INTO statements
+        FROM pg_index WHERE indrelid = parent::regclass AND NOT indisprimary;
+        SELECT statements || array_agg(format('ALTER TABLE %I ADD CONSTRAINT %I %s', parent, conname, pg_get_constraintdef(oid)))
+        INTO statements FROM pg_constraint WHERE conrelid = parent::regclass AND contype = 'f';
+        SELECT statements || array_agg(pg_get_triggerdef(oid)) INTO statements
+        FROM pg_trigger WHERE tgrelid = parent::regclass AND NOT tgisinternal;
+        SELECT statements || array_agg(format('GRANT %s ON %I TO %s', a.privilege_type, parent,
+                CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END))
+        INTO statements FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = parent::regclass AND a.grantee <> c.relowner;
+
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old);
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (%I)',
+                       parent, old, part_column);
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+        EXECUTE format('SELECT date_trunc(''month'', min(%I))::date FROM %I', part_column, old) INTO month;
+        month := COALESCE(month, date_trunc('month', now())::date);
+        WHILE month <= date_trunc('month', now()) + make_interval(months => months_ahead) LOOP
+            PERFORM create_month_partition(parent, part_column, month);
+            month := month + interval '1 month';
+        END LOOP;
+        -- Триггеров на новой таблице еще нет: дневные итоги и отметки изменений не пересчитываются
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', parent, old);
+        IF id_sequence IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', id_sequence, parent);
+        END IF;
+        -- Имена индексов освобождаются вместе со старой таблицей
+        EXECUTE format('DROP TABLE %I', old);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, %I)', parent, part_column);
+        FOREACH statement IN ARRAY COALESCE(statements, '{}') LOOP
+            EXECUTE statement;
+        END LOOP;
+    END
+    $$;
+"""
+
+PARTITIONS_QUERY = """
+    SELECT c.relname, c.reltuples::bigint
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    ORDER BY c.relname
+"""
+
+
+def partition_migration():
+    # Шаг миграции: функции и перевод обеих таблиц
+    return PARTITION_FUNCTIONS + "".join(
+        f"SELECT partition_by_month('{table}', '{column}', {MONTHS_AHEAD});\n"
+        for table, column in PARTITIONED_TABLES.items()
+    )
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table,))
+    return cursor.fetchone()[0]
+
+
+def partition_month(name):
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return date(int(match['year']), int(match['month']), 1)
+
+
+def create_partitions(db, months_ahead=MONTHS_AHEAD):
+    # Партиции текущего и следующих месяцев. Вызывается из планировщика
+    # (python partitions.py maintain): приложение DDL не выполняет, а строки
+    # месяца без партиции попадают в партицию по умолчанию и переносятся
+    # при ее создании. Возвращает число созданных партиций; без миграции версии 7 - 0
+    created = 0
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES.items():
+            if is_partitioned(cursor, table):
+                cursor.execute("SELECT create_month_partitions(%s, %s, %s)", (table, column, months_ahead))
+                created += cursor.fetchone()[0]
+    return created
+
+
+def archive_partitions(db, before, log=None):
+    # Отключает от таблиц партиции месяцев, закончившихся до before, и переносит
+    # их в схему archive. Дневные итоги отчетов не меняются; журналы и
+    # выгрузки перестают видеть эти строки. Возвращает имена перенесенных таблиц
+    log = log or (lambda message: None)
+    archived = []
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                raise Exception(f"Таблица {table} не разбита на партиции: python migrations.py")
+            cursor.execute(PARTITIONS_QUERY, (table,))
+            for name, _ in cursor.fetchall():
+                month = partition_month(name)
+                if month is None:
+                    continue
+                month_end = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+                if month_end > before:
+                    continue
+                # Каждая партиция - отдельная короткая транзакция: блокировка
+                # таблицы не держится на время всего архивирования
+                with conn:
+                    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+                archived.append(f"{ARCHIVE_SCHEMA}.{name}")
+                log(f"{table}: {name} перенесена в {ARCHIVE_SCHEMA}")
+    return archived
+
+
+def print_status(db):
+    with db.connection(timeout=0) as conn, conn.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                print(f"{table}: без партиций")
+                continue
+            cursor.execute(PARTITIONS_QUERY, (table,))
+            print(f"{table}:")
+            for name, rows in cursor.fetchall():
+                print(f"  {name:28} ~{max(rows, 0)} строк")
+            cursor.execute(
+                "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = %s AND c.relname LIKE %s AND c.relkind = 'r' ORDER BY c.relname",
+                (ARCHIVE_SCHEMA, f"{table}\\_y%")
+            )
+            archived = [row[0] for row in cursor.fetchall()]
+            if archived:
+                print(f"  в архиве: {', '.join(archived)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Помесячные партиции журналов продаж и расходов.")
+    parser.add_argument("--config", default="config.ini")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="партиции и архив")
+    maintain = commands.add_parser("maintain", help="создать партиции следующих месяцев")
+    maintain.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+    archive = commands.add_parser("archive", help="перенести старые месяцы в схему archive")
+    archive.add_argument("--before", type=date.fromisoformat, required=True,
+                         help="переносятся месяцы, закончившиеся до этой даты (ГГГГ-ММ-ДД)")
+    args = parser.parse_args()
+
+    db = Database.from_config(load_config(args.config))
+    try:
+        if args.command == "status":
+            print_status(db)
+        elif args.command == "maintain":
+            print(f"Создано партиций: {create_partitions(db, args.months_ahead)}")
+        else:
+            archived = archive_partitions(db, args.before, log=print)
+            print(f"Перенесено в архив: {len(archived)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
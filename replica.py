@@ -0,0 +1,518 @@
+import logging
+import re
+import sqlite3
+import threading
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from db_utils import Database, REFERENCE_QUERIES, convert_rows, load_config
+
+
+logger = logging.getLogger(__name__)
+
+# Локальная копия (SQLite) для сеансов просмотра (роль user): журналы,
+# справочники и отчеты читаются с диска клиента, основная база получает
+# только запросы синхронизации. Изменения забираются по отметкам
+# (updated_at, id) и таблице удалений deleted_rows (см. migrations.py, версия 4)
+
+# Колонки копируемых таблиц; справочники загружаются раньше журналов
+TABLES = {
+    "warehouses": ("id", "name", "quantity", "amount"),
+    "expense_items": ("id", "name"),
+    "sales": ("id", "warehouse_id", "sale_date", "quantity", "amount"),
+    "charges": ("id", "expense_item_id", "charge_date", "amount"),
+}
+
+# Объявленные типы колонок выбирают конвертеры ниже: даты и суммы
+# возвращаются теми же типами Python, что и из psycopg2. Суммы хранятся
+# целыми копейками (CENTS): сложение и умножение на количество в SQLite
+# точные, как numeric в основной базе, а REAL давал бы ошибки округления
+LOCAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS warehouses (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        amount CENTS NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS expense_items (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY,
+        warehouse_id INTEGER NOT NULL,
+        sale_date TIMESTAMP NOT NULL,
+        quantity INTEGER NOT NULL,
+        amount CENTS NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS charges (
+        id INTEGER PRIMARY KEY,
+        expense_item_id INTEGER NOT NULL,
+        charge_date DATE NOT NULL,
+        amount CENTS NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sales_date_id ON sales (sale_date, id);
+    CREATE INDEX IF NOT EXISTS sales_warehouse_date ON sales (warehouse_id, sale_date);
+    CREATE INDEX IF NOT EXISTS charges_date_id ON charges (charge_date, id);
+    CREATE INDEX IF NOT EXISTS charges_expense_item_date ON charges (expense_item_id, charge_date);
+
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day DATE NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue CENTS NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, warehouse_id)
+    );
+    CREATE TABLE IF NOT EXISTS charges_daily (
+        day DATE NOT NULL,
+        expense_item_id INTEGER NOT NULL,
+        amount CENTS NOT NULL DEFAULT 0,
+        charges_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, expense_item_id)
+    );
+
+    -- Отметка, до которой забраны изменения таблицы; complete - первая
+    -- полная загрузка закончена
+    CREATE TABLE IF NOT EXISTS replica_state (
+        table_name TEXT PRIMARY KEY,
+        changed_at TEXT NOT NULL,
+        changed_id INTEGER NOT NULL,
+        complete INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+# Дневные итоги копии ведут триггеры SQLite, как sales_daily/charges_daily
+# в основной базе, поэтому отчеты выполняются теми же запросами
+SALES_DAILY_DELTA = """
+    INSERT INTO sales_daily (day, warehouse_id, quantity, revenue, sales_count)
+    VALUES (date({row}.sale_date), {row}.warehouse_id, {sign}{row}.quantity,
+            {sign}{row}.quantity * {row}.amount, {sign}1)
+    ON CONFLICT (day, warehouse_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        sales_count = sales_count + excluded.sales_count;
+"""
+
+CHARGES_DAILY_DELTA = """
+    INSERT INTO charges_daily (day, expense_item_id, amount, charges_count)
+    VALUES ({row}.charge_date, {row}.expense_item_id, {sign}{row}.amount, {sign}1)
+    ON CONFLICT (day, expense_item_id) DO UPDATE SET
+        amount = amount + excluded.amount,
+        charges_count = charges_count + excluded.charges_count;
+"""
+
+ROLLUP_DELTAS = {
+    "sales": SALES_DAILY_DELTA,
+    "charges": CHARGES_DAILY_DELTA,
+}
+
+# Первичная загрузка журнала идет без триггеров: итоги считаются одним
+# запросом после нее, как в schema.install_rollups
+ROLLUP_REBUILD = {
+    "sales": """
+        DELETE FROM sales_daily;
+        INSERT INTO sales_daily (day, warehouse_id, quantity, revenue, sales_count)
+        SELECT date(sale_date), warehouse_id, sum(quantity), sum(quantity * amount), count(*)
+        FROM sales
+        GROUP BY 1, 2;
+    """,
+    "charges": """
+        DELETE FROM charges_daily;
+        INSERT INTO charges_daily (day, expense_item_id, amount, charges_count)
+        SELECT charge_date, expense_item_id, sum(amount), count(*)
+        FROM charges
+        GROUP BY 1, 2;
+    """,
+}
+
+# Изменения забираются порциями через серверный курсор
+SYNC_QUERY = """
+    SELECT {columns}, updated_at FROM {table}
+    WHERE (updated_at, id) > (%s::timestamptz, %s)
+    ORDER BY updated_at, id
+"""
+DELETED_QUERY = """
+    SELECT seq, table_name, id, deleted_at FROM deleted_rows
+    WHERE (deleted_at, seq) > (%s::timestamptz, %s)
+    ORDER BY deleted_at, seq
+"""
+SYNC_CHUNK = 50000
+SYNC_CACHE_KB = 65536
+
+# Версия схемы файла (PRAGMA user_version): копия старой схемы загружается заново
+LOCAL_SCHEMA_VERSION = 2
+# Колонки результатов отчетов - выражения, для них SQLite не сообщает
+# объявленный тип, и копейки переводятся в Decimal по имени колонки
+MONEY_RESULTS = frozenset(("total_sales", "total_expenses", "profit", "total_revenue", "total_amount"))
+
+
+def to_cents(value):
+    return int(value.scaleb(2).to_integral_value())
+
+
+def from_cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+sqlite3.register_adapter(Decimal, to_cents)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("CENTS", from_cents)
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+def rollup_triggers(table):
+    delta = ROLLUP_DELTAS[table]
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_daily_insert AFTER INSERT ON {table} BEGIN "
+        f"{delta.format(row='NEW', sign='')} END;",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_daily_update AFTER UPDATE ON {table} BEGIN "
+        f"{delta.format(row='OLD', sign='-')} {delta.format(row='NEW', sign='')} END;",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_daily_delete AFTER DELETE ON {table} BEGIN "
+        f"{delta.format(row='OLD', sign='-')} END;",
+    ]
+
+
+@lru_cache(maxsize=256)
+def like_regex(pattern, escape):
+    parts = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if escape and char == escape and position + 1 < len(pattern):
+            position += 1
+            parts.append(re.escape(pattern[position]))
+        elif char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+
+
+def sqlite_like(pattern, value, escape=None):
+    # Встроенный LIKE SQLite не различает регистр только для латиницы;
+    # ILIKE основной базы работает и для кириллицы
+    if pattern is None or value is None:
+        return None
+    return like_regex(pattern, escape).fullmatch(value) is not None
+
+
+def local_sql(sql):
+    # Запросы строятся теми же функциями, что и для Postgres
+    sql = sql.replace("ILIKE %s", "LIKE %s ESCAPE '\\'")
+    return sql.replace("%s", "?")
+
+
+def dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def money_results(description, rows):
+    positions = [position for position, column in enumerate(description) if column[0] in MONEY_RESULTS]
+    if not positions:
+        return rows
+    converted = []
+    for row in rows:
+        keys = [description[position][0] for position in positions] if isinstance(row, dict) else positions
+        row = dict(row) if isinstance(row, dict) else list(row)
+        for key in keys:
+            if isinstance(row[key], int):
+                row[key] = from_cents(row[key])
+        converted.append(row if isinstance(row, dict) else tuple(row))
+    return converted
+
+
+class Interrupter:
+    # CancelToken прерывает запрос вызовом conn.cancel(); у SQLite это interrupt()
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cancel(self):
+        self.connection.interrupt()
+
+
+class LocalCursor:
+    # Аналог ServerCursor для копии: страница журнала читается порциями
+    def __init__(self, connection, sql, params, row_format="dict"):
+        self.connection = connection
+        self.conn = Interrupter(connection)
+        self.exhausted = False
+        self.row_format = row_format
+        self.lock = threading.Lock()
+        try:
+            self.cursor = connection.execute(sql, params)
+        except Exception:
+            connection.close()
+            raise
+
+    def fetch(self, size):
+        with self.lock:
+            if self.exhausted:
+                return []
+            try:
+                rows = self.cursor.fetchmany(size)
+                result = convert_rows(rows, self.cursor.description, self.row_format)
+            except Exception as e:
+                self._close()
+                raise Exception(f"Ошибка чтения локальной копии: {e}")
+            if len(rows) < size:
+                self._close()
+            return result
+
+    def fetch_all(self):
+        with self.lock:
+            if self.exhausted:
+                return []
+            try:
+                return convert_rows(self.cursor.fetchall(), self.cursor.description, self.row_format)
+            except Exception as e:
+                raise Exception(f"Ошибка чтения локальной копии: {e}")
+            finally:
+                self._close()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if not self.exhausted:
+            self.exhausted = True
+            self.connection.close()
+
+
+class LocalReplica:
+    def __init__(self, db, path, sync_seconds=30, overlap_seconds=300):
+        self.db = db
+        self.path = path
+        self.sync_seconds = sync_seconds
+        # Строка с updated_at из транзакции, которая зафиксирована позже
+        # следующих, появляется "в прошлом": последние overlap секунд
+        # изменений перечитываются при каждой синхронизации
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_error = None
+        with self.connect() as local:
+            local.execute("PRAGMA journal_mode=WAL")
+            if local.execute("PRAGMA user_version").fetchone()['user_version'] != LOCAL_SCHEMA_VERSION:
+                # Копия - кэш основной базы: таблицы старой схемы пересоздаются
+                for table in (*TABLES, "sales_daily", "charges_daily", "replica_state"):
+                    local.execute(f"DROP TABLE IF EXISTS {table}")
+                local.execute(f"PRAGMA user_version = {LOCAL_SCHEMA_VERSION}")
+            local.executescript(LOCAL_SCHEMA)
+            self.ready = self._complete(local)
+        local.close()
+
+    @classmethod
+    def from_config(cls, db, config):
+        return cls(
+            db,
+            config.get('path', 'replica.sqlite3'),
+            sync_seconds=config.getint('sync_seconds', 30),
+            overlap_seconds=config.getint('overlap_seconds', 300),
+        )
+
+    def connect(self, row_format="dict"):
+        # Соединение на каждое чтение: открытие файла SQLite дешевле запроса
+        # по сети, а в режиме WAL чтение не ждет синхронизацию
+        local = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, timeout=30)
+        local.row_factory = dict_row if row_format == "dict" else None
+        local.create_function("like", 2, sqlite_like, deterministic=True)
+        local.create_function("like", 3, sqlite_like, deterministic=True)
+        return local
+
+    def _complete(self, local):
+        done = local.execute("SELECT count(*) AS done FROM replica_state WHERE complete = 1").fetchone()['done']
+        return done == len(TABLES) + 1
+
+    # Чтение
+    # row_format - как у Database.query; для dict строки собирает row_factory
+    def query(self, sql, params=(), token=None, row_format="dict"):
+        local = self.connect(row_format)
+        try:
+            with token.bind(Interrupter(local)) if token is not None else nullcontext():
+                cursor = local.execute(local_sql(sql), params)
+                rows = money_results(cursor.description, cursor.fetchall())
+                return convert_rows(rows, cursor.description, row_format)
+        except Exception as e:
+            raise Exception(f"Ошибка чтения локальной копии: {e}")
+        finally:
+            local.close()
+
+    def open_cursor(self, sql, params=(), row_format="dict"):
+        return LocalCursor(self.connect(row_format), local_sql(sql), params, row_format)
+
+    # Синхронизация
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="replica-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:
+                # Копия остается в прежнем состоянии, окна читают основную базу,
+                # пока первая загрузка не закончена
+                if str(e) != self.last_error:
+                    logger.warning("Синхронизация локальной копии: %s", e)
+                self.last_error = str(e)
+            self.stopped.wait(self.sync_seconds)
+
+    def sync(self):
+        cutoff = self.db.query("SELECT now() AS now", timeout=0)[0]['now'] - self.overlap
+        local = self.connect()
+        # Загрузка обновляет индексы журналов в случайном порядке: нужен кэш
+        # страниц больше стандартного. В режиме WAL NORMAL не рискует целостностью файла
+        local.execute(f"PRAGMA cache_size = -{SYNC_CACHE_KB}")
+        local.execute("PRAGMA synchronous = NORMAL")
+        try:
+            for table, columns in TABLES.items():
+                self._sync_table(local, table, columns, cutoff)
+                if self.stopped.is_set():
+                    return
+            self._sync_deleted(local, cutoff)
+            self.ready = self.ready or self._complete(local)
+        finally:
+            local.close()
+
+    def _watermark(self, local, table):
+        row = local.execute("SELECT changed_at, changed_id FROM replica_state WHERE table_name = ?", (table,)).fetchone()
+        return (row['changed_at'], row['changed_id']) if row else ("-infinity", 0)
+
+    def _save_watermark(self, local, table, changed_at, changed_id, complete):
+        local.execute(
+            "INSERT INTO replica_state (table_name, changed_at, changed_id, complete) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (table_name) DO UPDATE SET changed_at = excluded.changed_at, "
+            "changed_id = excluded.changed_id, complete = max(complete, excluded.complete)",
+            (table, changed_at.isoformat() if isinstance(changed_at, datetime) else changed_at, changed_id, complete)
+        )
+
+    def _read_changes(self, local, key, sql, cutoff, apply):
+        # Порции применяются в отдельных транзакциях SQLite вместе с отметкой:
+        # прерванная загрузка продолжается с места остановки. Отметка не
+        # уходит дальше cutoff, чтобы поздно зафиксированные строки не пропали
+        # Загрузка копии не ограничивается statement_timeout окон
+        cursor = self.db.open_cursor(sql, self._watermark(local, key), row_format="tuple", timeout=0)
+        try:
+            while not cursor.exhausted and not self.stopped.is_set():
+                rows = cursor.fetch(SYNC_CHUNK)
+                if not rows:
+                    break
+                with local:
+                    mark = min(apply(rows), (cutoff, 0))
+                    self._save_watermark(local, key, *mark, complete=0)
+            if cursor.exhausted:
+                with local:
+                    state = local.execute("SELECT complete FROM replica_state WHERE table_name = ?", (key,)).fetchone()
+                    if not state or not state['complete']:
+                        self._loaded(local, key)
+                    local.execute("UPDATE replica_state SET complete = 1 WHERE table_name = ?", (key,))
+                    local.execute(
+                        "INSERT OR IGNORE INTO replica_state (table_name, changed_at, changed_id, complete) "
+                        "VALUES (?, '-infinity', 0, 1)", (key,)
+                    )
+        finally:
+            cursor.close()
+
+    def _loaded(self, local, table):
+        # Первичная загрузка таблицы закончена: дальше итоги ведут триггеры
+        if table in ROLLUP_REBUILD:
+            for statement in ROLLUP_REBUILD[table].split(";"):
+                if statement.strip():
+                    local.execute(statement)
+            for statement in rollup_triggers(table):
+                local.execute(statement)
+
+    def _sync_table(self, local, table, columns, cutoff):
+        names = ", ".join(columns)
+        # Перечитанные без изменений строки (окно overlap) не трогают итоги
+        upsert = (
+            f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (id) DO UPDATE SET "
+            + ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+            + f" WHERE ({', '.join(f'{table}.{column}' for column in columns[1:])})"
+            f" IS NOT ({', '.join(f'excluded.{column}' for column in columns[1:])})"
+        )
+
+        def apply(rows):
+            local.executemany(upsert, [row[:-1] for row in rows])
+            return rows[-1][-1], rows[-1][0]
+
+        self._read_changes(local, table, SYNC_QUERY.format(columns=names, table=table), cutoff, apply)
+
+    def _sync_deleted(self, local, cutoff):
+        def apply(rows):
+            for table in TABLES:
+                ids = [(row[2],) for row in rows if row[1] == table]
+                if ids:
+                    local.executemany(f"DELETE FROM {table} WHERE id = ?", ids)
+            return rows[-1][3], rows[-1][0]
+
+        self._read_changes(local, "deleted_rows", DELETED_QUERY, cutoff, apply)
+
+
+class ReplicaDatabase:
+    # Database для сеанса просмотра: журналы, справочники и отчеты читаются из
+    # локальной копии, как только закончена первая загрузка; все остальное
+    # (вход, экспорт, запросы форм) выполняет основная база
+    def __init__(self, primary, replica):
+        self.primary = primary
+        self.replica = replica
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def get_reference(self, table):
+        if not self.replica.ready:
+            return self.primary.get_reference(table)
+        return self.replica.query(REFERENCE_QUERIES[table])
+
+    def search_reference(self, table, token=None, **filters):
+        if not self.replica.ready:
+            return self.primary.search_reference(table, token=token, **filters)
+        return self.replica.query(*Database.reference_search_query(table, **filters), token=token)
+
+    def journal_page(self, journal_type, date_from=None, date_to=None, after=None, limit=100, **filters):
+        if not self.replica.ready:
+            return self.primary.journal_page(journal_type, date_from, date_to, after, limit, **filters)
+        return self.replica.query(*Database.journal_query(journal_type, date_from, date_to, after, limit, **filters),
+                                  row_format="record")
+
+    def open_journal(self, journal_type, date_from=None, date_to=None, after=None, limit=None, **filters):
+        if not self.replica.ready:
+            return self.primary.open_journal(journal_type, date_from, date_to, after, limit, **filters)
+        return self.replica.open_cursor(*Database.journal_query(journal_type, date_from, date_to, after, limit, **filters),
+                                        row_format="record")
+
+    def query_report(self, sql, params=None, token=None):
+        if not self.replica.ready:
+            return self.primary.query_report(sql, params, token=token)
+        return self.replica.query(sql, params or (), token=token, row_format="record")
+
+    def close(self):
+        self.replica.stop()
+        self.primary.close()
+
+
+def open_replica(db, config=None):
+    # Копия включается секцией [replica] config.ini; без нее возвращается та же Database
+    config = config if config is not None else load_config()
+    parser = config.parser
+    if not parser.has_section('replica') or not parser['replica'].getboolean('enabled', False):
+        return db
+    replica = LocalReplica.from_config(db, parser['replica'])
+    replica.start()
+    return ReplicaDatabase(db, replica)
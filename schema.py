@@ -0,0 +1,173 @@
+import logging
+import sys
+from db_utils import Database, load_config
+
+
+logger = logging.getLogger(__name__)
+
+# Дневные итоги продаж и расходов. Отчеты читают их вместо sales/charges,
+# поэтому время отчета зависит от числа дней, а не от числа операций
+ROLLUP_TABLES = """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day date NOT NULL,
+        warehouse_id integer NOT NULL,
+        quantity bigint NOT NULL DEFAULT 0,
+        revenue numeric NOT NULL DEFAULT 0,
+        sales_count bigint NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, warehouse_id)
+    );
+    CREATE TABLE IF NOT EXISTS charges_daily (
+        day date NOT NULL,
+        expense_item_id integer NOT NULL,
+        amount numeric NOT NULL DEFAULT 0,
+        charges_count bigint NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, expense_item_id)
+    );
+"""
+
+# Триггеры уровня оператора с таблицами переходов: один COPY или массовое
+# удаление дает одно обновление итогов на каждый затронутый день, а не на строку.
+# Ключи сортируются, чтобы параллельные транзакции блокировали строки итогов
+# в одном порядке
+SALES_DAILY_DELTA = """
+    INSERT INTO sales_daily AS d (day, warehouse_id, quantity, revenue, sales_count)
+    SELECT sale_date::date, warehouse_id, {sign} sum(quantity), {sign} sum(quantity * amount), {sign} count(*)
+    FROM {rows}
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, warehouse_id) DO UPDATE SET
+        quantity = d.quantity + EXCLUDED.quantity,
+        revenue = d.revenue + EXCLUDED.revenue,
+        sales_count = d.sales_count + EXCLUDED.sales_count;
+"""
+
+CHARGES_DAILY_DELTA = """
+    INSERT INTO charges_daily AS d (day, expense_item_id, amount, charges_count)
+    SELECT charge_date, expense_item_id, {sign} sum(amount), {sign} count(*)
+    FROM {rows}
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, expense_item_id) DO UPDATE SET
+        amount = d.amount + EXCLUDED.amount,
+        charges_count = d.charges_count + EXCLUDED.charges_count;
+"""
+
+ROLLUP_FUNCTION = """
+    CREATE OR REPLACE FUNCTION {table}_daily_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {subtract}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {add}
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+ROLLUP_TRIGGERS = """
+    DROP TRIGGER IF EXISTS {table}_daily_insert ON {table};
+    CREATE TRIGGER {table}_daily_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_daily_apply();
+    DROP TRIGGER IF EXISTS {table}_daily_update ON {table};
+    CREATE TRIGGER {table}_daily_update AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_daily_apply();
+    DROP TRIGGER IF EXISTS {table}_daily_delete ON {table};
+    CREATE TRIGGER {table}_daily_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_daily_apply();
+"""
+
+ROLLUP_REFRESH = """
+    TRUNCATE sales_daily, charges_daily;
+    INSERT INTO sales_daily (day, warehouse_id, quantity, revenue, sales_count)
+    SELECT sale_date::date, warehouse_id, sum(quantity), sum(quantity * amount), count(*)
+    FROM sales
+    GROUP BY 1, 2;
+    INSERT INTO charges_daily (day, expense_item_id, amount, charges_count)
+    SELECT charge_date, expense_item_id, sum(amount), count(*)
+    FROM charges
+    GROUP BY 1, 2;
+"""
+
+ROLLUP_DELTAS = {
+    "sales": SALES_DAILY_DELTA,
+    "charges": CHARGES_DAILY_DELTA,
+}
+
+
+# Индексы поиска по названию в окнах журналов и справочников. Поиск по
+# подстроке (ILIKE '%...%') обычный B-tree не ускоряет, нужен триграммный
+# индекс из расширения pg_trgm; по найденным товарам и статьям строки
+# журналов выбираются по индексам внешних ключей (см. migrations.py)
+SEARCH_EXTENSION = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+
+TRIGRAM_INDEXES = """
+    CREATE INDEX IF NOT EXISTS warehouses_name_trgm ON warehouses USING gin (name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS expense_items_name_trgm ON expense_items USING gin (name gin_trgm_ops);
+"""
+
+
+def rollup_statements():
+    statements = [ROLLUP_TABLES]
+    for table, delta in ROLLUP_DELTAS.items():
+        statements.append(ROLLUP_FUNCTION.format(
+            table=table,
+            subtract=delta.format(sign="-", rows="old_rows"),
+            add=delta.format(sign="", rows="new_rows"),
+        ))
+        statements.append(ROLLUP_TRIGGERS.format(table=table))
+    return statements
+
+
+def install_rollups(db):
+    # Таблицы, триггеры и первичное заполнение создаются в одной транзакции.
+    # На время пересчета запись в журналы блокируется, чтобы ни одна
+    # операция не была учтена дважды или пропущена
+    with db.transaction() as cursor:
+        cursor.execute("LOCK TABLE sales, charges IN SHARE ROW EXCLUSIVE MODE")
+        for statement in rollup_statements():
+            cursor.execute(statement)
+        cursor.execute(ROLLUP_REFRESH)
+
+
+def install_search_indexes(db):
+    # Возвращает False, если pg_trgm на сервере недоступно: поиск по
+    # названию тогда работает, но просматривает справочник целиком
+    try:
+        with db.transaction() as cursor:
+            cursor.execute(SEARCH_EXTENSION)
+            cursor.execute(TRIGRAM_INDEXES)
+    except Exception as e:
+        logger.warning("Триграммные индексы не созданы: %s", e)
+        return False
+    return True
+
+
+def refresh_rollups(db):
+    # Полный пересчет итогов (например, после TRUNCATE журналов, который триггеры не видят)
+    with db.transaction() as cursor:
+        cursor.execute("LOCK TABLE sales, charges IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(ROLLUP_REFRESH)
+
+
+def main():
+    db = Database.from_config(load_config())
+    try:
+        if "--refresh" in sys.argv[1:]:
+            refresh_rollups(db)
+            print("Дневные итоги пересчитаны.")
+        else:
+            install_rollups(db)
+            print("Таблицы дневных итогов установлены.")
+            if install_search_indexes(db):
+                print("Индексы поиска по названию созданы.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QComboBox, QDateEdit, QLineEdit, QPushButton, QLabel, QMessageBox
+from datetime import datetime
+
+
+# Поля, которые можно задать сразу нескольким строкам:
+# (колонка, подпись, вид значения - справочник, "date" или "number")
+BULK_FIELDS = {
+    "sales": [
+        ("warehouse_id", "Товар", "warehouses"),
+        ("sale_date", "Дата продажи", "date"),
+        ("quantity", "Количество", "number"),
+        ("amount", "Цена за единицу", "number"),
+    ],
+    "charges": [
+        ("expense_item_id", "Статья расхода", "expense_items"),
+        ("charge_date", "Дата", "date"),
+        ("amount", "Сумма", "number"),
+    ],
+    "warehouses": [
+        ("quantity", "Количество", "number"),
+        ("amount", "Стоимость", "number"),
+    ],
+}
+
+
+class BulkEditForm(QDialog):
+    # Одно значение поля для всех выбранных строк. Сохранение выполняет окно
+    # списка через Database.update_many, форма только собирает значение
+    def __init__(self, db, table, count):
+        super().__init__()
+        self.db = db
+        self.table = table
+        self.count = count
+        self.values = None
+        self.init_ui()
+
+    def init_ui(self):
+        self.setWindowTitle("Изменить выбранные записи")
+        self.setFixedSize(300, 200)
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(f"Выбрано записей: {self.count}"))
+
+        self.field_combo = QComboBox()
+        for column, title, _ in BULK_FIELDS[self.table]:
+            self.field_combo.addItem(title, column)
+        self.field_combo.currentIndexChanged.connect(self.show_editor)
+        layout.addWidget(QLabel("Поле:"))
+        layout.addWidget(self.field_combo)
+
+        # Редактор значения для каждого поля, виден только редактор выбранного
+        layout.addWidget(QLabel("Новое значение:"))
+        self.editors = []
+        for _, _, kind in BULK_FIELDS[self.table]:
+            if kind == "date":
+                editor = QDateEdit()
+                editor.setCalendarPopup(True)
+                editor.setDate(datetime.today())
+            elif kind == "number":
+                editor = QLineEdit()
+            else:
+                # Список берется из общего кэша справочников
+                from views.journal_view import reference_combo_model
+                editor = QComboBox()
+                editor.setModel(reference_combo_model(self.db, kind))
+            editor.hide()
+            layout.addWidget(editor)
+            self.editors.append(editor)
+        self.show_editor(0)
+
+        self.save_button = QPushButton("Сохранить")
+        self.save_button.clicked.connect(self.handle_save)
+        layout.addWidget(self.save_button)
+
+        self.setLayout(layout)
+
+    def show_editor(self, index):
+        for position, editor in enumerate(self.editors):
+            editor.setVisible(position == index)
+
+    def handle_save(self):
+        index = self.field_combo.currentIndex()
+        column, _, kind = BULK_FIELDS[self.table][index]
+        editor = self.editors[index]
+        if kind == "date":
+            value = editor.date().toPyDate()
+        elif kind == "number":
+            value = editor.text().strip()
+        else:
+            value = editor.currentData()
+        if value in (None, ""):
+            QMessageBox.warning(self, "Ошибка", "Укажите новое значение.")
+            return
+        self.values = {column: value}
+        self.accept()
@@ -0,0 +1,229 @@
+import time
+from PyQt5.QtCore import QThreadPool
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QGridLayout, QGroupBox, QLabel, QPushButton,
+                             QSpinBox, QScrollArea, QWidget, QTableWidget, QTableWidgetItem,
+                             QHeaderView)
+from db_utils import CancelToken, last_months
+from views.workers import run_in_background, loading_indicator
+
+
+# Потоки панели отчетов. Пул общий для всех окон: пул, принадлежащий окну,
+# при закрытии ждал бы завершения начатых запросов
+_report_pool = None
+
+
+def report_pool(size):
+    # Потоков столько же, сколько соединений в пуле базы: каждый поток почти
+    # все время ждет сервер, а лишние задачи все равно ждали бы соединение
+    global _report_pool
+    if _report_pool is None:
+        _report_pool = QThreadPool()
+    _report_pool.setMaxThreadCount(size)
+    return _report_pool
+
+
+def timed_report(db, report_query, token):
+    started = time.perf_counter()
+    rows = db.query_report(*report_query, token=token)
+    return rows, (time.perf_counter() - started) * 1000
+
+
+class DashboardPanel(QGroupBox):
+    # Таблица панели с индикатором загрузки; строки заполняются по мере
+    # прихода результатов
+    def __init__(self, title, headers, rows=0):
+        super().__init__(title)
+        layout = QVBoxLayout()
+        self.loading_indicator = loading_indicator()
+        layout.addWidget(self.loading_indicator)
+        self.table = QTableWidget(rows, len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.table.setMinimumHeight(150)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+        self.pending = 0
+
+    def start(self):
+        # На панели может быть несколько запросов (прибыль - по одному на месяц)
+        self.pending += 1
+        self.loading_indicator.show()
+
+    def finish(self):
+        self.pending -= 1
+        self.loading_indicator.setVisible(self.pending > 0)
+
+    def cancel(self):
+        if self.pending:
+            self.pending = 0
+            self.loading_indicator.hide()
+            self.setTitle(f"{self.title()} - отменено")
+
+    def set_row(self, row_idx, values):
+        if row_idx >= self.table.rowCount():
+            self.table.setRowCount(row_idx + 1)
+        for col_idx, value in enumerate(values):
+            self.table.setItem(row_idx, col_idx, QTableWidgetItem(str(value)))
+
+    def set_rows(self, rows):
+        self.table.setRowCount(len(rows))
+        for row_idx, values in enumerate(rows):
+            self.set_row(row_idx, values)
+
+
+class DashboardView(QDialog):
+    # Прибыль, топ товаров и расходы по статьям за последние месяцы. Запросы
+    # независимы: каждый выполняется в своем потоке на своем соединении пула,
+    # панель заполняется, как только пришел ее результат, и вся панель
+    # загружается примерно за время самого долгого запроса
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+        self.thread_pool = report_pool(db.maxconn)
+        # Номер загрузки: результаты предыдущего обновления не попадают в новые панели
+        self.generation = 0
+        self.pending = 0
+        # Отмена запросов текущей загрузки
+        self.tokens = []
+        self.init_ui()
+        self.load_data()
+
+    def init_ui(self):
+        self.setWindowTitle("Панель отчетов")
+        self.resize(900, 700)
+
+        layout = QVBoxLayout()
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Месяцев:"))
+        self.months_input = QSpinBox()
+        self.months_input.setRange(1, 24)
+        self.months_input.setValue(3)
+        controls.addWidget(self.months_input)
+        controls.addWidget(QLabel("Товаров в топе:"))
+        self.top_input = QSpinBox()
+        self.top_input.setRange(1, 50)
+        self.top_input.setValue(5)
+        controls.addWidget(self.top_input)
+        self.refresh_button = QPushButton("Обновить")
+        self.refresh_button.clicked.connect(self.load_data)
+        controls.addWidget(self.refresh_button)
+        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button.clicked.connect(self.cancel_load)
+        self.cancel_button.hide()
+        controls.addWidget(self.cancel_button)
+        controls.addStretch()
+        self.status_label = QLabel()
+        controls.addWidget(self.status_label)
+        layout.addLayout(controls)
+
+        scroll = QScrollArea()
+        scroll.setWidgetResizable(True)
+        self.panels_widget = QWidget()
+        self.panels_layout = QGridLayout(self.panels_widget)
+        scroll.setWidget(self.panels_widget)
+        layout.addWidget(scroll)
+
+        self.setLayout(layout)
+
+    def clear_panels(self):
+        while self.panels_layout.count():
+            widget = self.panels_layout.takeAt(0).widget()
+            if widget is not None:
+                widget.deleteLater()
+
+    def cancel_tokens(self):
+        # В потоке окна: задачи отмены в пуле панели ждали бы своей очереди
+        for token in self.tokens:
+            token.cancel()
+        self.tokens = []
+
+    def cancel_load(self):
+        # Выполняющиеся запросы прерываются на сервере, ожидающие в очереди
+        # завершаются сразу; панели с полученными данными остаются
+        self.cancel_tokens()
+        self.generation += 1
+        for idx in range(self.panels_layout.count()):
+            self.panels_layout.itemAt(idx).widget().cancel()
+        self.cancel_button.hide()
+        self.status_label.setText(f"Отменено, не загружено запросов: {self.pending}")
+
+    def load_data(self):
+        # Запросы предыдущей загрузки больше не нужны
+        self.cancel_tokens()
+        self.generation += 1
+        self.clear_panels()
+        months = last_months(self.months_input.value())
+        top_limit = self.top_input.value()
+
+        profit_panel = DashboardPanel("Прибыль по месяцам", ["Месяц", "Выручка", "Расходы", "Прибыль"], len(months))
+        self.panels_layout.addWidget(profit_panel, 0, 0, 1, 2)
+        # Каждая задача: (панель, запрос, заполнение панели результатом)
+        tasks = []
+        for row_idx, (start, end, title) in enumerate(months):
+            profit_panel.set_row(row_idx, [title, "…", "…", "…"])
+            tasks.append((profit_panel, self.db.profit_query(start, end),
+                          lambda panel, rows, row_idx=row_idx, title=title: panel.set_row(
+                              row_idx, [title, rows[0]['total_sales'], rows[0]['total_expenses'], rows[0]['profit']])))
+
+            top_panel = DashboardPanel(f"Топ-{top_limit} товаров: {title}", ["Товар", "Выручка"])
+            expense_panel = DashboardPanel(f"Расходы по статьям: {title}", ["Статья", "Сумма"])
+            self.panels_layout.addWidget(top_panel, row_idx + 1, 0)
+            self.panels_layout.addWidget(expense_panel, row_idx + 1, 1)
+            tasks.append((top_panel, self.db.top_items_query(start, end, top_limit),
+                          lambda panel, rows: panel.set_rows([(row['item_name'], row['total_revenue']) for row in rows])))
+            tasks.append((expense_panel, self.db.expense_breakdown_query(start, end),
+                          lambda panel, rows: panel.set_rows([(row['item_name'], row['total_amount']) for row in rows])))
+
+        self.pending = len(tasks)
+        self.slowest_ms = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.status_label.setText(f"Загрузка: {self.pending} запросов…")
+        self.cancel_button.show()
+        for panel, report_query, show in tasks:
+            panel.start()
+            token = CancelToken()
+            self.tokens.append(token)
+            run_in_background(
+                timed_report, self.db, report_query, token,
+                on_result=lambda result, panel=panel, show=show, generation=self.generation:
+                    self.panel_ready(generation, panel, show, result),
+                on_error=lambda message, panel=panel, generation=self.generation:
+                    self.panel_failed(generation, panel, message),
+                owner=self,
+                pool=self.thread_pool,
+            )
+
+    def panel_ready(self, generation, panel, show, result):
+        if generation != self.generation:
+            return
+        rows, elapsed_ms = result
+        panel.finish()
+        show(panel, rows)
+        self.slowest_ms = max(self.slowest_ms, elapsed_ms)
+        self.task_done()
+
+    def panel_failed(self, generation, panel, message):
+        # Ошибка показывается в самой панели: остальные панели загружаются дальше
+        if generation != self.generation:
+            return
+        panel.finish()
+        panel.setTitle(f"{panel.title()} - ошибка")
+        panel.setToolTip(message)
+        self.failed += 1
+        self.task_done()
+
+    def task_done(self):
+        self.pending -= 1
+        if self.pending:
+            self.status_label.setText(f"Загрузка: осталось {self.pending} запросов…")
+            return
+        self.tokens = []
+        self.cancel_button.hide()
+        total_ms = (time.perf_counter() - self.started) * 1000
+        status = f"Загружено за {total_ms:.0f} мс (самый долгий запрос {self.slowest_ms:.0f} мс)"
+        if self.failed:
+            status += f", ошибок: {self.failed}"
+        self.status_label.setText(status)
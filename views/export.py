@@ -0,0 +1,52 @@
+from PyQt5.QtWidgets import QFileDialog, QProgressDialog, QMessageBox
+from PyQt5.QtCore import Qt
+import os
+from db_utils import CancelToken
+from views.workers import run_in_background
+
+
+def export_to_file(db, sql, params, path, progress=None, token=None):
+    # Выполняется в фоновом потоке: COPY TO STDOUT пишет прямо в файл
+    with open(path, "wb") as file:
+        return db.copy_out(sql, params, file, progress=progress, token=token)
+
+
+def start_export(parent, db, sql, params, default_name):
+    path, _ = QFileDialog.getSaveFileName(parent, "Сохранить в CSV", default_name, "CSV (*.csv)")
+    if not path:
+        return
+
+    token = CancelToken()
+    dialog = QProgressDialog("Выгрузка данных...", "Отмена", 0, 0, parent)
+    dialog.setWindowTitle("Экспорт")
+    dialog.setWindowModality(Qt.WindowModal)
+    dialog.setMinimumDuration(0)
+    dialog.canceled.connect(token.cancel)
+
+    def close_dialog():
+        # closeEvent диалога тоже выдает canceled, поэтому сначала отключаем отмену
+        dialog.canceled.disconnect(token.cancel)
+        dialog.close()
+
+    def finished(rows):
+        close_dialog()
+        QMessageBox.information(parent, "Экспорт", f"Выгружено строк: {rows}\nФайл: {path}")
+
+    def failed(message):
+        close_dialog()
+        # Недописанный файл не оставляем
+        if os.path.exists(path):
+            os.remove(path)
+        if token.cancelled:
+            QMessageBox.information(parent, "Экспорт", "Выгрузка отменена.")
+        else:
+            QMessageBox.critical(parent, "Ошибка", f"Не удалось выгрузить данные: {message}")
+
+    run_in_background(
+        export_to_file, db, sql, params, path, token=token,
+        on_progress=lambda rows: dialog.setLabelText(f"Выгружено строк: {rows}"),
+        on_result=finished,
+        on_error=failed,
+        owner=parent,
+    )
+    dialog.show()
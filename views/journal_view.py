@@ -1,6 +1,103 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QHBoxLayout, QComboBox, QDateEdit, QMessageBox, QLabel, QLineEdit
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QTableView, QAbstractItemView, QPushButton, QHBoxLayout, QComboBox, QDateEdit, QMessageBox, QLabel, QLineEdit, QFileDialog
+from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+import asyncio
 from datetime import datetime
+from views.table_model import LazyTableModel
+from views.workers import run_in_background, run_async, async_enabled, loading_indicator, watch_changes
+from views.export import start_export
+from views.bulk_edit_form import BulkEditForm
+from views.search import debounce_timer, search_input, parse_amount, row_matches
+from db_utils import CancelToken, JOURNALS
+
+
+JOURNAL_COLUMNS = {
+    "sales": [
+        ("id", "ID", str),
+        ("warehouse_name", "Товар", str),
+        ("sale_date", "Дата продажи", lambda value: value.strftime('%Y-%m-%d %H:%M:%S')),
+        ("quantity", "Количество", str),
+        ("amount", "Цена за единицу", str),
+    ],
+    "charges": [
+        ("id", "ID", str),
+        ("expense_item", "Статья расхода", str),
+        ("charge_date", "Дата", lambda value: value.strftime('%Y-%m-%d')),
+        ("amount", "Сумма", str),
+    ],
+}
+
+# Размер страницы журнала: строки страницы читаются порциями по CHUNK_SIZE
+PAGE_SIZE = 1000
+CHUNK_SIZE = 200
+# Больше измененных строк за одно уведомление - одна замена модели вместо построчных сигналов
+MAX_ROW_SIGNALS = 50
+# По умолчанию журнал показывает последние дни, а не всю историю
+DEFAULT_PERIOD_DAYS = 7
+
+
+# Модели выпадающих списков строятся один раз на версию справочника
+# и разделяются всеми формами
+_combo_models = {}
+
+
+def reference_combo_model(db, table):
+    rows = db.get_reference(table)
+    cached = _combo_models.get(table)
+    if cached is not None and cached[0] is rows:
+        return cached[1]
+    model = QStandardItemModel()
+    for row in rows:
+        item = QStandardItem(row['name'])
+        item.setData(row['id'], Qt.UserRole)
+        model.appendRow(item)
+    _combo_models[table] = (rows, model)
+    return model
+
+
+# Ожидаемые колонки CSV для загрузки журналов (первая строка файла - заголовок)
+IMPORT_HINTS = {
+    "sales": "товар, дата продажи, количество, цена за единицу",
+    "charges": "статья расхода, дата, сумма",
+}
+
+
+def import_csv_file(db, journal_type, path):
+    # Файл открывается в фоновом потоке и передается в COPY блоками
+    with open(path, "rb") as file:
+        return db.import_journal_csv(journal_type, file)
+
+
+# Запись журнала для формы изменения
+RECORD_QUERIES = {
+    "sales": "SELECT warehouse_id, sale_date, quantity, amount FROM sales WHERE id = %s",
+    "charges": "SELECT expense_item_id, charge_date, amount FROM charges WHERE id = %s",
+}
+
+
+async def load_form_data(db, journal_type, table, record_id):
+    # Справочник для выпадающего списка и изменяемая запись читаются одновременно
+    if record_id is None:
+        return await db.aio.get_reference(table), None
+    references, record = await asyncio.gather(
+        db.aio.get_reference(table),
+        db.aio.query(RECORD_QUERIES[journal_type], (record_id,)),
+    )
+    return references, record[0] if record else None
+
+
+def open_page(db, journal_type, filters, after, token):
+    # Открытие курсора и чтение первой порции выполняются в фоновом потоке.
+    # Первая порция - самая долгая часть запроса, ее прерывает token
+    # Лишняя строка сверх страницы показывает, есть ли следующая страница
+    source = db.open_journal(journal_type, after=after, limit=PAGE_SIZE + 1, **filters)
+    try:
+        with token.bind(source.conn):
+            return source, source.fetch(CHUNK_SIZE)
+    except Exception:
+        source.close()
+        raise
+
 
 class JournalView(QDialog):
     def __init__(self, db, journal_type, user_role):
@@ -17,18 +114,79 @@ class JournalView(QDialog):
 
         layout = QVBoxLayout()
 
-        # Таблица
-        self.table = QTableWidget()
-        if self.journal_type == "sales":
-            self.table.setColumnCount(5)
-            self.table.setHorizontalHeaderLabels(["ID", "Товар", "Дата продажи", "Количество", "Цена за единицу"])
-        elif self.journal_type == "charges":
-            self.table.setColumnCount(4)
-            self.table.setHorizontalHeaderLabels(["ID", "Статья расхода", "Дата", "Сумма"])
-
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)  # Только просмотр
+        # Фильтры по датам, названию и сумме: условия передаются в запрос на сервер
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("С:"))
+        self.date_from_input = QDateEdit()
+        self.date_from_input.setCalendarPopup(True)
+        self.date_from_input.setDate(QDate.currentDate().addDays(-DEFAULT_PERIOD_DAYS))
+        filter_layout.addWidget(self.date_from_input)
+        filter_layout.addWidget(QLabel("По:"))
+        self.date_to_input = QDateEdit()
+        self.date_to_input.setCalendarPopup(True)
+        self.date_to_input.setDate(QDate.currentDate())
+        filter_layout.addWidget(self.date_to_input)
+        self.apply_button = QPushButton("Показать")
+        self.apply_button.clicked.connect(self.apply_filter)
+        filter_layout.addWidget(self.apply_button)
+        self.export_button = QPushButton("Экспорт CSV")
+        self.export_button.clicked.connect(self.export_csv)
+        filter_layout.addWidget(self.export_button)
+        layout.addLayout(filter_layout)
+
+        search_layout = QHBoxLayout()
+        self.name_input = search_input("Товар" if self.journal_type == "sales" else "Статья расхода")
+        search_layout.addWidget(self.name_input)
+        search_layout.addWidget(QLabel("Сумма от:"))
+        self.amount_from_input = search_input("", width=90)
+        search_layout.addWidget(self.amount_from_input)
+        search_layout.addWidget(QLabel("до:"))
+        self.amount_to_input = search_input("", width=90)
+        search_layout.addWidget(self.amount_to_input)
+        layout.addLayout(search_layout)
+
+        # Запрос уходит после паузы во вводе; запрос по предыдущему
+        # состоянию фильтра прерывается сразу
+        self.search_timer = debounce_timer(self, self.apply_filter)
+        for field in (self.name_input, self.amount_from_input, self.amount_to_input):
+            field.textChanged.connect(self.filter_changed)
+        self.date_from_input.dateChanged.connect(self.filter_changed)
+        self.date_to_input.dateChanged.connect(self.filter_changed)
+
+        # Таблица: строки подгружаются порциями по мере прокрутки
+        self.model = LazyTableModel(JOURNAL_COLUMNS[self.journal_type], chunk_size=CHUNK_SIZE, parent=self)
+        self.model.fetch_failed.connect(self.show_load_error)
+        loading_layout = QHBoxLayout()
+        self.loading_indicator = loading_indicator()
+        self.model.loading_changed.connect(self.loading_indicator.setVisible)
+        loading_layout.addWidget(self.loading_indicator)
+        # Долгий запрос страницы можно прервать, не закрывая окно
+        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button.clicked.connect(self.cancel_clicked)
+        self.cancel_button.hide()
+        loading_layout.addWidget(self.cancel_button)
+        layout.addLayout(loading_layout)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Несколько строк выделяются для массового изменения и удаления
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Только просмотр
         layout.addWidget(self.table)
 
+        # Постраничный просмотр
+        page_layout = QHBoxLayout()
+        self.prev_button = QPushButton("◀ Назад")
+        self.prev_button.clicked.connect(self.prev_page)
+        page_layout.addWidget(self.prev_button)
+        self.page_label = QLabel()
+        self.page_label.setAlignment(Qt.AlignCenter)
+        page_layout.addWidget(self.page_label)
+        self.next_button = QPushButton("Вперёд ▶")
+        self.next_button.clicked.connect(self.next_page)
+        page_layout.addWidget(self.next_button)
+        layout.addLayout(page_layout)
+
         # Кнопки управления
         button_layout = QHBoxLayout()
         if self.user_role == "admin":
@@ -44,47 +202,252 @@ class JournalView(QDialog):
             self.delete_button.clicked.connect(self.delete_record)
             button_layout.addWidget(self.delete_button)
 
+            self.import_button = QPushButton("Импорт CSV")
+            self.import_button.clicked.connect(self.import_csv)
+            button_layout.addWidget(self.import_button)
+
         layout.addLayout(button_layout)
 
         self.setLayout(layout)
 
+        # Ключи начала просмотренных страниц: None - первая страница
+        self.page_keys = [None]
+        # Номер последнего запроса страницы: ответы на устаревшие запросы отбрасываются
+        self.load_generation = 0
+        # Отмена запроса страницы, который еще выполняется
+        self.load_token = None
+
+        # Изменения из других окон и программ приходят уведомлениями: окно
+        # перечитывает только измененные строки
+        journal = JOURNALS[self.journal_type]
+        self.unwatch_changes = watch_changes(self.db, (journal["table"], journal["reference"]), self.data_changed, self)
+
         # Загрузка данных
         self.load_data()
 
+    def filters(self):
+        return {
+            "date_from": self.date_from_input.date().toPyDate(),
+            "date_to": self.date_to_input.date().toPyDate(),
+            "name": self.name_input.text().strip(),
+            "amount_from": parse_amount(self.amount_from_input.text()),
+            "amount_to": parse_amount(self.amount_to_input.text()),
+        }
+
+    def cancel_load(self):
+        # Ответ на прерванный запрос отбрасывается по номеру запроса.
+        # Отмена - короткий запрос к серверу по отдельному соединению, поэтому
+        # выполняется в потоке окна: фоновая задача могла бы ждать в очереди
+        # пула потоков за тем самым запросом, который нужно прервать
+        self.load_generation += 1
+        self.cancel_button.hide()
+        if self.load_token is not None:
+            self.load_token.cancel()
+            self.load_token = None
+
+    def cancel_clicked(self):
+        self.cancel_load()
+        self.loading_indicator.hide()
+
+    def filter_changed(self):
+        self.cancel_load()
+        self.search_timer.start()
+
     def load_data(self):
-        try:
-            if self.journal_type == "sales":
-                # Загрузка данных о продажах
-                data = self.db.query("""
-                    SELECT s.id, w.name AS warehouse_name, s.sale_date, s.quantity, s.amount
-                    FROM sales s
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    ORDER BY s.sale_date DESC
-                """)
-                self.table.setRowCount(len(data))
-                for row_idx, row in enumerate(data):
-                    self.table.setItem(row_idx, 0, QTableWidgetItem(str(row['id'])))
-                    self.table.setItem(row_idx, 1, QTableWidgetItem(row['warehouse_name']))
-                    self.table.setItem(row_idx, 2, QTableWidgetItem(row['sale_date'].strftime('%Y-%m-%d %H:%M:%S')))
-                    self.table.setItem(row_idx, 3, QTableWidgetItem(str(row['quantity'])))
-                    self.table.setItem(row_idx, 4, QTableWidgetItem(str(row['amount'])))
-
-            elif self.journal_type == "charges":
-                # Загрузка данных о расходах
-                data = self.db.query("""
-                    SELECT c.id, e.name AS expense_item, c.charge_date, c.amount
-                    FROM charges c
-                    JOIN expense_items e ON c.expense_item_id = e.id
-                    ORDER BY c.charge_date DESC
-                """)
-                self.table.setRowCount(len(data))
-                for row_idx, row in enumerate(data):
-                    self.table.setItem(row_idx, 0, QTableWidgetItem(str(row['id'])))
-                    self.table.setItem(row_idx, 1, QTableWidgetItem(row['expense_item']))
-                    self.table.setItem(row_idx, 2, QTableWidgetItem(row['charge_date'].strftime('%Y-%m-%d')))
-                    self.table.setItem(row_idx, 3, QTableWidgetItem(str(row['amount'])))
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {e}")
+        self.page_label.setText(f"Страница {len(self.page_keys)}")
+        self.prev_button.setEnabled(len(self.page_keys) > 1)
+        self.search_timer.stop()
+        self.cancel_load()
+        generation = self.load_generation
+        self.load_token = token = CancelToken()
+        self.loading_indicator.show()
+        self.cancel_button.show()
+        # Запрос выполняется через серверный курсор: в память попадают
+        # только просмотренные пользователем строки текущей страницы
+        run_in_background(
+            open_page, self.db, self.journal_type, self.filters(), self.page_keys[-1], token,
+            on_result=lambda result: self.page_loaded(generation, result),
+            on_error=lambda message: self.page_failed(generation, message),
+            owner=self,
+            on_orphan=lambda result: run_in_background(result[0].close),
+        )
+
+    def page_loaded(self, generation, result):
+        source, rows = result
+        if generation != self.load_generation:
+            run_in_background(source.close)
+            return
+        self.load_token = None
+        self.cancel_button.hide()
+        self.loading_indicator.hide()
+        self.model.set_source(source, rows, limit=PAGE_SIZE)
+
+    def page_failed(self, generation, message):
+        if generation != self.load_generation:
+            return
+        self.load_token = None
+        self.cancel_button.hide()
+        self.loading_indicator.hide()
+        self.show_load_error(message)
+
+    def show_load_error(self, message):
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {message}")
+
+    def apply_filter(self):
+        self.page_keys = [None]
+        self.load_data()
+
+    def next_page(self):
+        # Для ключа следующей страницы нужна последняя строка текущей
+        self.model.fetch_all(on_done=self.open_next_page)
+
+    def open_next_page(self):
+        if not self.model.has_more:
+            QMessageBox.information(self, "Журнал", "Это последняя страница.")
+            return
+        self.page_keys.append(self.db.journal_key(self.journal_type, self.model.last_received))
+        self.load_data()
+
+    def prev_page(self):
+        if len(self.page_keys) > 1:
+            self.page_keys.pop()
+            self.load_data()
+
+    def done(self, result):
+        # Закрываем курсор и его соединение вместе с окном
+        self.unwatch_changes()
+        self.search_timer.stop()
+        self.cancel_load()
+        self.model.close_source()
+        super().done(result)
+
+    def selected_record_ids(self):
+        return [self.model.row_at(index.row())['id'] for index in self.table.selectionModel().selectedRows()]
+
+    def row_in_view(self, row):
+        # Попадает ли строка в текущий фильтр и на текущую страницу
+        filters = self.filters()
+        key = self.db.journal_key(self.journal_type, row)
+        row_date = key[0].date() if isinstance(key[0], datetime) else key[0]
+        if not filters["date_from"] <= row_date <= filters["date_to"]:
+            return False
+        if not row_matches(row, JOURNALS[self.journal_type]["name_key"], filters["name"],
+                           filters["amount_from"], filters["amount_to"]):
+            return False
+        return self.page_keys[-1] is None or key < self.page_keys[-1]
+
+    def insert_position(self, row):
+        # Место строки среди загруженных или None, если она ниже загруженной части страницы
+        key = self.db.journal_key(self.journal_type, row)
+        # Строки упорядочены по убыванию ключа (дата, id)
+        low, high = 0, self.model.rowCount()
+        while low < high:
+            middle = (low + high) // 2
+            if self.db.journal_key(self.journal_type, self.model.row_at(middle)) > key:
+                low = middle + 1
+            else:
+                high = middle
+        source = self.model.source
+        if low == self.model.rowCount() and (self.model.has_more or source is not None and not source.exhausted):
+            return None
+        return low
+
+    def place_row(self, row):
+        # Вставляет сохраненную строку на ее место среди загруженных
+        # вместо перезагрузки всего журнала. Пока открыто окно "Успех",
+        # уведомление об изменении могло уже вставить эту строку, поэтому
+        # существующая строка обновляется, а не добавляется второй раз
+        if row is None:
+            return
+        position = self.model.find_row(row['id'])
+        if position != -1:
+            if self.row_in_view(row) and position == self.insert_position(row):
+                self.model.replace_rows([row])
+                self.table.selectRow(position)
+                return
+            self.model.remove_row(position)
+        if not self.row_in_view(row):
+            return
+        position = self.insert_position(row)
+        if position is None:
+            return
+        self.model.insert_row(position, row)
+        self.table.selectRow(position)
+
+    def data_changed(self, change):
+        if change.table != self.journal_type:
+            # Переименование в справочнике меняет названия в строках журнала.
+            # Без поиска по названию перечитываются только загруженные строки
+            # с этими id; с поиском переименованный товар может добавить
+            # строки на страницу, поэтому она перечитывается целиком
+            if change.ids is None or change.op == "U" and self.filters().get("name"):
+                self.load_data()
+            elif change.op == "U" and self.model.rowCount():
+                generation = self.load_generation
+                run_in_background(
+                    self.db.journal_rows, self.journal_type, [row['id'] for row in self.model.rows],
+                    reference_ids=change.ids,
+                    on_result=lambda rows: self.names_changed(generation, rows),
+                    owner=self,
+                )
+            return
+        if change.ids is None:
+            # Массовое изменение: страница перечитывается целиком
+            self.load_data()
+        elif change.op == "D":
+            self.model.remove_ids(change.ids)
+        else:
+            generation = self.load_generation
+            run_in_background(
+                self.db.journal_rows, self.journal_type, change.ids,
+                on_result=lambda rows: self.rows_changed(generation, change.ids, rows),
+                owner=self,
+            )
+
+    def rows_changed(self, generation, ids, rows):
+        # Страница, перечитанная после запроса строк, уже содержит изменения
+        if generation != self.load_generation:
+            return
+        # Строк, удаленных после уведомления, в ответе нет
+        missing = set(ids) - {row['id'] for row in rows}
+        if missing:
+            self.model.remove_ids(missing)
+        if len(rows) > MAX_ROW_SIGNALS:
+            self.merge_rows(rows)
+            return
+        for row in rows:
+            position = self.model.find_row(row['id'])
+            if position != -1:
+                if self.row_in_view(row) and position == self.insert_position(row):
+                    self.model.replace_row(position, row)
+                    continue
+                self.model.remove_row(position)
+            if self.row_in_view(row):
+                position = self.insert_position(row)
+                if position is not None:
+                    self.model.insert_row(position, row)
+
+    def names_changed(self, generation, rows):
+        # Ключ сортировки (дата, id) не меняется: строки обновляются на месте
+        if generation == self.load_generation:
+            self.model.replace_rows(rows)
+
+    def merge_rows(self, rows):
+        # Измененные строки встают на свои места среди загруженных одним
+        # сбросом модели вместо перезагрузки страницы
+        key = lambda row: self.db.journal_key(self.journal_type, row)
+        changed = {row['id'] for row in rows}
+        kept = [row for row in self.model.rows if row['id'] not in changed]
+        source = self.model.source
+        complete = source is None or source.exhausted
+        last_key = key(kept[-1]) if kept else None
+        for row in rows:
+            row_key = key(row)
+            # Строку ниже загруженной части страницы покажет дальнейшая подгрузка
+            if self.row_in_view(row) and (complete or (last_key is not None and row_key > last_key)):
+                kept.append(row)
+        kept.sort(key=key, reverse=True)
+        self.model.set_rows(kept)
 
     def add_record(self):
         # В зависимости от типа журнала, создаем соответствующую форму для добавления
@@ -93,42 +456,116 @@ class JournalView(QDialog):
         elif self.journal_type == "charges":
             form = ChargesForm(self.db, mode="add")
         if form.exec_():
-            self.load_data()
+            self.place_row(form.saved_row)
 
     def edit_record(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
+        record_ids = self.selected_record_ids()
+        if not record_ids:
             QMessageBox.warning(self, "Ошибка", "Выберите запись для изменения.")
             return
+        if len(record_ids) > 1:
+            self.edit_records(record_ids)
+            return
+        record_id = record_ids[0]
 
-        record_id = self.table.item(selected_row, 0).text()
         if self.journal_type == "sales":
             form = SalesForm(self.db, mode="edit", record_id=record_id)
         elif self.journal_type == "charges":
             form = ChargesForm(self.db, mode="edit", record_id=record_id)
         if form.exec_():
-            self.load_data()
+            self.place_row(form.saved_row)
+
+    def edit_records(self, record_ids):
+        # Одно значение поля для всех выбранных строк одной командой UPDATE
+        form = BulkEditForm(self.db, self.journal_type, len(record_ids))
+        if not form.exec_():
+            return
+        # Изменение тысяч строк вместе с пересчетом дневных итогов идет в
+        # фоне; кнопки изменения заблокированы до его окончания
+        self.set_changing(True)
+        run_in_background(
+            self.db.update_many, self.journal_type, record_ids, form.values,
+            on_result=self.records_updated,
+            on_error=lambda message: self.change_failed("Не удалось изменить записи", message),
+            owner=self,
+        )
+
+    def set_changing(self, changing):
+        for button in (self.add_button, self.edit_button, self.delete_button, self.import_button):
+            button.setEnabled(not changing)
+        self.loading_indicator.setVisible(changing)
+
+    def records_updated(self, rows):
+        self.set_changing(False)
+        self.merge_rows(rows)
+
+    def records_deleted(self, deleted):
+        self.set_changing(False)
+        self.model.remove_ids(deleted)
+
+    def change_failed(self, title, message):
+        self.set_changing(False)
+        QMessageBox.critical(self, "Ошибка", f"{title}: {message}")
 
     def delete_record(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
+        record_ids = self.selected_record_ids()
+        if not record_ids:
             QMessageBox.warning(self, "Ошибка", "Выберите запись для удаления.")
             return
 
-        record_id = self.table.item(selected_row, 0).text()
-        confirm = QMessageBox.question(
-            self, "Удаление", "Вы уверены, что хотите удалить запись?",
-            QMessageBox.Yes | QMessageBox.No
-        )
+        text = ("Вы уверены, что хотите удалить запись?" if len(record_ids) == 1
+                else f"Вы уверены, что хотите удалить выбранные записи ({len(record_ids)})?")
+        confirm = QMessageBox.question(self, "Удаление", text, QMessageBox.Yes | QMessageBox.No)
         if confirm == QMessageBox.Yes:
-            try:
-                if self.journal_type == "sales":
-                    self.db.execute("DELETE FROM sales WHERE id = %s", (record_id,))
-                elif self.journal_type == "charges":
-                    self.db.execute("DELETE FROM charges WHERE id = %s", (record_id,))
-                self.load_data()
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось удалить запись: {e}")
+            # Все выбранные строки удаляются в одной транзакции
+            self.set_changing(True)
+            run_in_background(
+                self.db.delete_many, self.journal_type, record_ids,
+                on_result=self.records_deleted,
+                on_error=lambda message: self.change_failed("Не удалось удалить записи", message),
+                owner=self,
+            )
+
+    def export_csv(self):
+        box = QMessageBox(QMessageBox.Question, "Экспорт", "Какие записи выгрузить?", parent=self)
+        period_button = box.addButton("По текущему фильтру", QMessageBox.AcceptRole)
+        all_button = box.addButton("Весь журнал", QMessageBox.AcceptRole)
+        box.addButton("Отмена", QMessageBox.RejectRole)
+        box.exec_()
+        if box.clickedButton() is period_button:
+            sql, params = self.db.journal_query(self.journal_type, **self.filters())
+        elif box.clickedButton() is all_button:
+            sql, params = self.db.journal_query(self.journal_type)
+        else:
+            return
+        start_export(self, self.db, sql, params, f"{self.journal_type}.csv")
+
+    def import_csv(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, f"Импорт CSV ({IMPORT_HINTS[self.journal_type]})", "", "CSV (*.csv);;Все файлы (*)"
+        )
+        if not path:
+            return
+        self.import_button.setEnabled(False)
+        self.loading_indicator.show()
+        run_in_background(
+            import_csv_file, self.db, self.journal_type, path,
+            on_result=self.import_finished,
+            on_error=self.import_failed,
+            owner=self,
+        )
+
+    def import_finished(self, count):
+        self.import_button.setEnabled(True)
+        self.loading_indicator.hide()
+        QMessageBox.information(self, "Импорт", f"Загружено записей: {count}")
+        # После массовой загрузки страница перечитывается целиком
+        self.load_data()
+
+    def import_failed(self, message):
+        self.import_button.setEnabled(True)
+        self.loading_indicator.hide()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить файл: {message}")
 
 
 class SalesForm(QDialog):
@@ -137,6 +574,7 @@ class SalesForm(QDialog):
         self.db = db
         self.mode = mode
         self.record_id = record_id
+        self.saved_row = None
         self.init_ui()
 
     def init_ui(self):
@@ -147,9 +585,6 @@ class SalesForm(QDialog):
 
         # Поля для продажи
         self.warehouse_combo = QComboBox()
-        warehouses = self.db.query("SELECT id, name FROM warehouses")
-        for warehouse in warehouses:
-            self.warehouse_combo.addItem(warehouse['name'], warehouse['id'])
         layout.addWidget(QLabel("Товар:"))
         layout.addWidget(self.warehouse_combo)
 
@@ -174,24 +609,50 @@ class SalesForm(QDialog):
 
         self.setLayout(layout)
 
+        if async_enabled():
+            # Форма показывается сразу, данные приходят одним ожиданием
+            self.save_button.setEnabled(False)
+            run_async(
+                load_form_data(self.db, "sales", "warehouses", self.record_id if self.mode == "edit" else None),
+                on_result=self.show_form_data,
+                on_error=self.load_failed,
+                owner=self,
+            )
+        else:
+            self.warehouse_combo.setModel(reference_combo_model(self.db, "warehouses"))
+            if self.mode == "edit" and self.record_id:
+                self.load_record()
+
+    def show_form_data(self, result):
+        _, record = result
+        # Справочник уже в общем кэше, модель списка берется из него без запроса
+        self.warehouse_combo.setModel(reference_combo_model(self.db, "warehouses"))
+        self.save_button.setEnabled(True)
         if self.mode == "edit" and self.record_id:
-            self.load_record()
+            self.show_record(record)
 
     def load_record(self):
         try:
-            record = self.db.query("SELECT warehouse_id, sale_date, quantity, amount FROM sales WHERE id = %s", (self.record_id,))
-            if record:
-                self.warehouse_combo.setCurrentIndex(self.warehouse_combo.findData(record[0]['warehouse_id']))
-                self.date_input.setDate(record[0]['sale_date'])
-                self.quantity_input.setText(str(record[0]['quantity']))
-                self.amount_input.setText(str(record[0]['amount']))
-            else:
-                QMessageBox.warning(self, "Ошибка", "Запись не найдена.")
-                self.reject()
+            record = self.db.query(RECORD_QUERIES["sales"], (self.record_id,))
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить запись: {e}")
+            self.load_failed(str(e))
+            return
+        self.show_record(record[0] if record else None)
+
+    def show_record(self, record):
+        if record:
+            self.warehouse_combo.setCurrentIndex(self.warehouse_combo.findData(record['warehouse_id']))
+            self.date_input.setDate(record['sale_date'])
+            self.quantity_input.setText(str(record['quantity']))
+            self.amount_input.setText(str(record['amount']))
+        else:
+            QMessageBox.warning(self, "Ошибка", "Запись не найдена.")
             self.reject()
 
+    def load_failed(self, message):
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить запись: {message}")
+        self.reject()
+
     def handle_save(self):
         warehouse_id = self.warehouse_combo.currentData()
         sale_date = self.date_input.date().toPyDate()
@@ -203,12 +664,15 @@ class SalesForm(QDialog):
             return
 
         try:
+            # Сохраненная строка возвращается журналу для точечного обновления
             if self.mode == "add":
-                self.db.execute("INSERT INTO sales (warehouse_id, sale_date, quantity, amount) VALUES (%s, %s, %s, %s)",
-                                 (warehouse_id, sale_date, quantity, amount))
+                self.saved_row = self.db.write_journal_row(
+                    "sales", "INSERT INTO sales (warehouse_id, sale_date, quantity, amount) VALUES (%s, %s, %s, %s)",
+                    (warehouse_id, sale_date, quantity, amount))
             elif self.mode == "edit" and self.record_id:
-                self.db.execute("UPDATE sales SET warehouse_id = %s, sale_date = %s, quantity = %s, amount = %s WHERE id = %s",
-                                 (warehouse_id, sale_date, quantity, amount, self.record_id))
+                self.saved_row = self.db.write_journal_row(
+                    "sales", "UPDATE sales SET warehouse_id = %s, sale_date = %s, quantity = %s, amount = %s WHERE id = %s",
+                    (warehouse_id, sale_date, quantity, amount, self.record_id))
             QMessageBox.information(self, "Успех", "Запись успешно сохранена.")
             self.accept()
         except Exception as e:
@@ -221,6 +685,7 @@ class ChargesForm(QDialog):
         self.db = db
         self.mode = mode
         self.record_id = record_id
+        self.saved_row = None
         self.init_ui()
 
     def init_ui(self):
@@ -231,9 +696,6 @@ class ChargesForm(QDialog):
 
         # Поля для расхода
         self.expense_item_combo = QComboBox()
-        expense_items = self.db.query("SELECT id, name FROM expense_items")
-        for item in expense_items:
-            self.expense_item_combo.addItem(item['name'], item['id'])
         layout.addWidget(QLabel("Статья расхода:"))
         layout.addWidget(self.expense_item_combo)
 
@@ -253,23 +715,49 @@ class ChargesForm(QDialog):
 
         self.setLayout(layout)
 
+        if async_enabled():
+            # Форма показывается сразу, данные приходят одним ожиданием
+            self.save_button.setEnabled(False)
+            run_async(
+                load_form_data(self.db, "charges", "expense_items", self.record_id if self.mode == "edit" else None),
+                on_result=self.show_form_data,
+                on_error=self.load_failed,
+                owner=self,
+            )
+        else:
+            self.expense_item_combo.setModel(reference_combo_model(self.db, "expense_items"))
+            if self.mode == "edit" and self.record_id:
+                self.load_record()
+
+    def show_form_data(self, result):
+        _, record = result
+        # Справочник уже в общем кэше, модель списка берется из него без запроса
+        self.expense_item_combo.setModel(reference_combo_model(self.db, "expense_items"))
+        self.save_button.setEnabled(True)
         if self.mode == "edit" and self.record_id:
-            self.load_record()
+            self.show_record(record)
 
     def load_record(self):
         try:
-            record = self.db.query("SELECT expense_item_id, charge_date, amount FROM charges WHERE id = %s", (self.record_id,))
-            if record:
-                self.expense_item_combo.setCurrentIndex(self.expense_item_combo.findData(record[0]['expense_item_id']))
-                self.date_input.setDate(record[0]['charge_date'])
-                self.amount_input.setText(str(record[0]['amount']))
-            else:
-                QMessageBox.warning(self, "Ошибка", "Запись не найдена.")
-                self.reject()
+            record = self.db.query(RECORD_QUERIES["charges"], (self.record_id,))
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить запись: {e}")
+            self.load_failed(str(e))
+            return
+        self.show_record(record[0] if record else None)
+
+    def show_record(self, record):
+        if record:
+            self.expense_item_combo.setCurrentIndex(self.expense_item_combo.findData(record['expense_item_id']))
+            self.date_input.setDate(record['charge_date'])
+            self.amount_input.setText(str(record['amount']))
+        else:
+            QMessageBox.warning(self, "Ошибка", "Запись не найдена.")
             self.reject()
 
+    def load_failed(self, message):
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить запись: {message}")
+        self.reject()
+
     def handle_save(self):
         expense_item_id = self.expense_item_combo.currentData()
         charge_date = self.date_input.date().toPyDate()
@@ -280,12 +768,15 @@ class ChargesForm(QDialog):
             return
 
         try:
+            # Сохраненная строка возвращается журналу для точечного обновления
             if self.mode == "add":
-                self.db.execute("INSERT INTO charges (expense_item_id, charge_date, amount) VALUES (%s, %s, %s)",
-                                 (expense_item_id, charge_date, amount))
+                self.saved_row = self.db.write_journal_row(
+                    "charges", "INSERT INTO charges (expense_item_id, charge_date, amount) VALUES (%s, %s, %s)",
+                    (expense_item_id, charge_date, amount))
             elif self.mode == "edit" and self.record_id:
-                self.db.execute("UPDATE charges SET expense_item_id = %s, charge_date = %s, amount = %s WHERE id = %s",
-                                 (expense_item_id, charge_date, amount, self.record_id))
+                self.saved_row = self.db.write_journal_row(
+                    "charges", "UPDATE charges SET expense_item_id = %s, charge_date = %s, amount = %s WHERE id = %s",
+                    (expense_item_id, charge_date, amount, self.record_id))
             QMessageBox.information(self, "Успех", "Запись успешно сохранена.")
             self.accept()
         except Exception as e:
@@ -8,6 +8,7 @@ class RecordForm(QDialog):
         self.mode = mode
         self.record_id = record_id
         self.table_type = table_type
+        self.saved_row = None
         self.init_ui()
 
     def init_ui(self):
@@ -87,19 +88,26 @@ class RecordForm(QDialog):
                 QMessageBox.warning(self, "Ошибка", "Все поля должны быть заполнены.")
                 return
 
+        result = None
         try:
+            # RETURNING отдает сохраненную строку окну справочника для точечного обновления
             if self.mode == "add":
                 if self.table_type == "expense_items":
-                    self.db.execute("INSERT INTO expense_items (name) VALUES (%s)", (name,))
+                    result = self.db.query("INSERT INTO expense_items (name) VALUES (%s) RETURNING id, name", (name,))
                 elif self.table_type == "warehouses":
-                    self.db.execute("INSERT INTO warehouses (name, quantity, amount) VALUES (%s, %s, %s)",
-                                    (name, quantity, amount))
+                    result = self.db.query("INSERT INTO warehouses (name, quantity, amount) VALUES (%s, %s, %s) "
+                                           "RETURNING id, name, quantity, amount",
+                                           (name, quantity, amount))
             elif self.mode == "edit" and self.record_id:
                 if self.table_type == "expense_items":
-                    self.db.execute("UPDATE expense_items SET name = %s WHERE id = %s", (name, self.record_id))
+                    result = self.db.query("UPDATE expense_items SET name = %s WHERE id = %s RETURNING id, name",
+                                           (name, self.record_id))
                 elif self.table_type == "warehouses":
-                    self.db.execute("UPDATE warehouses SET name = %s, quantity = %s, amount = %s WHERE id = %s",
-                                    (name, quantity, amount, self.record_id))
+                    result = self.db.query("UPDATE warehouses SET name = %s, quantity = %s, amount = %s WHERE id = %s "
+                                           "RETURNING id, name, quantity, amount",
+                                           (name, quantity, amount, self.record_id))
+            self.saved_row = result[0] if result else None
+            self.db.invalidate_reference(self.table_type)
 
             QMessageBox.information(self, "Успех", "Запись успешно сохранена.")
             self.accept()
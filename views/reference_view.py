@@ -1,6 +1,25 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QHBoxLayout, QMessageBox
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QTableView, QAbstractItemView, QPushButton, QHBoxLayout, QMessageBox, QLabel
 from PyQt5.QtCore import Qt
 from views.record_form import RecordForm
+from views.bulk_edit_form import BulkEditForm, BULK_FIELDS
+from views.table_model import LazyTableModel
+from views.workers import run_in_background, loading_indicator, watch_changes
+from views.search import debounce_timer, search_input, parse_amount, row_matches
+from db_utils import CancelToken, REFERENCE_AMOUNTS
+
+
+REFERENCE_COLUMNS = {
+    "expense_items": [
+        ("id", "ID", str),
+        ("name", "Наименование", str),
+    ],
+    "warehouses": [
+        ("id", "ID", str),
+        ("name", "Наименование", str),
+        ("quantity", "Количество", str),
+        ("amount", "Стоимость", str),
+    ],
+}
 
 
 class ReferenceView(QDialog):
@@ -18,18 +37,44 @@ class ReferenceView(QDialog):
 
         layout = QVBoxLayout()
 
+        # Поиск выполняется на сервере; без условий строки берутся из общего кэша
+        search_layout = QHBoxLayout()
+        self.name_input = search_input("Наименование")
+        search_layout.addWidget(self.name_input)
+        self.search_fields = [self.name_input]
+        if self.table_type in REFERENCE_AMOUNTS:
+            search_layout.addWidget(QLabel("Стоимость от:"))
+            self.amount_from_input = search_input("", width=80)
+            search_layout.addWidget(self.amount_from_input)
+            search_layout.addWidget(QLabel("до:"))
+            self.amount_to_input = search_input("", width=80)
+            search_layout.addWidget(self.amount_to_input)
+            self.search_fields += [self.amount_from_input, self.amount_to_input]
+        layout.addLayout(search_layout)
+        self.search_timer = debounce_timer(self, self.load_data)
+        for field in self.search_fields:
+            field.textChanged.connect(self.filter_changed)
+
         # Таблица
-        self.table = QTableWidget()
-        if self.table_type == "expense_items":
-            self.table.setColumnCount(2)
-            self.table.setHorizontalHeaderLabels(["ID", "Наименование"])
-        elif self.table_type == "warehouses":
-            self.table.setColumnCount(4)
-            self.table.setHorizontalHeaderLabels(["ID", "Наименование", "Количество", "Стоимость"])
-
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)  # Только просмотр
+        self.model = LazyTableModel(REFERENCE_COLUMNS[self.table_type], parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Несколько строк выделяются для массового изменения и удаления
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Только просмотр
         layout.addWidget(self.table)
 
+        loading_layout = QHBoxLayout()
+        self.loading_indicator = loading_indicator()
+        loading_layout.addWidget(self.loading_indicator)
+        # Долгий поиск можно прервать, не меняя условий, как в журналах
+        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button.clicked.connect(self.cancel_clicked)
+        self.cancel_button.hide()
+        loading_layout.addWidget(self.cancel_button)
+        layout.addLayout(loading_layout)
+
         # Кнопки управления
         button_layout = QHBoxLayout()
         if self.user_role == "admin":
@@ -49,61 +94,207 @@ class ReferenceView(QDialog):
 
         self.setLayout(layout)
 
+        # Номер последнего запроса и отмена выполняющегося, как в журналах
+        self.load_generation = 0
+        self.load_token = None
+
+        # Изменения из других окон и программ приходят уведомлениями
+        self.unwatch_changes = watch_changes(self.db, (self.table_type,), self.data_changed, self)
+
         # Загрузка данных
         self.load_data()
 
+    def filters(self):
+        filters = {"name": self.name_input.text().strip()}
+        if self.table_type in REFERENCE_AMOUNTS:
+            filters["amount_from"] = parse_amount(self.amount_from_input.text())
+            filters["amount_to"] = parse_amount(self.amount_to_input.text())
+        return filters
+
+    def cancel_load(self):
+        self.load_generation += 1
+        self.cancel_button.hide()
+        if self.load_token is not None:
+            # В потоке окна, как в журналах: см. JournalView.cancel_load
+            self.load_token.cancel()
+            self.load_token = None
+
+    def cancel_clicked(self):
+        self.cancel_load()
+        self.loading_indicator.hide()
+
+    def filter_changed(self):
+        self.cancel_load()
+        self.search_timer.start()
+
     def load_data(self):
-        try:
-            if self.table_type == "expense_items":
-                data = self.db.query("SELECT id, name FROM expense_items")
-                self.table.setRowCount(len(data))
-                for row_idx, row in enumerate(data):
-                    self.table.setItem(row_idx, 0, QTableWidgetItem(str(row['id'])))
-                    self.table.setItem(row_idx, 1, QTableWidgetItem(row['name']))
-            elif self.table_type == "warehouses":
-                data = self.db.query("SELECT id, name, quantity, amount FROM warehouses")
-                self.table.setRowCount(len(data))
-                for row_idx, row in enumerate(data):
-                    self.table.setItem(row_idx, 0, QTableWidgetItem(str(row['id'])))
-                    self.table.setItem(row_idx, 1, QTableWidgetItem(row['name']))
-                    self.table.setItem(row_idx, 2, QTableWidgetItem(str(row['quantity'])))
-                    self.table.setItem(row_idx, 3, QTableWidgetItem(str(row['amount'])))
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {e}")
+        self.search_timer.stop()
+        self.cancel_load()
+        generation = self.load_generation
+        self.loading_indicator.show()
+        filters = self.filters()
+        if any(value not in (None, "") for value in filters.values()):
+            self.load_token = token = CancelToken()
+            self.cancel_button.show()
+            run_in_background(
+                self.db.search_reference, self.table_type, token=token, **filters,
+                on_result=lambda data: self.show_data(generation, data),
+                on_error=lambda message: self.show_load_error(generation, message),
+                owner=self,
+            )
+            return
+        # Данные берутся из общего кэша справочников; при промахе запрос
+        # выполняется в фоновом потоке, окно остается отзывчивым
+        run_in_background(
+            self.db.get_reference, self.table_type,
+            on_result=lambda data: self.show_data(generation, data),
+            on_error=lambda message: self.show_load_error(generation, message),
+            owner=self,
+        )
+
+    def show_data(self, generation, data):
+        if generation != self.load_generation:
+            return
+        self.load_token = None
+        self.cancel_button.hide()
+        self.loading_indicator.hide()
+        self.model.set_source(None, data)
+
+    def show_load_error(self, generation, message):
+        if generation != self.load_generation:
+            return
+        self.load_token = None
+        self.cancel_button.hide()
+        self.loading_indicator.hide()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {message}")
+
+    def done(self, result):
+        self.unwatch_changes()
+        self.search_timer.stop()
+        self.cancel_load()
+        super().done(result)
+
+    def row_in_view(self, row):
+        return row_matches(row, "name", **self.filters())
+
+    def data_changed(self, change):
+        if change.ids is None:
+            self.load_data()
+        elif change.op == "D":
+            self.model.remove_ids(change.ids)
+        else:
+            generation = self.load_generation
+            run_in_background(
+                self.db.reference_rows, self.table_type, change.ids,
+                on_result=lambda rows: self.rows_changed(generation, change.ids, rows),
+                owner=self,
+            )
+
+    def rows_changed(self, generation, ids, rows):
+        if generation != self.load_generation:
+            return
+        missing = set(ids) - {row['id'] for row in rows}
+        if missing:
+            self.model.remove_ids(missing)
+        for row in rows:
+            position = self.model.find_row(row['id'])
+            if position != -1 and self.row_in_view(row):
+                self.model.replace_row(position, row)
+            elif position != -1:
+                self.model.remove_row(position)
+            elif self.row_in_view(row):
+                # Строки справочника упорядочены по id
+                position = next((index for index, existing in enumerate(self.model.rows)
+                                 if existing['id'] > row['id']), self.model.rowCount())
+                self.model.insert_row(position, row)
+
+    def selected_record_ids(self):
+        return [self.model.row_at(index.row())['id'] for index in self.table.selectionModel().selectedRows()]
 
     def add_record(self):
         form = RecordForm(self.db, mode="add", table_type=self.table_type)
-        if form.exec_():
-            self.load_data()
+        if form.exec_() and form.saved_row is not None and self.row_in_view(form.saved_row):
+            # Обновляем только сохраненную строку вместо перезагрузки справочника.
+            # Уведомление об изменении могло вставить ее раньше, пока было
+            # открыто окно "Успех": тогда строка обновляется на месте
+            position = self.model.find_row(form.saved_row['id'])
+            if position != -1:
+                self.model.replace_rows([form.saved_row])
+            else:
+                position = self.model.rowCount()
+                self.model.insert_row(position, form.saved_row)
+            self.table.selectRow(position)
 
     def edit_record(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
+        record_ids = self.selected_record_ids()
+        if not record_ids:
             QMessageBox.warning(self, "Ошибка", "Выберите запись для изменения.")
             return
+        if len(record_ids) > 1:
+            self.edit_records(record_ids)
+            return
+        record_id = record_ids[0]
 
-        record_id = self.table.item(selected_row, 0).text()
         form = RecordForm(self.db, mode="edit", record_id=record_id, table_type=self.table_type)
-        if form.exec_():
-            self.load_data()
+        if form.exec_() and form.saved_row is not None:
+            position = self.model.find_row(record_id)
+            if position != -1 and self.row_in_view(form.saved_row):
+                self.model.replace_row(position, form.saved_row)
+            elif position != -1:
+                # Строка больше не подходит под условия поиска
+                self.model.remove_row(position)
+
+    def edit_records(self, record_ids):
+        if self.table_type not in BULK_FIELDS:
+            QMessageBox.warning(self, "Ошибка", "Этот справочник можно изменять только по одной записи.")
+            return
+        form = BulkEditForm(self.db, self.table_type, len(record_ids))
+        if not form.exec_():
+            return
+        # В фоне, как в журналах: см. JournalView.edit_records
+        self.set_changing(True)
+        run_in_background(
+            self.db.update_many, self.table_type, record_ids, form.values,
+            on_result=self.records_updated,
+            on_error=lambda message: self.change_failed("Не удалось изменить записи", message),
+            owner=self,
+        )
+
+    def set_changing(self, changing):
+        for button in (self.add_button, self.edit_button, self.delete_button):
+            button.setEnabled(not changing)
+        self.loading_indicator.setVisible(changing)
+
+    def records_updated(self, rows):
+        self.set_changing(False)
+        self.db.invalidate_reference(self.table_type)
+        self.model.replace_rows(rows)
+
+    def records_deleted(self, deleted):
+        self.set_changing(False)
+        self.db.invalidate_reference(self.table_type)
+        self.model.remove_ids(deleted)
+
+    def change_failed(self, title, message):
+        self.set_changing(False)
+        QMessageBox.critical(self, "Ошибка", f"{title}: {message}")
 
     def delete_record(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
+        record_ids = self.selected_record_ids()
+        if not record_ids:
             QMessageBox.warning(self, "Ошибка", "Выберите запись для удаления.")
             return
 
-        record_id = self.table.item(selected_row, 0).text()
-        confirm = QMessageBox.question(
-            self, "Удаление", "Вы уверены, что хотите удалить запись?",
-            QMessageBox.Yes | QMessageBox.No
-        )
+        text = ("Вы уверены, что хотите удалить запись?" if len(record_ids) == 1
+                else f"Вы уверены, что хотите удалить выбранные записи ({len(record_ids)})?")
+        confirm = QMessageBox.question(self, "Удаление", text, QMessageBox.Yes | QMessageBox.No)
         if confirm == QMessageBox.Yes:
-            try:
-                if self.table_type == "expense_items":
-                    self.db.execute("DELETE FROM expense_items WHERE id = %s", (record_id,))
-                elif self.table_type == "warehouses":
-                    self.db.execute("DELETE FROM warehouses WHERE id = %s", (record_id,))
-                self.load_data()
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось удалить запись: {e}")
+            # Все выбранные строки удаляются в одной транзакции: если на
+            # какую-то из них ссылается журнал, не удаляется ни одна
+            self.set_changing(True)
+            run_in_background(
+                self.db.delete_many, self.table_type, record_ids,
+                on_result=self.records_deleted,
+                on_error=lambda message: self.change_failed("Не удалось удалить записи", message),
+                owner=self,
+            )
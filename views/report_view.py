@@ -1,6 +1,33 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QPushButton, QLabel, QHBoxLayout, QMessageBox, QTableWidget, QTableWidgetItem
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QPushButton, QLabel, QHBoxLayout, QMessageBox, QTableWidget, QTableWidgetItem, QComboBox, QFileDialog
 from PyQt5.QtCore import Qt
-import os
+import csv
+import importlib.util
+from datetime import date, timedelta
+from db_utils import CancelToken
+from views.workers import run_in_background, loading_indicator, watch_changes
+from views.export import start_export
+
+
+# Источники данных для отчетов
+BACKEND_SERVER = "server"
+BACKEND_LOCAL = "local"
+
+
+def current_month():
+    start = date.today().replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def local_profit(cache):
+    # Локальный расчет: догружаем новые строки и считаем по колонкам NumPy
+    cache.sync()
+    return cache.profit_per_period(*current_month(), period="month")
+
+
+def local_top_items(cache):
+    cache.sync()
+    return cache.top_items(limit=5)
 
 
 class ReportView(QDialog):
@@ -19,6 +46,17 @@ class ReportView(QDialog):
         self.label = QLabel("Выберите отчет:")
         layout.addWidget(self.label)
 
+        # Отчет можно посчитать на сервере или по локальной копии данных в NumPy
+        backend_layout = QHBoxLayout()
+        backend_layout.addWidget(QLabel("Источник данных:"))
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("Сервер (дневные итоги)", BACKEND_SERVER)
+        self.backend_combo.addItem("Локально (NumPy)", BACKEND_LOCAL)
+        if importlib.util.find_spec("numpy") is None:
+            self.backend_combo.model().item(1).setEnabled(False)
+        backend_layout.addWidget(self.backend_combo)
+        layout.addLayout(backend_layout)
+
         self.profit_button = QPushButton("Прибыль за месяц")
         self.profit_button.clicked.connect(self.generate_profit_report)
         layout.addWidget(self.profit_button)
@@ -27,6 +65,15 @@ class ReportView(QDialog):
         self.top_items_button.clicked.connect(self.generate_top_items_report)
         layout.addWidget(self.top_items_button)
 
+        loading_layout = QHBoxLayout()
+        self.loading_indicator = loading_indicator()
+        loading_layout.addWidget(self.loading_indicator)
+        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button.clicked.connect(self.cancel_report)
+        self.cancel_button.hide()
+        loading_layout.addWidget(self.cancel_button)
+        layout.addLayout(loading_layout)
+
         # Результаты отчета
         self.result_table = QTableWidget()
         self.result_table.setColumnCount(2)
@@ -40,33 +87,85 @@ class ReportView(QDialog):
         self.setLayout(layout)
 
         self.current_report = []
+        # Запрос последнего отчета: при сохранении он выгружается через COPY
+        self.current_report_query = None
+        # Отмена выполняющегося отчета
+        self.report_token = None
+
+    def run_report(self, compute, build_report, report_query=None):
+        # Отчет считается в фоновом потоке; повторный запуск до получения
+        # результата заблокирован. compute получает CancelToken
+        self.set_loading(True)
+        self.report_token = token = CancelToken()
+        run_in_background(
+            compute, token,
+            on_result=lambda result: self.report_ready(token, report_query, build_report(result)),
+            on_error=lambda message: self.report_failed(token, message),
+            owner=self,
+        )
+
+    def run_server_report(self, report_query, build_report):
+        self.run_report(lambda token: self.db.query_report(*report_query, token=token), build_report, report_query)
+
+    def cancel_report(self):
+        # Запрос прерывается на сервере; ответ на него окно отбросит.
+        # Локальный расчет прервать нельзя, его результат тоже отбрасывается
+        if self.report_token is not None:
+            self.report_token.cancel()
+            self.report_token = None
+        self.set_loading(False)
+
+    def analytics_cache(self):
+        if self.backend_combo.currentData() != BACKEND_LOCAL:
+            return None
+        # numpy импортируется только при выборе локального расчета
+        import analytics
+        cache = analytics.shared_cache(self.db)
+        # Кэш общий для процесса, поэтому подписка без окна-владельца
+        cache.subscribe(lambda tables, callback: watch_changes(self.db, tables, callback, None))
+        return cache
+
+    def set_loading(self, loading):
+        self.loading_indicator.setVisible(loading)
+        self.cancel_button.setVisible(loading)
+        self.profit_button.setEnabled(not loading)
+        self.top_items_button.setEnabled(not loading)
+
+    def report_ready(self, token, report_query, report):
+        if token is not self.report_token:
+            return
+        self.report_token = None
+        self.set_loading(False)
+        self.current_report = report
+        self.current_report_query = report_query
+        self.show_report()
+
+    def report_failed(self, token, message):
+        if token is not self.report_token:
+            return
+        self.report_token = None
+        self.set_loading(False)
+        QMessageBox.critical(self, "Ошибка", f"Не удалось сгенерировать отчет: {message}")
 
     def generate_profit_report(self):
-        try:
-            result = self.db.query("SELECT * FROM calculate_current_month_profit()")
-            self.current_report = [
-                ("Общая выручка", result[0]['total_sales'] if result else 0),
-                ("Общие расходы", result[0]['total_expenses'] if result else 0),
-                ("Прибыль", result[0]['profit'] if result else 0),
-            ]
-            self.show_report()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сгенерировать отчет: {e}")
+        build_report = lambda result: [
+            ("Общая выручка", result[0]['total_sales'] if result else 0),
+            ("Общие расходы", result[0]['total_expenses'] if result else 0),
+            ("Прибыль", result[0]['profit'] if result else 0),
+        ]
+        cache = self.analytics_cache()
+        if cache is not None:
+            self.run_report(lambda token: local_profit(cache), build_report)
+        else:
+            self.run_server_report(self.db.current_month_profit_query(), build_report)
 
     def generate_top_items_report(self):
-        try:
-            result = self.db.query("""
-                SELECT w.name AS item_name, SUM(s.amount * s.quantity) AS total_revenue
-                FROM sales s
-                JOIN warehouses w ON s.warehouse_id = w.id
-                GROUP BY w.name
-                ORDER BY total_revenue DESC
-                LIMIT 5
-            """)
-            self.current_report = [(row['item_name'], row['total_revenue']) for row in result]
-            self.show_report()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сгенерировать отчет: {e}")
+        build_report = lambda result: [(row['item_name'], row['total_revenue']) for row in result]
+        cache = self.analytics_cache()
+        if cache is not None:
+            self.run_report(lambda token: local_top_items(cache), build_report)
+        else:
+            self.run_server_report(self.db.top_items_query(), build_report)
 
     def show_report(self):
         self.result_table.setRowCount(len(self.current_report))
@@ -79,11 +178,20 @@ class ReportView(QDialog):
             QMessageBox.warning(self, "Ошибка", "Нет данных для сохранения.")
             return
 
+        if self.current_report_query is not None:
+            sql, params = self.current_report_query
+            start_export(self, self.db, sql, params, "report.csv")
+            return
+
+        # Отчет посчитан локально: выгружать из базы нечего, сохраняем строки таблицы
+        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить в CSV", "report.csv", "CSV (*.csv)")
+        if not file_path:
+            return
         try:
-            file_path = "report.txt"
-            with open(file_path, "w", encoding="utf-8") as file:
-                for name, value in self.current_report:
-                    file.write(f"{name}: {value}\n")
-            QMessageBox.information(self, "Успех", f"Отчет сохранен в файл: {os.path.abspath(file_path)}")
+            with open(file_path, "w", encoding="utf-8", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["Название", "Значение"])
+                writer.writerows(self.current_report)
+            QMessageBox.information(self, "Успех", f"Отчет сохранен в файл: {file_path}")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить отчет: {e}")
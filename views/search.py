@@ -0,0 +1,48 @@
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QLineEdit
+from decimal import Decimal, InvalidOperation
+
+
+# Пауза после последнего изменения фильтра, после которой уходит запрос
+SEARCH_DELAY_MS = 300
+
+
+def debounce_timer(parent, callback):
+    # Каждое изменение фильтра перезапускает таймер (start), запрос
+    # выполняется один раз, когда пользователь перестал печатать
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.setInterval(SEARCH_DELAY_MS)
+    timer.timeout.connect(callback)
+    return timer
+
+
+def search_input(placeholder, width=None):
+    field = QLineEdit()
+    field.setPlaceholderText(placeholder)
+    field.setClearButtonEnabled(True)
+    if width is not None:
+        field.setFixedWidth(width)
+    return field
+
+
+def parse_amount(text):
+    # Пустое или неполное значение ("12,") не ограничивает выборку.
+    # "nan" и "inf" Decimal принимает, но сравнение с ними в row_matches
+    # выдает InvalidOperation, поэтому они тоже считаются неверным вводом
+    try:
+        value = Decimal(text.strip().replace(",", "."))
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() else None
+
+
+def row_matches(row, name_key, name=None, amount_from=None, amount_to=None):
+    # Та же проверка, что и в запросе, для строк, сохраненных в самом окне
+    if name and name.lower() not in row[name_key].lower():
+        return False
+    if amount_from is not None and row['amount'] < amount_from:
+        return False
+    if amount_to is not None and row['amount'] > amount_to:
+        return False
+    return True
@@ -0,0 +1,196 @@
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from views.workers import run_in_background
+
+
+# Сколько отдельных диапазонов remove_ids удаляет построчными сигналами
+MAX_REMOVE_RANGES = 50
+
+
+class LazyTableModel(QAbstractTableModel):
+    # fetchMore вызывается представлением, поэтому ошибки чтения
+    # передаются окну сигналом, а не исключением
+    fetch_failed = pyqtSignal(str)
+    # Идет ли сейчас чтение очередной порции в фоновом потоке
+    loading_changed = pyqtSignal(bool)
+
+    def __init__(self, columns, chunk_size=500, parent=None):
+        super().__init__(parent)
+        # Описание колонок: список кортежей (ключ, заголовок, функция форматирования)
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.source = None
+        self.fetching = False
+        # Не больше limit строк источника; строка сверх него не показывается,
+        # а означает, что у страницы есть продолжение (has_more).
+        # last_received - последняя показанная строка источника: строки,
+        # добавленные и удаленные уведомлениями, на нее не влияют
+        self.limit = None
+        self.received = 0
+        self.has_more = False
+        self.last_received = None
+
+    def set_source(self, source, rows=(), limit=None):
+        # Новый источник данных: сбрасываем уже загруженные строки,
+        # следующие порции будут запрошены представлением через fetchMore
+        self.beginResetModel()
+        self.close_source()
+        self.limit = limit
+        self.received = 0
+        self.has_more = False
+        self.last_received = None
+        self.rows = self._take(rows)
+        self.source = source
+        self.endResetModel()
+
+    def _take(self, rows):
+        rows = list(rows)
+        if self.limit is not None:
+            room = max(self.limit - self.received, 0)
+            if len(rows) > room:
+                self.has_more = True
+                rows = rows[:room]
+        self.received += len(rows)
+        if rows:
+            self.last_received = rows[-1]
+        return rows
+
+    def close_source(self):
+        if self.source is not None:
+            # Если порция еще читается, курсор закроется после нее, не блокируя окно
+            run_in_background(self.source.close)
+            self.source = None
+        if self.fetching:
+            self.fetching = False
+            self.loading_changed.emit(False)
+
+    def row_at(self, row):
+        return self.rows[row]
+
+    def find_row(self, record_id):
+        for position, row in enumerate(self.rows):
+            if row['id'] == record_id:
+                return position
+        return -1
+
+    def insert_row(self, position, row):
+        self.beginInsertRows(QModelIndex(), position, position)
+        self.rows.insert(position, row)
+        self.endInsertRows()
+
+    def replace_row(self, position, row):
+        self.rows[position] = row
+        self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.columns) - 1))
+
+    def set_rows(self, rows):
+        # Замена загруженных строк без смены источника
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+
+    def replace_rows(self, rows):
+        positions = {row['id']: position for position, row in enumerate(self.rows)}
+        for row in rows:
+            position = positions.get(row['id'])
+            if position is not None:
+                self.replace_row(position, row)
+
+    def remove_ids(self, ids):
+        # Смежные строки удаляются одним диапазоном; при сильно разбросанных
+        # строках дешевле один сброс модели
+        ids = set(ids)
+        positions = [position for position, row in enumerate(self.rows) if row['id'] in ids]
+        ranges = []
+        for position in positions:
+            if ranges and ranges[-1][1] == position - 1:
+                ranges[-1][1] = position
+            else:
+                ranges.append([position, position])
+        if len(ranges) > MAX_REMOVE_RANGES:
+            self.set_rows(row for row in self.rows if row['id'] not in ids)
+            return
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+
+    def remove_row(self, position):
+        self.beginRemoveRows(QModelIndex(), position, position)
+        del self.rows[position]
+        self.endRemoveRows()
+
+    def fetch_all(self, on_done=None):
+        # Дочитывает источник до конца (используется для ограниченных страниц)
+        if self.fetching:
+            return
+        if self.source is None or self.source.exhausted:
+            if on_done is not None:
+                on_done()
+            return
+        self._start_fetch(self.source.fetch_all, on_done)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        key, _, formatter = self.columns[index.column()]
+        value = self.rows[index.row()][key]
+        return formatter(value) if value is not None else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section][1]
+        return section + 1
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.source is not None and not self.source.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._start_fetch(self.source.fetch, None, self.chunk_size)
+
+    def _start_fetch(self, fetch, on_done, *args):
+        source = self.source
+        self.fetching = True
+        self.loading_changed.emit(True)
+        run_in_background(
+            fetch, *args,
+            on_result=lambda rows: self._fetched(source, rows, on_done),
+            on_error=lambda message: self._fetch_error(source, message),
+            owner=self,
+        )
+
+    def _fetched(self, source, rows, on_done):
+        if source is not self.source:
+            # Пока читалась порция, источник сменился
+            return
+        self.fetching = False
+        self.loading_changed.emit(False)
+        rows = self._take(rows)
+        if rows:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+        if on_done is not None:
+            on_done()
+
+    def _fetch_error(self, source, message):
+        if source is not self.source:
+            return
+        self.close_source()
+        self.fetch_failed.emit(message)
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import importlib.util
+import logging
+from PyQt5 import sip
+from PyQt5.QtCore import QObject, QRunnable, QSocketNotifier, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import QProgressBar
+from instrumentation import caller_view, view_context
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    progress = pyqtSignal(object)
+
+
+class QueryWorker(QRunnable):
+    # Выполняет функцию (обычно запрос к базе) в потоке из QThreadPool,
+    # результат возвращается в поток интерфейса через сигналы
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        # Окно, запустившее задачу: по нему группируются замеры запросов
+        self.view = caller_view()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            with view_context(self.view):
+                result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+# Сигналы запущенных задач храним до получения результата, чтобы они
+# не были удалены сборщиком мусора раньше времени
+_active_signals = set()
+
+
+def _deliver(signals, owner, callback, on_orphan=None):
+    def deliver(value):
+        _active_signals.discard(signals)
+        # Окно могло быть закрыто, пока выполнялся запрос: результат,
+        # владеющий ресурсами (например, курсором), отдаем on_orphan
+        if owner is not None and sip.isdeleted(owner):
+            if on_orphan is not None:
+                on_orphan(value)
+            return
+        if callback is not None:
+            callback(value)
+    return deliver
+
+
+def run_in_background(fn, *args, on_result=None, on_error=None, owner=None, on_orphan=None, on_progress=None,
+                      pool=None, **kwargs):
+    # pool - свой QThreadPool вместо общего: общий рассчитан на число ядер,
+    # а задачам, которые ждут базу, нужен поток на каждое соединение
+    worker = QueryWorker(fn, *args, **kwargs)
+    if on_progress is not None:
+        # Функция получает аргумент progress и вызывает его из фонового потока
+        worker.kwargs['progress'] = worker.signals.progress.emit
+        worker.signals.progress.connect(_deliver(None, owner, on_progress))
+    worker.signals.finished.connect(_deliver(worker.signals, owner, on_result, on_orphan))
+    worker.signals.failed.connect(_deliver(worker.signals, owner, on_error))
+    _active_signals.add(worker.signals)
+    (pool or QThreadPool.globalInstance()).start(worker)
+    return worker
+
+
+# Цикл asyncio поверх цикла Qt (qasync), если он установлен при запуске
+_async_loop = None
+
+
+def install_async_loop(app):
+    # Асинхронный доступ к базе требует qasync и psycopg 3; без них окна
+    # используют фоновые потоки
+    global _async_loop
+    if importlib.util.find_spec("qasync") is None or importlib.util.find_spec("psycopg_pool") is None:
+        return None
+    import qasync
+    _async_loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(_async_loop)
+    return _async_loop
+
+
+def async_enabled():
+    return _async_loop is not None
+
+
+def _start_task(coro, view):
+    # Задача копирует контекст при создании: запросы внутри нее относятся к окну view
+    with view_context(view):
+        return asyncio.ensure_future(coro)
+
+
+def run_async(coro, on_result=None, on_error=None, owner=None):
+    # Корутина выполняется в цикле asyncio в потоке интерфейса: ожидание базы
+    # не занимает поток, несколько запросов идут одновременно
+    future = contextvars.copy_context().run(_start_task, coro, caller_view())
+
+    def done(future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            _deliver(None, owner, on_error)(str(error))
+        else:
+            _deliver(None, owner, on_result)(future.result())
+
+    future.add_done_callback(done)
+    return future
+
+
+# Уведомления об изменениях (db_utils.ChangeListener) в цикле событий Qt:
+# QSocketNotifier срабатывает, когда в сокете соединения LISTEN есть данные,
+# опроса по таймеру нет. Соединение открывается при первой подписке
+LISTEN_RETRY_MS = 5000
+# {слушатель: QSocketNotifier}; None - соединение открывается
+_change_notifiers = {}
+
+
+def watch_changes(db, tables, callback, owner):
+    # callback(change) вызывается в потоке интерфейса, пока окно owner
+    # существует. Возвращает функцию отписки
+    # db_utils не импортируется при запуске: окно входа показывается без него
+    from db_utils import JOURNALS, REFERENCE_QUERIES
+    listener = db.changes
+    if listener not in _change_notifiers:
+        # Общие кэши обновляются по тем же уведомлениям раньше окон
+        listener.subscribe(REFERENCE_QUERIES, lambda change: _update_reference_cache(db, change))
+        listener.subscribe((*REFERENCE_QUERIES, *JOURNALS), lambda change: db.report_cache.expire_versions())
+        _start_listening(listener)
+    return listener.subscribe(tables, _deliver(None, owner, callback))
+
+
+def _update_reference_cache(db, change):
+    from db_utils import reference_cache
+    if change.ids is None:
+        # Сброс сразу: окно, которое перечитает справочник, получит новые строки
+        reference_cache.invalidate(change.table)
+    else:
+        run_in_background(reference_cache.apply_change, db, change)
+
+
+def _start_listening(listener, resync=False):
+    _change_notifiers[listener] = None
+    run_in_background(
+        listener.start,
+        on_result=lambda fileno: _listening(listener, fileno, resync),
+        on_error=lambda message: _listen_failed(listener, message),
+    )
+
+
+def _listening(listener, fileno, resync):
+    notifier = QSocketNotifier(fileno, QSocketNotifier.Read)
+    notifier.activated.connect(lambda: _poll_changes(listener))
+    _change_notifiers[listener] = notifier
+    if resync:
+        # Пока соединения не было, уведомления терялись: окна перечитывают данные
+        from db_utils import Change
+        listener.dispatch([Change(table, "T", None) for table in listener.tables()])
+
+
+def _poll_changes(listener):
+    try:
+        listener.poll()
+    except Exception as e:
+        _change_notifiers[listener].setEnabled(False)
+        listener.close()
+        _listen_failed(listener, str(e))
+
+
+def _listen_failed(listener, message):
+    logger.warning("Уведомления об изменениях недоступны: %s", message)
+    QTimer.singleShot(LISTEN_RETRY_MS, lambda: _start_listening(listener, resync=True))
+
+
+def loading_indicator():
+    # Бесконечный индикатор загрузки, показывается на время запроса
+    indicator = QProgressBar()
+    indicator.setRange(0, 0)
+    indicator.setTextVisible(False)
+    indicator.setMaximumHeight(8)
+    indicator.hide()
+    return indicator